@@ -0,0 +1,251 @@
+from typing import BinaryIO, Iterator, List, Optional
+from fractions import Fraction
+import mmap
+import struct
+
+# riff chunk header, four character id and size
+CHUNK = struct.Struct("<4sI")
+# avih, the main header
+AVIH = struct.Struct("<10I4I")
+# strh, the stream header
+STRH = struct.Struct("<4s4sIHHIIIIIIIIhhhh")
+# strf for video, a BITMAPINFOHEADER
+STRF = struct.Struct("<IiiHH4sIiiII")
+# idx1 entry, chunk id, flags, offset from the movi list's type, size
+IDX1 = struct.Struct("<4sIII")
+AVIF_HASINDEX = 0x10
+AVIIF_KEYFRAME = 0x10
+FRAME_ID = b"00dc"
+# a file is ended and the next one started before it grows past this, an
+# avi 1.0 index holds 32 bit offsets and many players stop at 2 GB
+MAX_BYTES = 1 << 30
+
+
+class AviWriter:
+    def __init__(
+        self, path: str, width: int, height: int, fps: float
+    ) -> None:
+        """[writes already compressed jpeg frames into an MJPG avi as they
+        are, so frames can be moved between files without being decoded.
+        the header's counts are filled in on close
+
+        Args:
+            path (str): [file to create]
+            width (int): [frame width]
+            height (int): [frame height]
+            fps (float): [frame rate]
+        """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rate = Fraction(fps).limit_denominator(1001)
+        self.file: BinaryIO = open(path, "wb")
+        self.index = bytearray()
+        self.frames = 0
+        self.largest = 0
+        self.write_headers()
+        # offsets in the index count from the movi list's type
+        self.movi = self.file.tell() - 4
+
+    def write_headers(self) -> None:
+        rate = self.rate
+        avih = AVIH.pack(
+            round(1e6 / rate),
+            0,
+            0,
+            AVIF_HASINDEX,
+            self.frames,
+            0,
+            1,
+            self.largest,
+            self.width,
+            self.height,
+            0,
+            0,
+            0,
+            0,
+        )
+        strh = STRH.pack(
+            b"vids",
+            b"MJPG",
+            0,
+            0,
+            0,
+            0,
+            rate.denominator,
+            rate.numerator,
+            0,
+            self.frames,
+            self.largest,
+            0xFFFFFFFF,
+            0,
+            0,
+            0,
+            self.width,
+            self.height,
+        )
+        strf = STRF.pack(
+            STRF.size,
+            self.width,
+            self.height,
+            1,
+            24,
+            b"MJPG",
+            self.width * self.height * 3,
+            0,
+            0,
+            0,
+            0,
+        )
+        strl = (
+            b"strl"
+            + CHUNK.pack(b"strh", STRH.size)
+            + strh
+            + CHUNK.pack(b"strf", STRF.size)
+            + strf
+        )
+        hdrl = (
+            b"hdrl"
+            + CHUNK.pack(b"avih", AVIH.size)
+            + avih
+            + CHUNK.pack(b"LIST", len(strl))
+            + strl
+        )
+        self.file.seek(0)
+        self.file.write(CHUNK.pack(b"RIFF", 0) + b"AVI ")
+        self.file.write(CHUNK.pack(b"LIST", len(hdrl)) + hdrl)
+        self.file.write(CHUNK.pack(b"LIST", 0) + b"movi")
+
+    @property
+    def size(self) -> int:
+        """[bytes the file will have once closed]"""
+        return self.file.tell() + CHUNK.size + len(self.index)
+
+    def write(self, jpeg) -> None:
+        """[append one frame, a bytes-like holding a whole jpeg]"""
+        length = len(jpeg)
+        offset = self.file.tell() - self.movi
+        self.file.write(CHUNK.pack(FRAME_ID, length))
+        self.file.write(jpeg)
+        if length & 1:
+            self.file.write(b"\0")
+        self.index += IDX1.pack(FRAME_ID, AVIIF_KEYFRAME, offset, length)
+        self.frames += 1
+        self.largest = max(self.largest, length)
+
+    def close(self) -> None:
+        movi_end = self.file.tell()
+        self.file.write(CHUNK.pack(b"idx1", len(self.index)))
+        self.file.write(self.index)
+        end = self.file.tell()
+        self.write_headers()
+        # the sizes of the riff and movi lists, now they are known
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", end - 8))
+        self.file.seek(self.movi - 4)
+        self.file.write(struct.pack("<I", movi_end - self.movi))
+        self.file.close()
+
+
+def frames(path: str) -> Iterator[bytes]:
+    """[every video frame of an avi as stored, in file order, walking the
+    movi lists of the file and of any opendml extensions]"""
+    with open(path, "rb") as file:
+        if not file.seek(0, 2):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            view = memoryview(data)
+            try:
+                yield from walk(view, 0, len(view))
+            finally:
+                view.release()
+
+
+def walk(view: memoryview, start: int, end: int) -> Iterator[bytes]:
+    offset = start
+    while offset + CHUNK.size <= end:
+        chunk_id, size = CHUNK.unpack_from(view, offset)
+        body = offset + CHUNK.size
+        if chunk_id in (b"RIFF", b"LIST"):
+            # riff lists run to the end of the file when a writer was
+            # stopped before it could fill their size in
+            list_end = min(body + size, end) if size else end
+            if bytes(view[body : body + 4]) in (b"AVI ", b"AVIX", b"movi"):
+                yield from walk(view, body + 4, list_end)
+            offset = list_end
+        else:
+            if chunk_id[2:] in (b"dc", b"db") and body + size <= end:
+                # a copy, a view would keep the map from closing
+                yield bytes(view[body : body + size])
+            offset = body + size + (size & 1)
+
+
+def join(
+    parts: List[str],
+    path: str,
+    width: int,
+    height: int,
+    fps: float,
+    max_bytes: int = MAX_BYTES,
+) -> List[str]:
+    """[copy the frames of parts, in order, into one avi at path without
+    decoding them. past max_bytes it goes on in path_2.avi and so on
+
+    Returns:
+        List[str]: [the files written]
+    """
+    written: List[str] = []
+    writer: Optional[AviWriter] = None
+    for part in parts:
+        for frame in frames(part):
+            if writer is None or writer.size + len(frame) > max_bytes:
+                if writer is not None:
+                    writer.close()
+                name = path
+                if written:
+                    stem, dot, ext = path.rpartition(".")
+                    name = f"{stem}_{len(written) + 1}{dot}{ext}"
+                writer = AviWriter(name, width, height, fps)
+                written.append(name)
+            writer.write(frame)
+    if writer is not None:
+        writer.close()
+    return written
+
+
+if __name__ == "__main__":
+    # testing code, joins ten 250 frame parts of 720p jpegs, the cost of
+    # moving a frame
+    import os
+    import tempfile
+    import time
+
+    import cv2
+    import numpy as np
+
+    folder = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    picture = rng.integers(0, 256, (720, 1280, 3), np.uint8)
+    jpeg = cv2.imencode(".jpg", cv2.GaussianBlur(picture, (0, 0), 4))[1]
+    parts = []
+    for num in range(10):
+        parts.append(os.path.join(folder, f"part_{num}.avi"))
+        writer = AviWriter(parts[-1], 1280, 720, 25)
+        for _ in range(250):
+            writer.write(jpeg)
+        writer.close()
+    start = time.perf_counter()
+    out = join(parts, os.path.join(folder, "joined.avi"), 1280, 720, 25)
+    elapsed = time.perf_counter() - start
+    size = sum(os.path.getsize(path) for path in out)
+    capture = cv2.VideoCapture(out[0])
+    count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+    capture.release()
+    print(
+        f"joined 2500 frames, {size / 1e6:.0f} MB, in {elapsed:.2f} s, "
+        f"{elapsed / 2500 * 1e6:.0f} us a frame, {size / elapsed / 1e6:.0f} "
+        f"MB/s. opencv reads {count:.0f} frames"
+    )
+    for path in parts + out:
+        os.remove(path)
+    os.rmdir(folder)
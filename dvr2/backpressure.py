@@ -0,0 +1,285 @@
+from typing import Dict, List, Optional, Sequence
+import logging
+import os
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# one row per stage, written only by the stage: items waiting and room
+# for them, how far behind the newest item it is (ns), when it last
+# reported (monotonic ns), items it let through, items the policy had it
+# shed and items lost before it got to them
+STAGE = np.dtype(
+    [
+        ("depth", "<u8"),
+        ("capacity", "<u8"),
+        ("lag", "<i8"),
+        ("updated", "<i8"),
+        ("passed", "<u8"),
+        ("shed", "<u8"),
+        ("lost", "<u8"),
+    ]
+)
+# the level the policy has set, the only field it writes
+LEVEL = np.dtype("<u8")
+# stage kinds, in the order they are shed. telemetry is never shed
+PREVIEW = "preview"
+RECORD = "record"
+TELEMETRY = "telemetry"
+# level 1 sheds every preview frame, each level above that sheds one in
+# DECIMATE[level - 2] recorded frames as well
+SHED_PREVIEW = 1
+DECIMATE = (4, 3, 2)
+# defaults for the "backpressure" section of config.json
+INTERVAL = 0.25
+# load, the fuller of depth / capacity and lag / max lag, over which the
+# level goes up a step per interval, and under which it comes back down a
+# step per hold seconds
+HIGH = 0.5
+LOW = 0.25
+HOLD_SECONDS = 2.0
+MAX_LAG_SECONDS = 1.0
+# a stage that has not reported for this long is idle, not backed up
+STALE_NS = 2_000_000_000
+
+
+def stage_names(settings: Dict) -> List[str]:
+    """[every stage the board has a row for]"""
+    names = []
+    for camera in settings["cameras"]:
+        names += [f"{camera['name']}_{RECORD}", f"{camera['name']}_{PREVIEW}"]
+    return names
+
+
+class Board:
+    def __init__(
+        self,
+        names: Sequence[str],
+        name: Optional[str] = None,
+        create: bool = True,
+    ) -> None:
+        """[where stages in any process say how backed up they are and
+        read the level the policy has set, a row of STAGE per stage in
+        shared memory]
+
+        Args:
+            names (Sequence[str]): [stage names, from stage_names]
+            name (str, optional): [shared memory block name, made up when
+            creating and None]
+            create (bool): [True for the owner, False to attach]
+        """
+        self.names = list(names)
+        self.shm = shared_memory.SharedMemory(
+            name=name,
+            create=create,
+            size=LEVEL.itemsize + STAGE.itemsize * len(self.names),
+        )
+        self.name = self.shm.name
+        # only the owner unlinks, see shared_mailbox.Mailbox
+        self.owner = create
+        self.owner_pid = os.getpid()
+        self.level_view = np.ndarray((1,), LEVEL, self.shm.buf, 0)
+        self.stages = np.ndarray(
+            (len(self.names),), STAGE, self.shm.buf, LEVEL.itemsize
+        )
+        if create:
+            self.level_view[0] = 0
+            self.stages[...] = 0
+
+    def __reduce__(self):
+        # pass by name so a child process attaches to the same block
+        return (Board, (self.names, self.name, False))
+
+    @property
+    def level(self) -> int:
+        return int(self.level_view[0])
+
+    def stage(self, name: str, kind: str) -> "Stage":
+        return Stage(self, self.names.index(name), kind)
+
+    def close(self) -> None:
+        self.level_view = self.stages = None
+        self.shm.close()
+        if self.owner and os.getpid() == self.owner_pid:
+            self.shm.unlink()
+
+
+class Stage:
+    def __init__(self, board: Board, index: int, kind: str) -> None:
+        """[one stage's row of the board. a row has one writer, the stage
+        itself
+
+        Args:
+            board (Board): [the board, attached by name in a child]
+            index (int): [the stage's row]
+            kind (str): [PREVIEW, RECORD or TELEMETRY, what the policy may
+            shed of it]
+        """
+        self.board = board
+        self.row = board.stages[index : index + 1]
+        self.kind = kind
+
+    def report(self, depth: int, capacity: int, lag: int) -> None:
+        """[how backed up the stage is
+
+        Args:
+            depth (int): [items waiting]
+            capacity (int): [items that can wait before some are lost]
+            lag (int): [age of the item being worked on (ns)]
+        """
+        row = self.row
+        row["depth"] = depth
+        row["capacity"] = capacity
+        row["lag"] = lag
+        row["updated"] = time.monotonic_ns()
+
+    def admit(self, number: int) -> bool:
+        """[whether item number is to be worked on at the level the policy
+        has set, either way it is counted]"""
+        level = self.board.level
+        keep = True
+        if self.kind == PREVIEW:
+            keep = level < SHED_PREVIEW
+        elif self.kind == RECORD and level > SHED_PREVIEW:
+            every = DECIMATE[min(level, len(DECIMATE) + 1) - 2]
+            keep = number % every != every - 1
+        if keep:
+            self.row["passed"] += 1
+        else:
+            self.row["shed"] += 1
+        return keep
+
+    def lose(self, count: int = 1) -> None:
+        """[count items lost without the policy asking, overwritten before
+        the stage got to them]"""
+        self.row["lost"] += count
+
+
+class Policy:
+    def __init__(
+        self, board: Board, settings: Dict, logger: logging.Logger
+    ) -> None:
+        """[decides how much to shed from how backed up the stages are,
+        checked every interval by main. the level goes up a step at a time
+        while any stage is more than high full, so preview goes first,
+        then a growing share of recorded frames. it comes down a step at a
+        time once every stage has been under low for hold seconds
+
+        Args:
+            board (Board): [the stages' board]
+            settings (Dict): [the "backpressure" section of config.json]
+            logger (logging.Logger): [the logger for debug_logging]
+        """
+        self.board = board
+        self.logger = logger
+        self.interval = settings.get("interval", INTERVAL)
+        self.high = settings.get("high", HIGH)
+        self.low = settings.get("low", LOW)
+        self.hold = int(settings.get("hold_seconds", HOLD_SECONDS) * 1e9)
+        self.max_lag = int(
+            settings.get("max_lag_seconds", MAX_LAG_SECONDS) * 1e9
+        )
+        self.max_level = SHED_PREVIEW + len(DECIMATE)
+        self.calm_since = 0
+        self.raised = 0
+        self.lowered = 0
+        self.worst = ""
+
+    def loads(self, now: int) -> np.ndarray:
+        """[each stage's load, 0 for idle stages]"""
+        stages = self.board.stages
+        fill = stages["depth"] / np.maximum(stages["capacity"], 1)
+        lag = np.maximum(stages["lag"], 0) / self.max_lag
+        loads = np.maximum(fill, lag)
+        loads[now - stages["updated"] > STALE_NS] = 0
+        return loads
+
+    def evaluate(self, now: Optional[int] = None) -> int:
+        """[move the level a step if the load calls for it
+
+        Returns:
+            int: [the level now]
+        """
+        now = time.monotonic_ns() if now is None else now
+        loads = self.loads(now)
+        worst = int(np.argmax(loads)) if len(loads) else 0
+        load = float(loads[worst]) if len(loads) else 0.0
+        level = self.board.level
+        if load > self.high:
+            self.calm_since = now
+            if level < self.max_level:
+                level += 1
+                self.raised += 1
+                self.worst = self.board.names[worst]
+                self.logger.warning(
+                    f"backpressure level {level}, {self.worst} at "
+                    f"{load:.0%}"
+                )
+        elif load >= self.low:
+            self.calm_since = now
+        elif level and now - self.calm_since >= self.hold:
+            level -= 1
+            self.lowered += 1
+            self.calm_since = now
+            self.logger.warning(f"backpressure level {level}")
+        self.board.level_view[0] = level
+        return level
+
+    def counters(self) -> Dict:
+        stages = self.board.stages
+        return {
+            "level": self.board.level,
+            "raised": self.raised,
+            "lowered": self.lowered,
+            "worst": self.worst,
+            "stages": {
+                name: {
+                    "depth": int(row["depth"]),
+                    "capacity": int(row["capacity"]),
+                    "lag_ms": int(row["lag"]) / 1e6,
+                    "passed": int(row["passed"]),
+                    "shed": int(row["shed"]),
+                    "lost": int(row["lost"]),
+                }
+                for name, row in zip(self.board.names, stages)
+            },
+        }
+
+
+if __name__ == "__main__":
+    # testing code, a camera at 25 fps into a 16 slot ring read by an
+    # encoder that only manages 15 fps, with and without the policy
+    logger = logging.getLogger("backpressure")
+    logger.setLevel(logging.ERROR)
+    for shedding in (False, True):
+        board = Board(["camera1_record", "camera1_preview"])
+        policy = Policy(board, {}, logger)
+        record = board.stage("camera1_record", RECORD)
+        waiting = 0.0
+        for number in range(25 * 60):
+            now = number * 40_000_000
+            if record.admit(number):
+                waiting += 1
+            if waiting > 16:
+                # overwritten in the ring before the encoder got to it
+                waiting -= 1
+                record.lose()
+            waiting = max(waiting - 0.6, 0.0)
+            record.report(int(waiting), 16, int(waiting * 40_000_000))
+            record.row["updated"] = now
+            if shedding and number % 6 == 0:
+                policy.evaluate(now)
+        counters = policy.counters()["stages"]["camera1_record"]
+        print(
+            f"policy {'on' if shedding else 'off'}: level {board.level}, "
+            f"{counters['shed']} shed, {counters['lost']} lost in the ring, "
+            f"raised {policy.raised} lowered {policy.lowered} times"
+        )
+        count = 100_000
+        start = time.perf_counter()
+        for number in range(count):
+            record.admit(number)
+        elapsed = time.perf_counter() - start
+        board.close()
+    print(f"admit: {elapsed / count * 1e9:.0f} ns")
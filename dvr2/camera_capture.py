@@ -0,0 +1,185 @@
+from typing import Dict, List, Tuple
+import logging
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+
+import frame_ring
+
+# seconds between attempts to open a camera that is not answering
+RECONNECT_WAIT = 5
+
+
+class SyntheticCamera:
+    def __init__(self, camera: Dict) -> None:
+        """[test pattern camera, a gradient that scrolls one pixel a frame
+        with the frame number written in the first 8 bytes, paced at the
+        camera's fps]"""
+        self.interval = 1 / camera["fps"]
+        self.columns = np.arange(camera["width"], dtype=np.uint32)
+        self.number = 0
+        self.next_frame = time.monotonic()
+
+    def opened(self) -> bool:
+        return True
+
+    def read(self, out: np.ndarray) -> bool:
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.next_frame += self.interval
+        out[...] = ((self.columns + self.number) % 256).astype(np.uint8)[
+            None, :, None
+        ]
+        out[0, :8, 0] = np.frombuffer(self.number.to_bytes(8, "little"), "u1")
+        self.number += 1
+        return True
+
+    def release(self) -> None:
+        pass
+
+
+class OpenCVCamera:
+    def __init__(
+        self, source: str, camera: Dict, pace: bool = False, loop: bool = False
+    ) -> None:
+        """[camera read through cv2.VideoCapture, a stream url or a file]
+
+        Args:
+            source (str): [anything cv2.VideoCapture opens]
+            camera (Dict): [the camera's settings]
+            pace (bool): [sleep to the camera's fps, for files]
+            loop (bool): [start again at the end, for files]
+        """
+        self.cap = cv2.VideoCapture(source)
+        self.size = (camera["width"], camera["height"])
+        self.interval = 1 / camera["fps"] if pace else 0
+        self.loop = loop
+        self.next_frame = time.monotonic()
+
+    def opened(self) -> bool:
+        return self.cap.isOpened()
+
+    def read(self, out: np.ndarray) -> bool:
+        if self.interval:
+            delay = self.next_frame - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.next_frame += self.interval
+        # decode straight into the slot when the stream is the slot's size
+        ok, frame = self.cap.read(out)
+        if not ok and self.loop:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.cap.read(out)
+        if not ok:
+            return False
+        if frame.ctypes.data != out.ctypes.data:
+            cv2.resize(frame, self.size, dst=out)
+        return True
+
+    def release(self) -> None:
+        self.cap.release()
+
+
+# builds a camera from its settings, keyed by the camera's "driver"
+DRIVERS = {
+    "hikivision": lambda camera: OpenCVCamera(
+        f"rtsp://{camera['ip']}:{camera['port']}"
+        f"/Streaming/Channels/{camera['id']}",
+        camera,
+    ),
+    "axis": lambda camera: OpenCVCamera(
+        f"rtsp://{camera['ip']}:{camera['port']}/axis-media/media.amp"
+        f"?camera={camera['id']}",
+        camera,
+    ),
+    "file": lambda camera: OpenCVCamera(
+        camera["path"], camera, pace=True, loop=True
+    ),
+    "synthetic": SyntheticCamera,
+}
+
+
+def frame_shape(camera: Dict) -> Tuple[int, int, int]:
+    return (camera["height"], camera["width"], 3)
+
+
+def capture_camera(
+    camera: Dict, ring: frame_ring.FrameRing, stop: multiprocessing.Event
+) -> None:
+    """[capture process, decodes frames from one camera into its ring
+    until stop is set, reopening the camera whenever it drops out]
+
+    Args:
+        camera (Dict): [the camera's settings]
+        ring (frame_ring.FrameRing): [the camera's ring, attached by name]
+        stop (multiprocessing.Event): [set by main to shut down]
+    """
+    logger = logging.getLogger(camera["name"])
+    source = None
+    while not stop.is_set():
+        if source is None:
+            source = DRIVERS[camera["driver"]](camera)
+            if not source.opened():
+                logger.warning(f"{camera['name']} not answering")
+                source.release()
+                source = None
+                stop.wait(RECONNECT_WAIT)
+                continue
+            logger.info(f"{camera['name']} opened")
+        if not source.read(ring.begin()):
+            logger.warning(f"{camera['name']} stopped sending frames")
+            source.release()
+            source = None
+            continue
+        ring.commit(time.time())
+    if source is not None:
+        source.release()
+    ring.close()
+
+
+def start_cameras(
+    settings: Dict, logger: logging.Logger
+) -> Tuple[List, List, multiprocessing.Event]:
+    """[one frame ring and one capture process per configured camera]
+
+    Returns:
+        Tuple[List, List, multiprocessing.Event]: [rings, processes and the
+        event that stops them, in settings["cameras"] order]
+    """
+    stop = multiprocessing.Event()
+    rings = []
+    processes = []
+    for camera in settings["cameras"]:
+        ring = frame_ring.FrameRing(camera["ring_slots"], frame_shape(camera))
+        process = multiprocessing.Process(
+            name=camera["name"],
+            target=capture_camera,
+            args=(camera, ring, stop),
+            daemon=True,
+        )
+        process.start()
+        rings.append(ring)
+        processes.append(process)
+        logger.info(f"capture process started for {camera['name']}")
+    return rings, processes, stop
+
+
+def stop_cameras(
+    rings: List,
+    processes: List,
+    stop: multiprocessing.Event,
+    logger: logging.Logger,
+) -> None:
+    stop.set()
+    for process in processes:
+        process.join(timeout=RECONNECT_WAIT + 1)
+        if process.is_alive():
+            # stuck opening a stream, nothing to lose by killing it
+            process.terminate()
+            process.join()
+        logger.debug(f"SHUTTING DOWN: {process.name} capture stopped")
+    for ring in rings:
+        ring.close()
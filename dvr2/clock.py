@@ -0,0 +1,86 @@
+from typing import Optional, Tuple
+import socket
+import struct
+import sys
+import time
+
+# the clock packets are stamped with: the monotonic clock, shifted so it
+# reads as the wall clock did at the anchor. it never steps when the wall
+# clock is set, and within a session it is still the wall clock for display
+
+# linux numbers, missing from the socket module
+SO_TIMESTAMPNS: Optional[int] = getattr(
+    socket, "SO_TIMESTAMPNS", 35 if sys.platform.startswith("linux") else None
+)
+# a struct timespec, two native longs
+TIMESPEC = struct.Struct("@ll")
+ANCILLARY_SIZE = socket.CMSG_SPACE(TIMESPEC.size)
+
+
+def anchor(reads: int = 5) -> Tuple[int, int]:
+    """[wall and monotonic clock (ns) read together, the pair read closest
+    together out of a few]"""
+    best = None
+    for _ in range(reads):
+        before = time.monotonic_ns()
+        wall = time.time_ns()
+        after = time.monotonic_ns()
+        if best is None or after - before < best[0]:
+            best = (after - before, wall, (before + after) // 2)
+    return best[1], best[2]
+
+
+ANCHOR = anchor()
+# added to the monotonic clock to get a timestamp
+OFFSET = ANCHOR[0] - ANCHOR[1]
+
+
+def now_ns() -> int:
+    return time.monotonic_ns() + OFFSET
+
+
+def set_anchor(wall: int, monotonic: int) -> None:
+    """[take on another process's anchor, the monotonic clock is shared by
+    every process on the machine so both then stamp on the same clock]"""
+    global ANCHOR, OFFSET
+    ANCHOR = (wall, monotonic)
+    OFFSET = wall - monotonic
+
+
+def kernel_shift() -> int:
+    """[added to a kernel receive timestamp (wall clock) to put it on the
+    monotonic clock, good for as long as the wall clock is not set]"""
+    return now_ns() - time.time_ns()
+
+
+def kernel_timestamps(sock: socket.socket) -> bool:
+    """[ask for every datagram's kernel receive time, it comes as a
+    TIMESPEC in recvmsg's ancillary data
+
+    Returns:
+        bool: [False where there are no kernel timestamps]
+    """
+    if SO_TIMESTAMPNS is None:
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+    except OSError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    # testing code
+    count = 100_000
+    for name, fn in (
+        ("time.time", time.time),
+        ("time.time_ns", time.time_ns),
+        ("now_ns", now_ns),
+        ("kernel_shift", kernel_shift),
+    ):
+        start = time.perf_counter()
+        for _ in range(count):
+            fn()
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / count * 1e9:.0f} ns")
+    print(f"anchor {ANCHOR}, wall clock ahead by {-kernel_shift()} ns")
@@ -1,12 +1,51 @@
+from typing import Dict, Optional, Tuple
 import logging
+import queue
 import time
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import (
+    QueueHandler,
+    QueueListener,
+    TimedRotatingFileHandler,
+)
 import datetime
 from pathlib import Path
 
+import disk_writer
 
-def get_new_log_file_name(folder: str, prefix: str, ext: str):
-    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+# records waiting for the listener before new ones are dropped, so a stuck
+# disk or terminal costs log lines rather than memory or a blocked caller
+QUEUE_SIZE = 100_000
+# newest name given out for each folder and prefix, see file_time
+ISSUED: Dict[Tuple[str, str], datetime.datetime] = {}
+
+
+def file_time(
+    key: Tuple[str, str], when: Optional[datetime.datetime] = None
+) -> str:
+    """[the time part of a rotated file's or a session's name, to the
+    millisecond. the names given out for a key only move forwards, two
+    asked for in the same millisecond are a millisecond apart
+
+    Args:
+        key (Tuple[str, str]): [the folder and prefix named]
+        when (datetime.datetime, optional): [the time named, now if None]
+    ]"""
+    when = datetime.datetime.now() if when is None else when
+    when = when.replace(microsecond=when.microsecond // 1000 * 1000)
+    last = ISSUED.get(key)
+    if last is not None and when <= last:
+        when = last + datetime.timedelta(milliseconds=1)
+    ISSUED[key] = when
+    return f"{when:%Y-%m-%d_%H%M%S}{when.microsecond // 1000:03d}"
+
+
+def get_new_log_file_name(
+    folder: str,
+    prefix: str,
+    ext: str,
+    when: Optional[datetime.datetime] = None,
+):
+    timestamp = file_time((folder, prefix), when)
     folder = folder.replace(" ", "_")
     Path(folder).mkdir(parents=True, exist_ok=True)
     file_path = Path(folder)
@@ -15,7 +54,62 @@ def get_new_log_file_name(folder: str, prefix: str, ext: str):
     return file_name
 
 
-def init_logger(name: str, level: str, log_file_name: str) -> logging.Logger:
+class AsyncQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue) -> None:
+        """[puts records on the listener's queue without formatting them and
+        without ever waiting, a full queue drops the record]"""
+        super().__init__(log_queue)
+        self.dropped = 0
+        self.listener: LogListener
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the listener is a thread in this process, so the record can go
+        # as it is and the message is only formatted if it gets written
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def rotate(self, log_file_name: str) -> None:
+        """[ask the listener to move to a new log file, the old file is
+        closed and the new one opened on the listener thread]"""
+        marker = logging.makeLogRecord({"rotate_to": log_file_name})
+        # a rotation must not be dropped, wait for room if need be
+        self.queue.put(marker)
+
+
+class LogListener(QueueListener):
+    def handle(self, record: logging.LogRecord) -> None:
+        log_file_name = getattr(record, "rotate_to", None)
+        if log_file_name is None:
+            super().handle(record)
+            return
+        handlers = list(self.handlers)
+        for idx, handler in enumerate(handlers):
+            if isinstance(handler, logging.FileHandler):
+                file_handler = disk_writer.LogFileHandler(log_file_name)
+                file_handler.setFormatter(handler.formatter)
+                handler.close()
+                handlers[idx] = file_handler
+        self.handlers = tuple(handlers)
+
+
+def init_logger(
+    name: str, level: str, log_file_name: str, asynchronous: bool = False
+) -> logging.Logger:
+    """[logger writing to log_file_name and the console
+
+    Args:
+        name (str): [logger name]
+        level (str): ["info", "debug" or "warning"]
+        log_file_name (str): [file to log to]
+        asynchronous (bool): [hand records to a listener thread that does
+        the formatting and writing, so logging never blocks the caller.
+        call stop_logger to flush it]
+    ]"""
 
     logger = logging.getLogger(name)
 
@@ -32,8 +126,9 @@ def init_logger(name: str, level: str, log_file_name: str) -> logging.Logger:
     formatter = logging.Formatter(
         "%(relativeCreated)7d,%(asctime)s,[%(levelname)s], NM:%(name)s, PID:%(processName)s, THR:%(threadName)s, MOD:%(module)s, MSG:%(message)s"
     )
-    # print to file @ cwd
-    file_handler = logging.FileHandler(log_file_name)
+    # print to file @ cwd, lines are gathered and written in large chunks
+    # by a writer thread rather than flushed one at a time
+    file_handler = disk_writer.LogFileHandler(log_file_name)
     # file_handler = TimedRotatingFileHandler(
     #     "log/debug.log", when="s", interval=10
     # )
@@ -41,25 +136,94 @@ def init_logger(name: str, level: str, log_file_name: str) -> logging.Logger:
     # print to console
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
+    if asynchronous:
+        queue_handler = AsyncQueueHandler(queue.Queue(maxsize=QUEUE_SIZE))
+        queue_handler.listener = LogListener(
+            queue_handler.queue, file_handler, stream_handler
+        )
+        queue_handler.listener.start()
+        logger.addHandler(queue_handler)
+        return logger
     logger.addHandler(file_handler)
     logger.addHandler(stream_handler)
     return logger
 
 
+def stop_logger(logger: logging.Logger) -> None:
+    """[write out everything queued and stop the listener, if any]"""
+    for handler in logger.handlers[:]:
+        if isinstance(handler, AsyncQueueHandler):
+            handler.listener.stop()
+            for listener_handler in handler.listener.handlers:
+                listener_handler.close()
+            logger.removeHandler(handler)
+
+
+def dropped(logger: logging.Logger) -> int:
+    """[records the logger's queue had no room for]"""
+    return sum(
+        handler.dropped
+        for handler in logger.handlers
+        if isinstance(handler, AsyncQueueHandler)
+    )
+
+
 def update_handler(
     logger: logging.Logger, log_file_name: str
 ) -> logging.Logger:
     for handler in logger.handlers[:]:
-        if isinstance(handler, logging.FileHandler):
+        if isinstance(handler, AsyncQueueHandler):
+            handler.rotate(log_file_name)
+        elif isinstance(handler, logging.FileHandler):
             formatter = logger.handlers[0].formatter
             logger.removeHandler(handler)
-            file_handler = logging.FileHandler(log_file_name)
+            handler.close()
+            file_handler = disk_writer.LogFileHandler(log_file_name)
             file_handler.setFormatter(formatter)
             logger.addHandler(file_handler)
     return logger
 
 
+def measure_overhead(count: int = 20_000) -> None:
+    """[time a get_packets style log line per packet, logging straight to
+    file and console versus through the queue. it is the calling thread's
+    own cpu time that is measured, which leaves out the listener's work.
+    the console goes to /dev/null so a terminal's speed does not decide
+    the result]"""
+    import contextlib
+    import os
+    import sys
+
+    packet = b"2021-09-22 14:32:07,3.471,11.447,28.111,TASK: I'm the real Batman"
+    for asynchronous in (False, True):
+        log_name = get_new_log_file_name("test/overhead", "debug", "log")
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stderr(
+            devnull
+        ):
+            logger = init_logger(
+                f"overhead_{asynchronous}", "debug", log_name, asynchronous
+            )
+            start = time.thread_time()
+            for _ in range(count):
+                logger.info(
+                    "data_packet from %s on port %s: %s",
+                    ("127.0.0.1", 50000),
+                    20001,
+                    packet,
+                )
+                logger.debug("data put in mb%d", 0)
+            elapsed = time.thread_time() - start
+            stop_logger(logger)
+        mode = "queue" if asynchronous else "inline"
+        print(
+            f"{mode:>6}: {elapsed / count * 1e6:.1f} us per packet",
+            file=sys.stdout,
+        )
+
+
 if __name__ == "__main__":
+    measure_overhead()
+
     log_name = get_new_log_file_name("test/pr2", "debug", "log")
     logger = init_logger(__name__, "debug", log_name)
 
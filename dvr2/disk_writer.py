@@ -0,0 +1,362 @@
+from typing import Callable, Deque, Dict, Optional
+from collections import deque
+import ctypes
+import ctypes.util
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import stats
+
+# defaults for the "disk" section of config.json
+# size, and alignment, of every write but the last of a file
+CHUNK_BYTES = 1 << 20
+# bytes handed over but not written yet before write waits for the disk
+QUEUE_BYTES = 64 << 20
+# most disk space reserved ahead of the writes, so a file is laid out in
+# long runs even with several files growing at once. a reservation is as
+# big as the file so far, at least a chunk, so small files reserve little
+PREALLOCATE_BYTES = 64 << 20
+# fdatasync after this many bytes or seconds, 0 for only on close
+FSYNC_BYTES = 32 << 20
+FSYNC_SECONDS = 5.0
+# a part chunk is written out once it is this old, so a quiet file, like
+# the debug log, is still readable as it goes
+FLUSH_SECONDS = 1.0
+FALLOC_FL_KEEP_SIZE = 1
+
+
+def load_fallocate():
+    """[libc's fallocate, None where there is none (not linux)]"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fallocate = libc.fallocate64
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [
+        ctypes.c_int,
+        ctypes.c_int,
+        ctypes.c_int64,
+        ctypes.c_int64,
+    ]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+FALLOCATE = load_fallocate()
+# open writers, for the stats, and totals of the closed ones
+WRITERS: Dict[int, "DiskWriter"] = {}
+CLOSED = {"files": 0, "written": 0, "stalls": 0}
+
+
+def preallocate(fd: int, offset: int, length: int) -> bool:
+    """[reserve disk space without changing the file's size, readers of a
+    file still being written see no zeros past its end]"""
+    if FALLOCATE is None:
+        return False
+    return FALLOCATE(fd, FALLOC_FL_KEEP_SIZE, offset, length) == 0
+
+
+class DiskWriter:
+    def __init__(
+        self,
+        path: str,
+        disk: Optional[Dict] = None,
+        append: bool = False,
+        exclusive: bool = False,
+    ) -> None:
+        """[a file written by its own thread. small writes are gathered
+        into chunks of chunk_bytes, each written at its aligned offset in
+        one pwrite, behind space reserved ahead of it, and what is left of
+        the reservation is given back on close. fdatasync runs every
+        fsync_bytes or fsync_seconds and on close. write only waits when
+        queue_bytes are already waiting for the disk
+
+        Args:
+            path (str): [file to create]
+            disk (Dict, optional): [the "disk" section of config.json]
+            append (bool): [carry on from the end of an existing file]
+            exclusive (bool): [raise FileExistsError rather than truncate
+            an existing file]
+        ]"""
+        disk = disk or {}
+        self.path = path
+        self.chunk_bytes = disk.get("chunk_bytes", CHUNK_BYTES)
+        self.queue_bytes = disk.get("queue_bytes", QUEUE_BYTES)
+        self.preallocate_bytes = disk.get(
+            "preallocate_bytes", PREALLOCATE_BYTES
+        )
+        self.fsync_bytes = disk.get("fsync_bytes", FSYNC_BYTES)
+        self.fsync_seconds = disk.get("fsync_seconds", FSYNC_SECONDS)
+        self.flush_seconds = disk.get("flush_seconds", FLUSH_SECONDS)
+        flags = os.O_WRONLY | os.O_CREAT
+        if exclusive:
+            flags |= os.O_EXCL
+        elif not append:
+            flags |= os.O_TRUNC
+        self.fd = os.open(path, flags, 0o644)
+        # bytes not handed over yet, they start at offset in the file
+        self.buffer = bytearray()
+        self.offset = os.fstat(self.fd).st_size
+        # length of the buffer when it was last flushed, and when bytes
+        # past that came in
+        self.flushed = 0
+        self.buffered_at = 0.0
+        self.lock = threading.Lock()
+        self.space = threading.Condition(self.lock)
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.queued = 0
+        self.max_queued = 0
+        # times write had to wait for the disk to catch up
+        self.stalls = 0
+        self.written = 0
+        self.fsyncs = 0
+        self.allocated = self.offset
+        # whether space past the end of the file has been reserved
+        self.reserved = False
+        # pwrite and fdatasync times, from the writer thread, folded into
+        # the histograms when the stats are read
+        self.pending: Deque = deque()
+        self.stats_lock = threading.Lock()
+        self.write_ns = stats.Histogram()
+        self.fsync_ns = stats.Histogram()
+        self.thread = threading.Thread(
+            name=f"disk_writer {os.path.basename(path)}",
+            target=self.run,
+            daemon=True,
+        )
+        self.thread.start()
+        WRITERS[id(self)] = self
+
+    def put(self, item, size: int) -> None:
+        # called with the lock held, the wait lets go of it
+        if self.queued and self.queued + size > self.queue_bytes:
+            self.stalls += 1
+            while self.queued and self.queued + size > self.queue_bytes:
+                self.space.wait()
+        self.queued += size
+        self.max_queued = max(self.max_queued, self.queued)
+        self.queue.put(item)
+
+    def full(self, size: int) -> bool:
+        """[whether handing over size more bytes would wait for the disk]"""
+        with self.lock:
+            return bool(self.queued) and self.queued + size > self.queue_bytes
+
+    def write(self, data) -> None:
+        """[append data, a bytes-like that is copied before this returns]"""
+        with self.lock:
+            if len(self.buffer) == self.flushed:
+                self.buffered_at = time.monotonic()
+            self.buffer += data
+            if len(self.buffer) < self.chunk_bytes:
+                return
+            size = len(self.buffer) // self.chunk_bytes * self.chunk_bytes
+            self.put((self.offset, bytes(self.buffer[:size])), size)
+            del self.buffer[:size]
+            self.offset += size
+            self.flushed = 0
+
+    def flush(self) -> None:
+        """[hand over the part chunk too. it stays buffered and is written
+        again, whole, at the same offset once it fills]"""
+        with self.lock:
+            if len(self.buffer) != self.flushed:
+                data = bytes(self.buffer)
+                self.put((self.offset, data), len(data))
+                self.flushed = len(data)
+
+    def call(self, fn: Callable[[], None]) -> None:
+        """[run fn on the writer thread once everything written before
+        has been handed to the disk]"""
+        with self.lock:
+            self.queue.put(fn)
+
+    def run(self) -> None:
+        unsynced = 0
+        synced_at = time.monotonic()
+        end = 0
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+                if len(self.buffer) != self.flushed and (
+                    time.monotonic() - self.buffered_at >= self.flush_seconds
+                ):
+                    # nothing is queued, so this cannot wait on itself
+                    self.flush()
+            if item is None:
+                if unsynced and self.fsync_seconds and (
+                    time.monotonic() - synced_at >= self.fsync_seconds
+                ):
+                    self.sync()
+                    unsynced = 0
+                    synced_at = time.monotonic()
+                continue
+            if callable(item):
+                item()
+                continue
+            if isinstance(item, str):
+                break
+            offset, data = item
+            end = max(end, offset + len(data))
+            while end > self.allocated - self.chunk_bytes:
+                reserve = min(
+                    self.preallocate_bytes,
+                    max(self.chunk_bytes, self.allocated),
+                )
+                if reserve and preallocate(self.fd, self.allocated, reserve):
+                    self.allocated += reserve
+                    self.reserved = True
+                else:
+                    self.allocated = end + self.chunk_bytes
+            start = time.perf_counter_ns()
+            os.pwrite(self.fd, data, offset)
+            self.pending.append((False, time.perf_counter_ns() - start))
+            self.written += len(data)
+            unsynced += len(data)
+            if (self.fsync_bytes and unsynced >= self.fsync_bytes) or (
+                self.fsync_seconds
+                and time.monotonic() - synced_at >= self.fsync_seconds
+            ):
+                self.sync()
+                unsynced = 0
+                synced_at = time.monotonic()
+            with self.lock:
+                self.queued -= len(data)
+                self.space.notify_all()
+        if self.reserved:
+            # blocks reserved past the end stay the file's until it is
+            # cut back to its own size, unseen by st_size
+            os.ftruncate(self.fd, os.fstat(self.fd).st_size)
+        self.sync()
+        os.close(self.fd)
+
+    def sync(self) -> None:
+        start = time.perf_counter_ns()
+        os.fdatasync(self.fd)
+        self.pending.append((True, time.perf_counter_ns() - start))
+        self.fsyncs += 1
+
+    def close(self) -> None:
+        """[write everything out, fdatasync and close]"""
+        self.flush()
+        with self.lock:
+            self.queue.put("close")
+        self.thread.join()
+        WRITERS.pop(id(self), None)
+        CLOSED["files"] += 1
+        CLOSED["written"] += self.written
+        CLOSED["stalls"] += self.stalls
+
+    def counters(self) -> Dict:
+        with self.stats_lock:
+            rows = [self.pending.popleft() for _ in range(len(self.pending))]
+            if rows:
+                times = np.array(rows, dtype=np.int64)
+                syncs = times[:, 0] == 1
+                if (~syncs).any():
+                    self.write_ns.record(times[~syncs, 1])
+                if syncs.any():
+                    self.fsync_ns.record(times[syncs, 1])
+            return {
+                "written": self.written,
+                "queued": self.queued,
+                "max_queued": self.max_queued,
+                "stalls": self.stalls,
+                "fsyncs": self.fsyncs,
+                "write_ns": self.write_ns.summary(),
+                "fsync_ns": self.fsync_ns.summary(),
+            }
+
+
+def counters() -> Dict:
+    """[every open writer's counters, by file, and totals of the closed
+    ones]"""
+    out = {
+        os.path.basename(writer.path): writer.counters()
+        for writer in list(WRITERS.values())
+    }
+    out["closed"] = dict(CLOSED)
+    return out
+
+
+class TextStream:
+    def __init__(self, writer: DiskWriter, encoding: str = "utf-8") -> None:
+        """[the file interface logging.FileHandler wants, on a DiskWriter.
+        flush does nothing, a record is on disk within flush_seconds
+        rather than after every line]"""
+        self.writer = writer
+        self.encoding = encoding
+
+    def write(self, text: str) -> None:
+        self.writer.write(text.encode(self.encoding))
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class LogFileHandler(logging.FileHandler):
+    """[logging.FileHandler writing through a DiskWriter]"""
+
+    def _open(self):
+        # python 3.10 on passes "locale" for no encoding
+        encoding = self.encoding
+        if encoding in (None, "locale"):
+            encoding = "utf-8"
+        # a log grows slowly and rotates often, nothing is reserved
+        writer = DiskWriter(
+            self.baseFilename,
+            {"preallocate_bytes": 0},
+            append="a" in self.mode,
+        )
+        return TextStream(writer, encoding)
+
+
+if __name__ == "__main__":
+    # testing code, four files, like cameras and inputs recording at once,
+    # written a small record at a time straight to the file and through
+    # DiskWriter. run it against the recording disk, the folder is argv[1]
+    import sys
+
+    folder = sys.argv[1] if len(sys.argv) > 1 else "."
+    record = b"x" * 200
+    count = 50_000
+    files = 4
+    paths = [
+        os.path.join(folder, f"disk_test_{num}.bin") for num in range(files)
+    ]
+    for mode in ("direct", "writer"):
+        start = time.perf_counter()
+        if mode == "direct":
+            outs = [open(path, "wb", buffering=0) for path in paths]
+        else:
+            outs = [DiskWriter(path) for path in paths]
+        for _ in range(count):
+            for out in outs:
+                out.write(record)
+        writes = count * files
+        for out in outs:
+            if mode == "direct":
+                os.fdatasync(out.fileno())
+            else:
+                out.flush()
+                writes = out.counters()["write_ns"]["count"] * files
+            out.close()
+        elapsed = time.perf_counter() - start
+        total = count * files * len(record)
+        print(
+            f"{mode}: {total / elapsed / 1e6:.0f} MB/s, "
+            f"{elapsed / count / files * 1e9:.0f} ns/record, "
+            f"{writes} writes to disk"
+        )
+    for path in paths:
+        os.remove(path)
@@ -0,0 +1,391 @@
+from typing import Callable, Dict, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+import argparse
+import datetime
+import json
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+
+import avi
+import overlay_decoder
+import overlay_renderer
+import session_index
+import telemetry_sync
+
+# defaults for the "export" section of config.json
+FOLDER = "exports"
+# recorded seconds in a chunk, each chunk is one job in the pool
+CHUNK_SECONDS = 30
+QUALITY = 90
+# the export's plan and what is done, in its folder, for resuming
+PLAN = "plan.json"
+
+
+def plan(
+    segments: List[session_index.Segment],
+    ranges: List[Tuple[int, int]],
+    chunk_frames: int,
+) -> List[Dict]:
+    """[cut the camera's frames in each time range into chunks that can
+    be exported on their own. a chunk never spans two segments, its frames
+    are a run of one file
+
+    Args:
+        segments (List[session_index.Segment]): [the camera's segments,
+        in time order]
+        ranges (List[Tuple[int, int]]): [start and end (ns) of each part
+        of the session wanted]
+        chunk_frames (int): [most frames in a chunk]
+
+    Returns:
+        List[Dict]: [per range, its start and end and its chunks. a chunk
+        is its segment, first frame in it and count, and which of the
+        camera's frames, counted across segments, it holds]
+    """
+    times = [segment.index["timestamp"] for segment in segments]
+    # where each segment's frames start, counted across segments
+    bases = np.cumsum([0] + [len(column) for column in times])
+    out = []
+    for start, end in ranges:
+        chunks = []
+        for segment, column, base in zip(segments, times, bases):
+            low = int(np.searchsorted(column, start, "left"))
+            high = int(np.searchsorted(column, end, "right"))
+            for first in range(low, high, chunk_frames):
+                count = min(chunk_frames, high - first)
+                position = int(segment.index["position"][first])
+                frames = int(base) + first
+                chunks.append(
+                    {
+                        "number": len(chunks),
+                        "segment": str(segment.path),
+                        "first": position,
+                        "count": count,
+                        "frames": [frames, frames + count],
+                    }
+                )
+        out.append({"start": start, "end": end, "chunks": chunks})
+    return out
+
+
+def init_worker() -> None:
+    # each worker has a core, opencv's own threads would only fight
+    cv2.setNumThreads(1)
+
+
+def export_chunk(
+    chunk: Dict,
+    path: str,
+    samples: np.ndarray,
+    valid: np.ndarray,
+    overlay: Dict,
+    texts: List[str],
+    video: Tuple[int, int, float],
+    quality: int,
+) -> Tuple[str, int, float]:
+    """[pool job, decodes a chunk's frames, burns their telemetry in and
+    writes them as jpegs into an avi of their own. the file only gets its
+    name once it is whole, so an interrupted export redoes this chunk and
+    no other
+
+    Args:
+        chunk (Dict): [the chunk, out of plan]
+        path (str): [the chunk's file]
+        samples (np.ndarray): [a record per frame, out of SessionSync]
+        valid (np.ndarray): [whether each frame has a record]
+        overlay (Dict): [the "overlay" section of config.json]
+        texts (List[str]): [the texts the samples' codes index, see
+        overlay_decoder.renumber_texts]
+        video (Tuple[int, int, float]): [width, height and fps]
+        quality (int): [jpeg quality]
+
+    Returns:
+        Tuple[str, int, float]: [path, frames written and seconds taken]
+    """
+    started = time.perf_counter()
+    logger = logging.getLogger("export")
+    # text codes in the samples index the session decoder's table
+    decoder = overlay_decoder.OverlayDecoder(
+        dict(overlay, rate=1, buffer_seconds=1), logger
+    )
+    decoder.texts = texts
+    width, height, fps = video
+    renderer = overlay_renderer.OverlayRenderer(
+        overlay, decoder, (height, width, 3)
+    )
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    part = f"{path}.part"
+    writer = avi.AviWriter(part, width, height, fps)
+    capture = cv2.VideoCapture(chunk["segment"])
+    capture.set(cv2.CAP_PROP_POS_FRAMES, chunk["first"])
+    frame = None
+    for num in range(chunk["count"]):
+        ok, frame = capture.read(frame)
+        if not ok:
+            break
+        renderer.render(frame, samples[num] if valid[num] else None)
+        writer.write(cv2.imencode(".jpg", frame, params)[1])
+    capture.release()
+    written = writer.frames
+    writer.close()
+    os.replace(part, path)
+    return path, written, time.perf_counter() - started
+
+
+class Export:
+    def __init__(
+        self,
+        session: str,
+        settings: Dict,
+        camera: str,
+        logger: logging.Logger,
+        ranges: Optional[List[Tuple[int, int]]] = None,
+    ) -> None:
+        """[a camera's recording of a session, cut to time ranges with the
+        overlay burned in, each range one video. the ranges are cut into
+        chunks that a process pool sized to the cores renders and encodes
+        side by side, then each range's chunks are joined without being
+        encoded again. chunks already done are kept, an export that was
+        stopped carries on where it was
+
+        Args:
+            session (str): [the session's folder]
+            settings (Dict): [package configuration file]
+            camera (str): [camera, or mosaic, name]
+            logger (logging.Logger): [the logger for debug_logging]
+            ranges (List[Tuple[int, int]], optional): [start and end (ns)
+            of each part wanted, the whole session if None]
+        """
+        export = settings.get("export", {})
+        self.logger = logger
+        self.camera = camera
+        self.overlay = settings["overlay"]
+        self.quality = export.get("quality", QUALITY)
+        self.sync = telemetry_sync.SessionSync(
+            session,
+            self.overlay,
+            logger,
+            export.get("sync", telemetry_sync.NEAREST),
+        )
+        frames, self.samples, self.valid = self.sync.align(camera)
+        segments = self.sync.index.streams.get(camera, [])
+        if not segments:
+            raise ValueError(f"no {camera} recording in {session}")
+        capture = cv2.VideoCapture(str(segments[0].path))
+        self.video = (
+            int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            capture.get(cv2.CAP_PROP_FPS),
+        )
+        capture.release()
+        if ranges is None:
+            timestamps = frames["timestamp"]
+            ranges = [(int(timestamps[0]), int(timestamps[-1]))]
+        chunk_frames = max(
+            1,
+            round(export.get("chunk_seconds", CHUNK_SECONDS) * self.video[2]),
+        )
+        folder = Path(export.get("folder", FOLDER))
+        self.folder = folder / f"{Path(session).name}_{camera}"
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.ranges = plan(segments, ranges, chunk_frames)
+        self.state = {"ranges": self.ranges, "joined": {}}
+        plan_path = self.folder / PLAN
+        if plan_path.exists():
+            with open(plan_path, "r") as f:
+                state = json.load(f)
+            if state["ranges"] == self.ranges:
+                self.state = state
+            else:
+                # a different plan, nothing done for the old one fits it
+                for stale in self.folder.glob("chunk_*"):
+                    stale.unlink()
+        self.save()
+
+    def save(self) -> None:
+        with open(self.folder / f"{PLAN}.part", "w") as f:
+            json.dump(self.state, f)
+        os.replace(self.folder / f"{PLAN}.part", self.folder / PLAN)
+
+    def chunk_path(self, range_number: int, chunk: Dict) -> Path:
+        return self.folder / (
+            f"chunk_{range_number:03d}_{chunk['number']:05d}.avi"
+        )
+
+    def output_path(self, range_number: int) -> Path:
+        part = self.ranges[range_number]
+        start, end = (
+            datetime.datetime.fromtimestamp(part[key] / 1e9)
+            for key in ("start", "end")
+        )
+        return self.folder / (
+            f"{self.camera}_{start:%Y-%m-%d_%H%M%S}-{end:%H%M%S}.avi"
+        )
+
+    def run(
+        self,
+        workers: Optional[int] = None,
+        progress: Optional[Callable[[Dict], None]] = None,
+        keep_chunks: bool = False,
+    ) -> Dict:
+        """[export every range not exported yet
+
+        Args:
+            workers (int, optional): [pool size, the cores if None]
+            progress (Callable[[Dict], None], optional): [called with the
+            counts so far as each chunk finishes]
+            keep_chunks (bool): [keep chunk files once joined]
+
+        Returns:
+            Dict: [what was done and how fast]
+        """
+        started = time.perf_counter()
+        jobs = []
+        total = skipped = 0
+        for range_number, part in enumerate(self.ranges):
+            if str(range_number) in self.state["joined"]:
+                continue
+            for chunk in part["chunks"]:
+                total += chunk["count"]
+                path = self.chunk_path(range_number, chunk)
+                if path.exists():
+                    skipped += chunk["count"]
+                    continue
+                jobs.append((chunk, path))
+        report = {
+            "frames": total,
+            "resumed": skipped,
+            "done": skipped,
+            "chunks": len(jobs),
+            "encode_seconds": 0.0,
+        }
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker
+        ) as pool:
+            futures = []
+            for chunk, path in jobs:
+                # a job gets only the texts its frames show, not the
+                # session's whole table
+                samples = self.samples[slice(*chunk["frames"])].copy()
+                codes = overlay_decoder.renumber_texts(
+                    samples, self.sync.decoder.fields
+                )
+                texts = [self.sync.decoder.texts[code] for code in codes]
+                futures.append(
+                    pool.submit(
+                        export_chunk,
+                        chunk,
+                        str(path),
+                        samples,
+                        self.valid[slice(*chunk["frames"])],
+                        self.overlay,
+                        texts,
+                        self.video,
+                        self.quality,
+                    )
+                )
+            for future in as_completed(futures):
+                path, written, seconds = future.result()
+                report["done"] += written
+                report["encode_seconds"] += seconds
+                elapsed = time.perf_counter() - started
+                fps = (report["done"] - skipped) / max(elapsed, 1e-9)
+                report["fps"] = fps
+                report["eta_seconds"] = (total - report["done"]) / max(
+                    fps, 1e-9
+                )
+                if progress is not None:
+                    progress(dict(report, chunk=path))
+        join_started = time.perf_counter()
+        outputs = []
+        for range_number, part in enumerate(self.ranges):
+            if str(range_number) in self.state["joined"]:
+                outputs += self.state["joined"][str(range_number)]
+                continue
+            parts = [
+                str(self.chunk_path(range_number, chunk))
+                for chunk in part["chunks"]
+            ]
+            written = avi.join(
+                parts, str(self.output_path(range_number)), *self.video
+            )
+            self.state["joined"][str(range_number)] = written
+            self.save()
+            outputs += written
+            if not keep_chunks:
+                for path in parts:
+                    os.remove(path)
+        elapsed = time.perf_counter() - started
+        encoded = report["done"] - skipped
+        report.update(
+            {
+                "outputs": outputs,
+                "seconds": elapsed,
+                "join_seconds": time.perf_counter() - join_started,
+                "fps": encoded / max(elapsed, 1e-9),
+                # recorded seconds exported per second taken
+                "realtime": encoded / self.video[2] / max(elapsed, 1e-9),
+                "workers": workers,
+            }
+        )
+        report.pop("eta_seconds", None)
+        self.logger.info(
+            f"exported {encoded} frames of {self.camera} in {elapsed:.1f} s, "
+            f"{report['fps']:.0f} fps with {workers} workers"
+        )
+        return report
+
+    def close(self) -> None:
+        self.sync.close()
+
+
+if __name__ == "__main__":
+    # export a camera of a recorded session with the overlay burned in:
+    #   python export.py recordings/session_<time> camera1 --range 30 90
+    parser = argparse.ArgumentParser(description="dvr2 export")
+    parser.add_argument("session", help="recorded session folder")
+    parser.add_argument("camera", help="camera, or mosaic, name")
+    parser.add_argument(
+        "--range",
+        nargs=2,
+        action="append",
+        metavar=("START", "END"),
+        help="seconds from the start, or local times 2021-09-22T14:32:07",
+    )
+    parser.add_argument("--workers", type=int, help="pool size, the cores")
+    parser.add_argument("--keep-chunks", action="store_true")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+    with open(args.config, "r") as f:
+        settings = json.load(f)
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger("export")
+    first = session_index.SessionIndex(args.session)
+    segments = first.streams.get(args.camera, [])
+    start = segments[0].start if segments else 0
+    first.close()
+    ranges = None
+    if args.range:
+        ranges = [
+            tuple(session_index.parse_time(text, start) for text in pair)
+            for pair in args.range
+        ]
+    export = Export(args.session, settings, args.camera, logger, ranges)
+
+    def show(report: Dict) -> None:
+        print(
+            f"{report['done']}/{report['frames']} frames, "
+            f"{report['fps']:.0f} fps, {report['eta_seconds']:.0f} s left"
+        )
+
+    try:
+        result = export.run(args.workers, show, args.keep_chunks)
+    finally:
+        export.close()
+    print(json.dumps(result, indent=4))
@@ -0,0 +1,272 @@
+from typing import Dict, List, Optional
+import ctypes
+import ctypes.util
+import errno
+import logging
+import socket
+
+# send buffer of the forwarding socket, room for bursts to every output
+SEND_BUFFER = 1 << 22
+MSG_DONTWAIT = getattr(socket, "MSG_DONTWAIT", 0)
+# outputs before one sendmmsg beats a sendto each, the ctypes call costs
+# about as much as a loopback send (see the testing code below)
+BATCH_MIN = 8
+
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+class sockaddr_in(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_uint16),
+        ("sin_addr", ctypes.c_uint8 * 4),
+        ("sin_zero", ctypes.c_uint8 * 8),
+    ]
+
+
+def load_sendmmsg():
+    """[libc's sendmmsg, None where there is none (not linux)]"""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError, TypeError):
+        return None
+    sendmmsg.argtypes = [
+        ctypes.c_int,
+        ctypes.POINTER(mmsghdr),
+        ctypes.c_uint,
+        ctypes.c_int,
+    ]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+SENDMMSG = load_sendmmsg()
+
+
+class Output:
+    def __init__(self, setting: Dict, overlay: Dict) -> None:
+        """[one downstream display or logger
+
+        Args:
+            setting (Dict): [the output's settings. "inputs" lists the
+            inputs forwarded to it, "fields" optionally cuts overlay
+            packets down to those overlay fields]
+            overlay (Dict): [the "overlay" section of config.json]
+        """
+        self.name = setting["name"]
+        self.address = (setting["ip"], setting["port"])
+        self.inputs = setting.get("inputs", [])
+        names = [field["name"] for field in overlay["fields"]]
+        self.overlay_input = overlay["input"]
+        # the last overlay field is free text and may hold separators
+        self.splits = len(names) - 1
+        self.fields = [names.index(name) for name in setting.get("fields", [])]
+        self.sent = 0
+        self.dropped = 0
+
+    def reformats(self, input_name: str) -> bool:
+        return bool(self.fields) and input_name == self.overlay_input
+
+    def reformat(self, payload) -> bytes:
+        parts = bytes(payload).split(b",", self.splits)
+        return b",".join(parts[idx] for idx in self.fields if idx < len(parts))
+
+
+class MessageBatch:
+    def __init__(self, sock: socket.socket, outputs: List[Output]) -> None:
+        """[one sendmmsg call sends a payload to every output. the headers
+        and addresses are built once, each send only points the shared
+        iovec at the payload, which is never copied]"""
+        self.fd = sock.fileno()
+        self.outputs = outputs
+        self.count = len(outputs)
+        self.iov = iovec()
+        self.addresses = (sockaddr_in * self.count)()
+        self.messages = (mmsghdr * self.count)()
+        for idx, output in enumerate(outputs):
+            address = self.addresses[idx]
+            address.sin_family = socket.AF_INET
+            address.sin_port = socket.htons(output.address[1])
+            address.sin_addr[:] = list(socket.inet_aton(output.address[0]))
+            header = self.messages[idx].msg_hdr
+            header.msg_name = ctypes.addressof(address)
+            header.msg_namelen = ctypes.sizeof(sockaddr_in)
+            header.msg_iov = ctypes.pointer(self.iov)
+            header.msg_iovlen = 1
+
+    def send(self, payload: memoryview) -> None:
+        address = ctypes.addressof(ctypes.c_char.from_buffer(payload))
+        self.iov.iov_base = address
+        self.iov.iov_len = len(payload)
+        start = 0
+        while start < self.count:
+            sent = SENDMMSG(
+                self.fd,
+                ctypes.byref(self.messages[start]),
+                self.count - start,
+                MSG_DONTWAIT,
+            )
+            if sent < 0:
+                # the message at start failed (full buffer), skip it
+                error = ctypes.get_errno()
+                if error == errno.EINTR:
+                    continue
+                self.outputs[start].dropped += 1
+                start += 1
+                continue
+            for output in self.outputs[start : start + sent]:
+                output.sent += 1
+            start += sent
+
+
+class Route:
+    def __init__(
+        self, sock: socket.socket, input_name: str, outputs: List[Output]
+    ) -> None:
+        """[everything one input is forwarded to, raw outputs share a
+        batch, reformatted ones get their own copy]"""
+        self.sock = sock
+        self.raw = [out for out in outputs if not out.reformats(input_name)]
+        self.reformatted = [
+            out for out in outputs if out.reformats(input_name)
+        ]
+        self.batch: Optional[MessageBatch] = None
+        if SENDMMSG is not None and len(self.raw) >= BATCH_MIN:
+            self.batch = MessageBatch(sock, self.raw)
+
+    def send(self, payload: memoryview) -> None:
+        """[forward a payload, called from the drain loop before the
+        receive buffer is reused. a full socket buffer drops the packet for
+        that output, ingest never waits]"""
+        # ctypes cannot take the address of an empty buffer, an empty
+        # datagram goes out one sendto at a time
+        if self.batch is not None and len(payload) and not payload.readonly:
+            self.batch.send(payload)
+        else:
+            for output in self.raw:
+                self.send_to(output, payload)
+        for output in self.reformatted:
+            self.send_to(output, output.reformat(payload))
+
+    def send_to(self, output: Output, payload) -> None:
+        try:
+            self.sock.sendto(payload, output.address)
+            output.sent += 1
+        except OSError:
+            output.dropped += 1
+
+
+class Forwarder:
+    def __init__(self, settings: Dict, logger: logging.Logger) -> None:
+        """[fans received packets out to the configured outputs over one
+        non-blocking socket
+
+        Args:
+            settings (Dict): [package configuration file]
+            logger (logging.Logger): [the logger for debug_logging]
+        """
+        self.outputs = [
+            Output(setting, settings["overlay"])
+            for setting in settings["outputs"]
+        ]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        self.sock.setblocking(False)
+        self.routes: Dict[str, Route] = {}
+        for conn in settings["inputs"]:
+            name = conn["name"]
+            outputs = [out for out in self.outputs if name in out.inputs]
+            if outputs:
+                self.routes[name] = Route(self.sock, name, outputs)
+                logger.info(
+                    f"{conn['name']} forwarded to "
+                    f"{', '.join(out.name for out in outputs)}"
+                )
+        if SENDMMSG is None:
+            logger.info("no sendmmsg here, forwarding with sendto")
+
+    def route(self, input_name: str) -> Optional[Route]:
+        return self.routes.get(input_name)
+
+    def counters(self) -> Dict:
+        return {
+            out.name: {"sent": out.sent, "dropped": out.dropped}
+            for out in self.outputs
+        }
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+if __name__ == "__main__":
+    # testing code, fan one packet out to n outputs with sendto and with
+    # sendmmsg
+    import sys
+    import time
+
+    OUTPUTS = int(sys.argv[1]) if len(sys.argv) > 1 else BATCH_MIN
+    sinks = []
+    settings = {
+        "overlay": {"input": "overlay", "fields": [{"name": "timestamp"}]},
+        "inputs": [{"name": "overlay"}],
+        "outputs": [],
+    }
+    for num in range(OUTPUTS):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 24)
+        sink.bind(("127.0.0.1", 0))
+        sinks.append(sink)
+        settings["outputs"].append(
+            {
+                "name": f"output{num}",
+                "ip": "127.0.0.1",
+                "port": sink.getsockname()[1],
+                "inputs": ["overlay"],
+            }
+        )
+    logger = logging.getLogger("forwarder")
+    forwarder = Forwarder(settings, logger)
+    route = forwarder.route("overlay")
+    buffer = bytearray(b"x" * 100)
+    payload = memoryview(buffer)
+    count = 20_000
+    batch = MessageBatch(forwarder.sock, route.raw) if SENDMMSG else None
+    for name, route.batch in (("sendto", None), ("sendmmsg", batch)):
+        start = time.perf_counter()
+        for _ in range(count):
+            route.send(payload)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name}: {elapsed / count * 1e6:.2f} us per packet "
+            f"to {OUTPUTS} outputs"
+        )
+        for sink in sinks:
+            sink.setblocking(False)
+            try:
+                while True:
+                    sink.recv(2048)
+            except BlockingIOError:
+                pass
+    print(forwarder.counters())
+    forwarder.close()
+    for sink in sinks:
+        sink.close()
@@ -0,0 +1,131 @@
+import os
+from typing import Optional, Tuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# per slot header, guarded like shared_mailbox: seq is odd while the slot is
+# being written and 2 * frame number + 2 once frame number is in it
+SLOT_HEADER = np.dtype([("seq", "<u8"), ("timestamp", "<f8")])
+# frames published so far, the only field outside the slot headers
+COUNT = np.dtype("<u8")
+
+
+class FrameRing:
+    def __init__(
+        self,
+        slots: int,
+        shape: Tuple[int, int, int],
+        name: Optional[str] = None,
+        create: bool = True,
+    ) -> None:
+        """[ring of fixed size frame slots in shared memory. one capture
+        process writes frames in place, any number of readers in other
+        processes look frames up by number without copying or pickling]
+
+        Args:
+            slots (int): [number of frames kept]
+            shape (Tuple[int, int, int]): [height, width, channels]
+            name (str, optional): [shared memory block name, made up when
+            creating and None]
+            create (bool): [True for the owner, False to attach]
+        """
+        self.slots = slots
+        self.shape = tuple(shape)
+        header_size = COUNT.itemsize + SLOT_HEADER.itemsize * slots
+        frame_size = int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=header_size + frame_size * slots
+        )
+        self.name = self.shm.name
+        # only the owner unlinks, see shared_mailbox.Mailbox
+        self.owner = create
+        # a forked child holds the owner's object, it must not unlink
+        self.owner_pid = os.getpid()
+        buf = self.shm.buf
+        self.count_view = np.ndarray((1,), COUNT, buf, 0)
+        self.headers = np.ndarray((slots,), SLOT_HEADER, buf, COUNT.itemsize)
+        self.frames = np.ndarray(
+            (slots,) + self.shape, np.uint8, buf, header_size
+        )
+        if create:
+            self.count_view[0] = 0
+            self.headers["seq"] = 0
+
+    def __reduce__(self):
+        # pass by name so a child process attaches to the same block
+        return (FrameRing, (self.slots, self.shape, self.name, False))
+
+    @property
+    def count(self) -> int:
+        """[frames published so far, the newest is count - 1]"""
+        return int(self.count_view[0])
+
+    def begin(self) -> np.ndarray:
+        """[mark the next slot as being written and return it to decode
+        the next frame into. the slot is only readable after commit]"""
+        number = self.count
+        self.headers["seq"][number % self.slots] = 2 * number + 1
+        return self.frames[number % self.slots]
+
+    def commit(self, timestamp: float) -> int:
+        """[publish the frame written since begin]
+
+        Returns:
+            int: [the frame's number]
+        """
+        number = self.count
+        slot = number % self.slots
+        self.headers["timestamp"][slot] = timestamp
+        self.headers["seq"][slot] = 2 * number + 2
+        self.count_view[0] = number + 1
+        return number
+
+    def valid(self, number: int) -> bool:
+        """[True while frame number is still in its slot, check it again
+        after using a view from get to know the frame was not overwritten]"""
+        return self.headers["seq"][number % self.slots] == 2 * number + 2
+
+    def get(
+        self, number: int, out: Optional[np.ndarray] = None
+    ) -> Optional[Tuple[float, np.ndarray]]:
+        """[look up a frame by number
+
+        Args:
+            number (int): [frame number, count - 1 for the newest]
+            out (np.ndarray, optional): [copy the frame in here, otherwise a
+            view of the slot is returned, which the writer will overwrite
+            slots frames later]
+
+        Returns:
+            Optional[Tuple[float, np.ndarray]]: [timestamp and frame, None
+            if the frame is not in the ring (yet or any more)]
+        """
+        if number < 0 or not self.valid(number):
+            return None
+        slot = number % self.slots
+        timestamp = float(self.headers["timestamp"][slot])
+        if out is None:
+            return timestamp, self.frames[slot]
+        out[...] = self.frames[slot]
+        if not self.valid(number):
+            # overwritten while copying
+            return None
+        return timestamp, out
+
+    def latest(
+        self, out: Optional[np.ndarray] = None
+    ) -> Optional[Tuple[int, float, np.ndarray]]:
+        """[the newest frame, as (number, timestamp, frame)]"""
+        number = self.count - 1
+        frame = self.get(number, out)
+        if frame is None:
+            return None
+        return (number,) + frame
+
+    def close(self) -> None:
+        # the numpy views have to go before the block can be closed
+        self.count_view = self.headers = self.frames = None
+        self.shm.close()
+        if self.owner and os.getpid() == self.owner_pid:
+            self.shm.unlink()
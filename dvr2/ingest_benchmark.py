@@ -0,0 +1,596 @@
+from typing import Dict, List, Optional
+from pathlib import Path
+import argparse
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import clock
+import debug_logger
+import io_connections
+import main
+import recorder
+import shard_receiver
+import shared_mailbox
+import socket_connections
+import stats
+import telemetry_file
+
+# every benchmark packet starts with its sequence number and the time it was
+# sent (ns, clock.now_ns), the rest is padding up to the payload size
+PACKET = struct.Struct("<Iq")
+# seconds given to the server to drain what is left once the senders stop
+SETTLE = 0.5
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def free_ports(count: int) -> List[int]:
+    """[ports nothing is bound to right now, for the benchmark inputs]"""
+    socks = []
+    for _ in range(count):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        socks.append(sock)
+    ports = [sock.getsockname()[1] for sock in socks]
+    for sock in socks:
+        sock.close()
+    return ports
+
+
+def wait_bound(ports: List[int], timeout: float = 10) -> None:
+    """[wait for the server to bind every port, a port is taken once
+    binding it here fails]"""
+    deadline = time.monotonic() + timeout
+    for port in ports:
+        while True:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.bind(("127.0.0.1", port))
+            except OSError:
+                break
+            finally:
+                sock.close()
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"nothing bound to port {port}")
+            time.sleep(0.01)
+
+
+def send_packets(
+    port: int,
+    rate: float,
+    size: int,
+    duration: float,
+    burst: int,
+    sent: multiprocessing.Queue,
+    flows: int = 1,
+) -> None:
+    """[sender process, rate packets a second to port for duration seconds.
+    packets go in bursts of burst back to back, burst 1 is steady. flows
+    source ports take turns, SO_REUSEPORT shards a port by flow]"""
+    socks = [
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(flows)
+    ]
+    payload = bytearray(max(size, PACKET.size))
+    interval = burst / rate
+    count = 0
+    start = time.perf_counter()
+    # bursts are counted, not timed, a sum of float intervals can come up
+    # a hair short of duration and send one burst too many
+    for number in range(max(1, math.ceil(round(duration / interval, 6)))):
+        deadline = start + number * interval
+        wait = deadline - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        for _ in range(burst):
+            PACKET.pack_into(payload, 0, count, clock.now_ns())
+            try:
+                socks[count % flows].sendto(payload, ("127.0.0.1", port))
+            except OSError:
+                # the local send buffer is full, it counts as sent and lost
+                pass
+            count += 1
+    for sock in socks:
+        sock.close()
+    sent.put(count)
+
+
+def kernel_drops(ports: List[int]) -> Optional[int]:
+    """[datagrams the kernel dropped on the ports' sockets because their
+    receive buffers were full, None where /proc/net/udp does not exist]"""
+    try:
+        with open("/proc/net/udp", "r") as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    drops = 0
+    for line in lines:
+        fields = line.split()
+        if int(fields[1].split(":")[1], 16) in ports:
+            drops += int(fields[-1])
+    return drops
+
+
+def process_cpu(pid: int) -> Optional[float]:
+    """[user and system cpu seconds used so far by process pid and the
+    children it has running (shards, encoders), None where /proc does not
+    exist]"""
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # the command name may hold spaces, the fields start after it
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    for children in Path(f"/proc/{pid}/task").glob("*/children"):
+        try:
+            pids = children.read_text().split()
+        except OSError:
+            continue
+        for child in pids:
+            cpu += process_cpu(int(child)) or 0.0
+    return cpu
+
+
+def read_session(folder: Path, inputs: List[str]) -> Dict:
+    """[latencies (ns, ingest timestamp less send time) and the number of
+    packets recorded for each input, out of every telemetry file under
+    folder]"""
+    latencies = []
+    received = {name: 0 for name in inputs}
+    for path in sorted(folder.glob("**/telemetry_*.tlm")):
+        reader = telemetry_file.TelemetryReader(str(path))
+        payload = None
+        for timestamp, input_id, payload in reader:
+            name = reader.inputs[input_id]
+            if name not in received:
+                continue
+            _, sent_at = PACKET.unpack_from(payload)
+            latencies.append(timestamp - sent_at)
+            received[name] += 1
+        # the last view has to go before the map can close
+        payload = None
+        reader.close()
+    return {
+        "latencies": np.array(latencies, dtype=np.int64),
+        "received": received,
+    }
+
+
+class InProcessServer:
+    def __init__(
+        self, inputs: List[Dict], folder: Path, with_stats: bool = True
+    ) -> None:
+        """[main's socket server on a thread of this process, recording
+        every packet into folder]"""
+        self.logger = logging.getLogger("ingest_benchmark")
+        self.logger.setLevel(logging.WARNING)
+        self.mailboxes = main.create_mailboxes(len(inputs), self.logger)
+        self.recorder = recorder.Recorder(
+            {
+                "folder": str(folder),
+                "preroll_seconds": 0,
+                "preroll_max_bytes": 0,
+                "chunk_bytes": telemetry_file.CHUNK_BYTES,
+            },
+            [conn["name"] for conn in inputs],
+            self.logger,
+        )
+        self.recorder.start()
+        self.stats = stats.Stats() if with_stats else None
+        self.shard_groups = shard_receiver.start_shards(
+            {"inputs": inputs}, self.mailboxes, self.logger
+        )
+        self.control_q: queue.SimpleQueue = queue.SimpleQueue()
+        self.wakeup_recv, self.wakeup_send = socket.socketpair()
+        self.wakeup_recv.setblocking(False)
+        self.thread = threading.Thread(
+            name="socket_server",
+            target=main.socket_server,
+            args=(
+                {"inputs": inputs},
+                self.logger,
+                self.mailboxes,
+                queue.SimpleQueue(),
+                self.control_q,
+                self.wakeup_recv,
+                {},
+                self.recorder,
+                self.stats,
+                None,
+                self.shard_groups,
+            ),
+        )
+        self.thread.start()
+        self.pid = os.getpid()
+
+    def cpu(self) -> float:
+        # the senders are other processes, so this is the server's share
+        cpu = time.process_time()
+        for group in self.shard_groups.values():
+            for process in group.processes:
+                cpu += process_cpu(process.pid) or 0.0
+        return cpu
+
+    def snapshot(self) -> Optional[Dict]:
+        return None if self.stats is None else self.stats.snapshot()
+
+    def stop(self) -> None:
+        self.control_q.put(None)
+        main.wake(self.wakeup_send)
+        self.thread.join()
+        shard_receiver.stop_shards(self.shard_groups, self.logger)
+        self.recorder.stop()
+        self.wakeup_recv.close()
+        self.wakeup_send.close()
+        for box in self.mailboxes:
+            box.close()
+
+
+class SubprocessServer:
+    def __init__(self, inputs: List[Dict], folder: Path) -> None:
+        """[main.py as it runs for real, in its own process with a config
+        file in folder, recording every packet]"""
+        with open(Path(__file__).parent / "config.json", "r") as f:
+            settings = json.load(f)
+        self.controller, stats_port = free_ports(2)
+        settings["cameras"] = []
+        # with no cameras there is nothing to tile or preview
+        settings.pop("mosaic", None)
+        settings.pop("preview", None)
+        settings["stats"]["port"] = stats_port
+        self.stats_address = (settings["stats"]["ip"], stats_port)
+        settings["inputs"] = inputs + [
+            {"name": "controller", "ip": "127.0.0.1", "port": self.controller}
+        ]
+        settings["debug_level"] = "warning"
+        settings["log_length"] = {"hour": 24, "minute": 0, "second": 0}
+        with open(folder / "config.json", "w") as f:
+            json.dump(settings, f)
+        self.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).parent / "main.py")],
+            cwd=folder,
+        )
+        self.pid = self.process.pid
+        # the command waits on the bound socket until main gets to it
+        wait_bound([self.controller])
+        self.command("start")
+        while not list(folder.glob("recordings/session_*/telemetry_*.tlm")):
+            if self.process.poll() is not None:
+                raise RuntimeError("main.py exited during start up")
+            time.sleep(0.05)
+
+    def command(self, command: str) -> None:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.sendto(command.encode(), ("127.0.0.1", self.controller))
+        sock.close()
+
+    def cpu(self) -> Optional[float]:
+        return process_cpu(self.pid)
+
+    def snapshot(self) -> Optional[Dict]:
+        return stats.query(*self.stats_address)
+
+    def stop(self) -> None:
+        self.command("close")
+        self.process.wait()
+
+
+def run(
+    rate: float,
+    size: int,
+    inputs: int,
+    duration: float,
+    burst: int = 1,
+    mode: str = "inprocess",
+    with_stats: bool = True,
+    shards: int = 0,
+) -> Dict:
+    """[drive the ingest server with one sender process per input and
+    measure it
+
+    Args:
+        rate (float): [packets a second per input]
+        size (int): [payload bytes]
+        inputs (int): [number of inputs]
+        duration (float): [seconds of sending]
+        burst (int): [packets sent back to back, 1 for steady traffic]
+        mode (str): [inprocess or subprocess]
+        with_stats (bool): [keep ingest stats, inprocess only, main always
+        keeps them]
+        shards (int): [receiver processes per input, 0 to receive on the
+        server thread]
+
+    Returns:
+        Dict: [the benchmark's settings and results]
+    ]"""
+    ports = free_ports(inputs)
+    settings = [
+        {
+            "name": f"input{idx}",
+            "ip": "127.0.0.1",
+            "port": port,
+            "shards": shards,
+        }
+        for idx, port in enumerate(ports)
+    ]
+    with tempfile.TemporaryDirectory() as temp:
+        folder = Path(temp)
+        if mode == "subprocess":
+            server = SubprocessServer(settings, folder)
+        else:
+            server = InProcessServer(settings, folder, with_stats)
+        wait_bound(ports)
+        drops_before = kernel_drops(ports)
+        sent_q: multiprocessing.Queue = multiprocessing.Queue()
+        senders = [
+            multiprocessing.Process(
+                target=send_packets,
+                args=(
+                    port,
+                    rate,
+                    size,
+                    duration,
+                    burst,
+                    sent_q,
+                    max(1, shards),
+                ),
+            )
+            for port in ports
+        ]
+        cpu_before = server.cpu()
+        start = time.perf_counter()
+        for sender in senders:
+            sender.start()
+        sent = sum(sent_q.get() for _ in senders)
+        for sender in senders:
+            sender.join()
+        elapsed = time.perf_counter() - start
+        time.sleep(SETTLE)
+        cpu_after = server.cpu()
+        drops_after = kernel_drops(ports)
+        snapshot = server.snapshot()
+        server.stop()
+        session = read_session(folder, [conn["name"] for conn in settings])
+
+    received = sum(session["received"].values())
+    latencies = session["latencies"]
+    result = {
+        "settings": {
+            "rate": rate,
+            "size": size,
+            "inputs": inputs,
+            "duration": duration,
+            "burst": burst,
+            "mode": mode,
+            "stats": with_stats or mode == "subprocess",
+            "shards": shards,
+        },
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "sent": sent,
+        "received": received,
+        "lost": sent - received,
+        "kernel_drops": None
+        if drops_before is None
+        else drops_after - drops_before,
+        "throughput": received / elapsed,
+        "latency_us": {},
+        "cpu_us_per_packet": None,
+        "stats": None if snapshot is None else snapshot["inputs"],
+    }
+    if len(latencies):
+        for percentile in PERCENTILES:
+            result["latency_us"][f"p{percentile}"] = (
+                float(np.percentile(latencies, percentile)) / 1e3
+            )
+        result["latency_us"]["max"] = float(latencies.max()) / 1e3
+    if cpu_before is not None and received:
+        result["cpu_us_per_packet"] = (
+            (cpu_after - cpu_before) / received * 1e6
+        )
+    return result
+
+
+class LatencyRecorder:
+    def __init__(self) -> None:
+        """[stands in for the session recorder, keeps every packet's
+        timestamp less the time it was sent]"""
+        self.latencies: List[int] = []
+
+    def add(self, stream: str, timestamp: int, payload) -> None:
+        self.latencies.append(timestamp - PACKET.unpack_from(payload)[1])
+
+
+def busy(done: threading.Event) -> None:
+    # pure python, holds the gil for its switch interval at a time like the
+    # other threads of main do
+    while not done.is_set():
+        sum(range(10_000))
+
+
+def jitter(rate: float, duration: float, load: bool = True) -> Dict:
+    """[how far packet timestamps are from the send times, stamped by the
+    kernel and by the monotonic clock once get_packets has the packet. with
+    load a busy thread competes with the receiving one for the gil
+
+    Returns:
+        Dict: [latency percentiles (us) and the p99 less p50 spread for
+        each way of stamping]
+    ]"""
+    logger = logging.getLogger("ingest_benchmark")
+    logger.setLevel(logging.WARNING)
+    results = {}
+    for stamping in ("monotonic", "kernel"):
+        port = free_ports(1)[0]
+        conn = io_connections.get_connections(
+            [
+                {
+                    "name": "jitter",
+                    "ip": "127.0.0.1",
+                    "port": port,
+                    "kernel_timestamps": stamping == "kernel",
+                }
+            ],
+            True,
+            logger,
+        )[0]
+        conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        mailboxes = [
+            shared_mailbox.Mailbox(socket_connections.MAX_DATAGRAM, ns=True)
+        ]
+        latencies = LatencyRecorder()
+        done = threading.Event()
+        loader = threading.Thread(target=busy, args=(done,))
+        if load:
+            loader.start()
+        sent_q: multiprocessing.Queue = multiprocessing.Queue()
+        sender = multiprocessing.Process(
+            target=send_packets,
+            args=(port, rate, PACKET.size, duration, 1, sent_q),
+        )
+        sender.start()
+        sel = selectors.DefaultSelector()
+        sel.register(conn.sock, selectors.EVENT_READ)
+        deadline = None
+        while deadline is None or time.monotonic() < deadline:
+            if sel.select(timeout=0.1):
+                main.get_packets(
+                    conn, logger, mailboxes, queue.SimpleQueue(), latencies
+                )
+            if deadline is None and not sender.is_alive():
+                deadline = time.monotonic() + SETTLE
+        sent_q.get()
+        sender.join()
+        done.set()
+        if load:
+            loader.join()
+        sel.close()
+        conn.sock.close()
+        mailboxes[0].close()
+        values = np.array(latencies.latencies, dtype=np.int64) / 1e3
+        result = {"packets": len(values)}
+        for percentile in PERCENTILES:
+            result[f"p{percentile}"] = float(np.percentile(values, percentile))
+        result["max"] = float(values.max())
+        result["spread"] = result["p99"] - result["p50"]
+        results[stamping] = result
+    return {
+        "settings": {"rate": rate, "duration": duration, "load": load},
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "latency_us": results,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: Dict, previous: Dict) -> None:
+    """[print how the headline numbers moved since a previous result]"""
+    rows = [
+        ("throughput", result["throughput"], previous["throughput"]),
+        ("lost", result["lost"], previous["lost"]),
+        (
+            "p99 latency us",
+            result["latency_us"].get("p99"),
+            previous["latency_us"].get("p99"),
+        ),
+        (
+            "cpu us/packet",
+            result["cpu_us_per_packet"],
+            previous["cpu_us_per_packet"],
+        ),
+    ]
+    print(f"against {previous.get('commit')} at {previous.get('time')}:")
+    for name, now, before in rows:
+        if now is None or before is None:
+            continue
+        change = f"{(now - before) / before * 100:+.1f}%" if before else ""
+        print(f"  {name}: {before:.1f} -> {now:.1f} {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="dvr2 ingest benchmark")
+    parser.add_argument("--rate", type=float, default=1000)
+    parser.add_argument("--size", type=int, default=100)
+    parser.add_argument("--inputs", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument(
+        "--burst", type=int, default=1, help="packets per burst, 1 is steady"
+    )
+    parser.add_argument(
+        "--mode", choices=["inprocess", "subprocess"], default="inprocess"
+    )
+    parser.add_argument(
+        "--no-stats", action="store_true", help="inprocess without stats"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=0, help="receiver processes per input"
+    )
+    parser.add_argument("--output", help="results file")
+    parser.add_argument("--compare", help="earlier results file")
+    parser.add_argument(
+        "--jitter",
+        action="store_true",
+        help="compare kernel and monotonic packet timestamps instead",
+    )
+    parser.add_argument(
+        "--no-load", action="store_true", help="jitter without a busy thread"
+    )
+    args = parser.parse_args()
+    multiprocessing.set_start_method("spawn")
+
+    if args.jitter:
+        result = jitter(args.rate, args.duration, not args.no_load)
+        output = args.output or debug_logger.get_new_log_file_name(
+            "benchmarks", "jitter", "json"
+        )
+        with open(output, "w") as f:
+            json.dump(result, f, indent=4)
+        print(json.dumps(result, indent=4))
+        print(f"saved {output}")
+        sys.exit()
+
+    result = run(
+        args.rate,
+        args.size,
+        args.inputs,
+        args.duration,
+        args.burst,
+        args.mode,
+        not args.no_stats,
+        args.shards,
+    )
+    output = args.output or debug_logger.get_new_log_file_name(
+        "benchmarks", "ingest", "json"
+    )
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4)
+    print(json.dumps(result, indent=4))
+    print(f"saved {output}")
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(result, json.load(f))
@@ -2,6 +2,7 @@ from typing import List, Dict
 import logging
 import json
 
+import clock
 import debug_logger
 import socket_connections
 
@@ -11,12 +12,20 @@ def get_connections(
 ) -> List:
 
     conn_list = []
-    for conn in setting:
+    for idx, conn in enumerate(setting):
         conn_list.append(
             socket_connections.Connection(
                 conn["name"], conn["ip"], conn["port"], logger
             )
         )
+        # remember the slot so packets can be routed without a lookup
+        conn_list[-1].index = idx
+        # stamped by the kernel on arrival unless the input opts out, a
+        # recvmsg costs more than a recv
+        if conn.get("kernel_timestamps", True):
+            conn_list[-1].kernel_stamps = clock.kernel_timestamps(
+                conn_list[-1].sock
+            )
         if binding == True:
             conn_list[-1].bind_open()
     return conn_list
@@ -1,4 +1,4 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 import json
 import threading
 import queue
@@ -6,9 +6,25 @@ import time
 import datetime
 import logging
 import selectors
+import socket
 import multiprocessing
 import io_connections
+import shared_mailbox
+import overlay_decoder
+import camera_capture
+import recorder
+import video_encoder
+import socket_connections
 import debug_logger
+import shard_receiver
+import stats
+import forwarder
+import clock
+import backpressure
+import preview
+import disk_writer
+import mosaic
+import retention
 
 
 def read_config_file(config: str) -> Dict:
@@ -16,97 +32,230 @@ def read_config_file(config: str) -> Dict:
         return json.load(f)
 
 
-def create_queues(count: int, logger: logging.Logger) -> List:
-    queues: List[multiprocessing.Queue] = []
+def create_mailboxes(count: int, logger: logging.Logger) -> List:
+    mailboxes: List[shared_mailbox.Mailbox] = []
     for num in range(count):
-        queues.append(multiprocessing.Queue(maxsize=1))
-        logger.info(f"q{num} added to queue")
-    return queues
+        mailboxes.append(
+            shared_mailbox.Mailbox(socket_connections.MAX_DATAGRAM, ns=True)
+        )
+        logger.info(f"mb{num} added to mailboxes")
+    return mailboxes
 
 
 def socket_server(
     settings: Dict,
     logger: logging.Logger,
-    qs: List,
+    mailboxes: List,
     command_q: queue.Queue,
     socket_control_q: queue.Queue,
+    wakeup: socket.socket,
+    decoders: Dict,
+    session_recorder: recorder.Recorder,
+    ingest_stats: Optional[stats.Stats] = None,
+    stats_server: Optional[stats.StatsServer] = None,
+    shard_groups: Optional[Dict] = None,
+    outputs: Optional[forwarder.Forwarder] = None,
 ) -> None:
-    inputs = io_connections.get_connections(settings["inputs"], True, logger)
+    shard_groups = shard_groups or {}
+    inputs = io_connections.get_connections(settings["inputs"], False, logger)
+    # sharded inputs are received by their shard processes, main only
+    # reads what the shards hand over
+    for group in shard_groups.values():
+        inputs[group.index].sock.close()
+    inputs = [conn for conn in inputs if conn.name not in shard_groups]
     sel = selectors.DefaultSelector()
+    for conn in inputs + list(shard_groups.values()):
+        conn.decoder = decoders.get(conn.name)
+        if outputs is not None:
+            conn.forward = outputs.route(conn.name)
+        if ingest_stats is not None:
+            conn.stats = ingest_stats.input(conn.name)
     for conn in inputs:
+        conn.bind_open()
+        # the connection is the selector data so each ready socket maps
+        # straight to its input slot
         sel.register(
-            fileobj=conn.sock, events=selectors.EVENT_READ, data=get_packets
+            fileobj=conn.sock, events=selectors.EVENT_READ, data=conn
         )
-    while True:
-        if not socket_control_q.empty():
-            command = socket_control_q.get()
-            if command == "start" or command == "stop":
-                socket_control_q.put(command)
-            else:
-                # command is to close
-                # drain all qs and break
-                for idx, q in enumerate(qs):
-                    # drain the q
-                    while True:
-                        try:
-                            _ = q.get(block=False)
-                            logger.debug(f"SHUTTING DOWN: q{idx} drained")
-                        except queue.Empty:
-                            break
-                break
-        events = sel.select(timeout=0)
+    for group in shard_groups.values():
+        sel.register(
+            fileobj=group.wakeup, events=selectors.EVENT_READ, data=group
+        )
+    # the wakeup socket has no connection, it only interrupts the select so
+    # the socket_control_q gets read
+    sel.register(fileobj=wakeup, events=selectors.EVENT_READ, data=None)
+    # stats queries are answered on this thread too, between drains
+    if stats_server is not None:
+        sel.register(
+            fileobj=stats_server.sock,
+            events=selectors.EVENT_READ,
+            data=stats_server,
+        )
+    running = True
+    while running:
+        # block until a packet arrives or main wakes us up, a shard group
+        # holding packets back for order is looked at again every poll
+        holding = [
+            group for group in shard_groups.values() if group.holding
+        ]
+        events = sel.select(shard_receiver.POLL if holding else None)
+        if not events:
+            for group in holding:
+                group.get_packets(session_recorder)
         for key, mask in events:
-            callback = key.data
-            callback(
-                key.fileobj,
-                mask,
-                settings,
-                logger,
-                qs,
-                command_q,
-                socket_control_q,
-            )
+            conn = key.data
+            if conn is None:
+                running = socket_control(wakeup, socket_control_q)
+                continue
+            if conn is stats_server:
+                stats_server.handle()
+                continue
+            if isinstance(conn, shard_receiver.ShardGroup):
+                conn.get_packets(session_recorder)
+                continue
+            get_packets(conn, logger, mailboxes, command_q, session_recorder)
+    sel.close()
+    for conn in inputs:
+        conn.sock.close()
+
+
+def socket_control(
+    wakeup: socket.socket, socket_control_q: queue.Queue
+) -> bool:
+    # clear the wakeup bytes, one is sent per command
+    try:
+        wakeup.recv(1024)
+    except BlockingIOError:
+        pass
+    while True:
+        try:
+            command = socket_control_q.get(block=False)
+        except queue.Empty:
+            return True
+        if command == "start" or command == "stop":
+            continue
+        # command is to close, stop serving
+        return False
+
+
+def wake(wakeup: socket.socket) -> None:
+    # any byte will do, the selector only needs the socket to be readable
+    wakeup.send(b"\x00")
 
 
 def get_packets(
-    sock,
-    mask,
-    settings: Dict,
+    conn: socket_connections.Connection,
     logger: logging.Logger,
-    qs: List,
+    mailboxes: List,
     command_q: queue.Queue,
-    socket_control_q: queue.Queue,
-) -> None:
-    print("\n")
-    data_packet, sensor_ip = sock.recvfrom(1024)
-    sensor_port = sock.getsockname()[1]
-    logger.info(
-        f"data_packet from {sensor_ip} on port {sensor_port}: {data_packet}"
-    )
-    timestamp = datetime.datetime.now()
-    data_packet = [timestamp, data_packet]
-
-    # spin over all the inputs
-    for idx, input in enumerate(settings["inputs"]):
-        # check which sensor corresponds to the incoming packets
-
-        if sensor_port == input["port"]:
-            # load the sensors assigned queue
-            q = qs[idx]
-
-            # drain the q
-            while True:
-                try:
-                    _ = q.get(block=False)
-                except queue.Empty:
-                    break
-            # put new data in q
-            q.put(data_packet, block=False)
-            logger.debug(f"data put in q{idx}")
-
-            if input["name"] == "controller":
-                # logger.info(data_packet[1].decode())
-                command_q.put(data_packet[1].decode())
+    session_recorder: Optional[recorder.Recorder] = None,
+) -> int:
+    """drains every datagram waiting on the connection's socket into its
+    reusable buffer, then writes only the newest one to the input's mailbox.
+    each packet is stamped with its kernel receive time, or the monotonic
+    clock as it comes out of the socket, on the clock module's clock
+
+    Args:
+        conn (socket_connections.Connection): [bound, non-blocking input]
+        logger (logging.Logger): [the logger for debug_logging]
+        mailboxes (List): [one mailbox per input, indexed by conn.index]
+        command_q (queue.Queue): [controller commands for main]
+        session_recorder (recorder.Recorder, optional): [gets every sensor
+        packet, not just the newest]
+
+    every packet also goes to the connection's forward route, if it has one
+
+    Returns:
+        int: [number of datagrams read]
+    """
+    sock = conn.sock
+    buffer = conn.buffer
+    buffers = conn.buffers
+    view = conn.view
+    decoder = conn.decoder
+    forward = conn.forward
+    input_stats = conn.stats
+    is_controller = conn.name == "controller"
+    if is_controller:
+        session_recorder = None
+    if input_stats is not None:
+        started = time.perf_counter_ns()
+    kernel_stamps = conn.kernel_stamps
+    if kernel_stamps:
+        shift = clock.kernel_shift()
+        ancillary_size = clock.ANCILLARY_SIZE
+        unpack_timespec = clock.TIMESPEC.unpack
+    monotonic_ns = time.monotonic_ns
+    offset = clock.OFFSET
+    log_packets = logger.isEnabledFor(logging.INFO)
+    count = 0
+    nbytes = 0
+    total = 0
+    timestamp = 0
+    while True:
+        try:
+            if kernel_stamps:
+                nbytes, ancdata, _, sensor_ip = sock.recvmsg_into(
+                    buffers, ancillary_size
+                )
+                # the timestamp is the only ancillary data asked for
+                if ancdata:
+                    seconds, nanoseconds = unpack_timespec(ancdata[0][2])
+                    timestamp = seconds * 1_000_000_000 + nanoseconds + shift
+                else:
+                    timestamp = monotonic_ns() + offset
+            elif log_packets:
+                nbytes, sensor_ip = sock.recvfrom_into(buffer)
+                timestamp = monotonic_ns() + offset
+            else:
+                # the sender address is only wanted for the log
+                nbytes = sock.recv_into(buffer)
+                timestamp = monotonic_ns() + offset
+        except (BlockingIOError, InterruptedError):
+            break
+        if log_packets:
+            logger.info(
+                "data_packet from %s on port %s: %s",
+                sensor_ip,
+                conn.port,
+                bytes(view[:nbytes]),
+            )
+        count += 1
+        total += nbytes
+        if decoder is not None:
+            decoder.add(view[:nbytes], timestamp)
+        if forward is not None:
+            # before the next receive reuses the buffer
+            forward.send(view[:nbytes])
+        if session_recorder is not None:
+            session_recorder.add(conn.name, timestamp, view[:nbytes])
+        if is_controller:
+            # every command matters, not just the newest
+            command_q.put(str(view[:nbytes], "utf-8"))
+
+    if count == 0:
+        return 0
+    if input_stats is not None:
+        drained = decoded = time.perf_counter_ns()
+    if decoder is not None:
+        # everything drained in this wakeup is decoded as one batch
+        decoder.flush()
+        if input_stats is not None:
+            decoded = time.perf_counter_ns()
+
+    # overwrite the sensors assigned mailbox, readers only want the newest
+    mailboxes[conn.index].write(view[:nbytes], timestamp)
+    logger.debug("data put in mb%d", conn.index)
+    if input_stats is not None:
+        pending = input_stats.pending
+        pending.append(
+            (started, drained, decoded, time.perf_counter_ns(), count, total)
+        )
+        if is_controller:
+            input_stats.commands += count
+        if len(pending) >= stats.FOLD_AT:
+            input_stats.fold()
+    return count
 
 
 def main() -> None:
@@ -120,55 +269,207 @@ def main() -> None:
     )
     # logger_pass_queue = queue.Queue(maxsize=1)
     log_name = debug_logger.get_new_log_file_name("log", "debug", "log")
-    logger = debug_logger.init_logger(__name__, debug_level, log_name)
+    logger = debug_logger.init_logger(
+        __name__, debug_level, log_name, settings["async_logging"]
+    )
     # logger_pass_queue.put(logger)
-    qs = create_queues(len(settings["inputs"]), logger)
+    mailboxes = create_mailboxes(len(settings["inputs"]), logger)
+    shard_groups = shard_receiver.start_shards(settings, mailboxes, logger)
+    overlay = settings["overlay"]
+    decoders = {
+        overlay["input"]: overlay_decoder.OverlayDecoder(overlay, logger)
+    }
+    session_recorder = recorder.Recorder(
+        settings["recording"],
+        [conn["name"] for conn in settings["inputs"]],
+        logger,
+        settings.get("disk"),
+    )
+    ingest_stats = stats.Stats()
+    for name, decoder in decoders.items():
+        ingest_stats.add_source(
+            f"decoder_{name}",
+            lambda decoder=decoder: {
+                "decoded": decoder.decoded,
+                "malformed": decoder.malformed,
+            },
+        )
+    ingest_stats.add_source(
+        "preroll",
+        lambda: {
+            "records": len(session_recorder.preroll.records),
+            "bytes": session_recorder.preroll.size,
+            "evicted": session_recorder.preroll.evicted,
+        },
+    )
+    ingest_stats.add_source(
+        "recorder", lambda: {"dropped": session_recorder.dropped}
+    )
+    ingest_stats.add_source(
+        "logging", lambda: {"dropped": debug_logger.dropped(logger)}
+    )
+    ingest_stats.add_source(
+        "shards",
+        lambda: {name: group.dropped for name, group in shard_groups.items()},
+    )
+    outputs = forwarder.Forwarder(settings, logger)
+    ingest_stats.add_source("outputs", outputs.counters)
+    ingest_stats.add_source("disk", disk_writer.counters)
+    # rotated logs and stats are compressed and aged out in the background
+    retention_process, retention_counters, retention_stop = (
+        retention.start_retention(settings, logger)
+    )
+    ingest_stats.add_source(
+        "retention", lambda: retention.read_counters(retention_counters)
+    )
+    stats_settings = settings["stats"]
+    stats_server = stats.StatsServer(
+        ingest_stats, stats_settings["ip"], stats_settings["port"]
+    )
+    stats_name = debug_logger.get_new_log_file_name(
+        stats_settings["folder"], "stats", "jsonl"
+    )
     command_q: queue.SimpleQueue = queue.SimpleQueue()
     socket_control_q: queue.SimpleQueue = queue.SimpleQueue()
     # video_control_q: queue.SimpleQueue = queue.SimpleQueue()
+    rings, capture_processes, capture_stop = camera_capture.start_cameras(
+        settings, logger
+    )
+    mosaic_ring, mosaic_process, mosaic_counters, mosaic_stop = (
+        mosaic.start_mosaic(settings, rings, logger)
+    )
+    ingest_stats.add_source(
+        "mosaic", lambda: mosaic.read_counters(mosaic_counters)
+    )
+    # the cameras, the mosaic or both, as the encoder and preview see them
+    stream_settings, stream_rings = mosaic.streams(
+        settings, rings, mosaic_ring
+    )
+    board = backpressure.Board(backpressure.stage_names(stream_settings))
+    policy = backpressure.Policy(
+        board, settings.get("backpressure", {}), logger
+    )
+    ingest_stats.add_source("backpressure", policy.counters)
+    encoder = video_encoder.SegmentEncoder(
+        stream_settings, stream_rings, logger, board
+    )
+    ingest_stats.add_source("recording", encoder.counters)
+    preview_process, preview_stop = preview.start_preview(
+        stream_settings, stream_rings, board, logger
+    )
+    # socket pair used to wake the socket server out of its blocking select
+    wakeup_recv, wakeup_send = socket.socketpair()
+    wakeup_recv.setblocking(False)
     server_thread = threading.Thread(
         name="socket_server",
         target=socket_server,
-        args=(settings, logger, qs, command_q, socket_control_q),
+        args=(
+            settings,
+            logger,
+            mailboxes,
+            command_q,
+            socket_control_q,
+            wakeup_recv,
+            decoders,
+            session_recorder,
+            ingest_stats,
+            stats_server,
+            shard_groups,
+            outputs,
+        ),
     )
     server_thread.start()
 
-    start_time = datetime.datetime.now()
+    # the rotation deadline is on the monotonic clock so it is not moved
+    # by wall clock changes
+    rotate_at = time.monotonic() + log_length.total_seconds()
+    stats_at = time.monotonic() + stats_settings["interval"]
+    policy_at = time.monotonic() + policy.interval
     log = False
 
     while True:
-        if not command_q.empty():
-            command = command_q.get(block=False)
-            logger.warning(f"COMMAND RECEIVED: {command}")
-
-            if command == "start":
-                log = True
-                logger.warning(f"LOG_STATUS: {log}")
-            elif command == "stop":
-                log = False
-                logger.warning(f"LOG_STATUS: {log}")
-            elif command == "close":
-                logger.warning(f"SHUTTING DOWN: {log}")
-                socket_control_q.put(None)
-                # video_control_q.put(None)
-                break
-            else:
-                pass
-
-        current_time = datetime.datetime.now()
-
-        if current_time - start_time > log_length:
+        # sleep until a command arrives or the log file is due to rotate
+        try:
+            command = command_q.get(
+                timeout=max(
+                    0.0,
+                    min(rotate_at, stats_at, policy_at) - time.monotonic(),
+                )
+            )
+        except queue.Empty:
+            if time.monotonic() >= policy_at:
+                policy.evaluate()
+                policy_at = time.monotonic() + policy.interval
+            if time.monotonic() >= stats_at:
+                ingest_stats.write(str(stats_name))
+                stats_at = time.monotonic() + stats_settings["interval"]
+            if time.monotonic() < rotate_at:
+                continue
             log_name = debug_logger.get_new_log_file_name(
                 "log", "debug", "log"
             )
             logger = debug_logger.update_handler(logger, log_name)
             logger.info(f"logger init {log_name}")
-            start_time = current_time
+            stats_name = debug_logger.get_new_log_file_name(
+                stats_settings["folder"], "stats", "jsonl"
+            )
+            # recordings rotate on the same boundaries as the log
+            session_recorder.rotate()
+            encoder.rotate()
+            rotate_at = time.monotonic() + log_length.total_seconds()
+            continue
+
+        logger.warning(f"COMMAND RECEIVED: {command}")
+
+        if command == "start":
+            log = True
+            session = session_recorder.start()
+            encoder.start(
+                session,
+                time.time() - settings["recording"]["preroll_seconds"],
+            )
+            logger.warning(f"LOG_STATUS: {log}")
+        elif command == "stop":
+            log = False
+            encoder.stop()
+            session_recorder.stop()
+            logger.warning(f"LOG_STATUS: {log}")
+        elif command == "close":
+            logger.warning(f"SHUTTING DOWN: {log}")
+            encoder.stop()
+            session_recorder.stop()
+            socket_control_q.put(None)
+            wake(wakeup_send)
+            # video_control_q.put(None)
+            break
         else:
-            logger = logger
+            pass
 
     server_thread.join()
+    ingest_stats.write(str(stats_name))
+    stats_server.close()
+    shard_receiver.stop_shards(shard_groups, logger)
+    outputs.close()
+    encoder.close()
+    preview.stop_preview(preview_process, preview_stop, logger)
+    mosaic.stop_mosaic(
+        mosaic_process, mosaic_ring, mosaic_counters, mosaic_stop, logger
+    )
+    camera_capture.stop_cameras(
+        rings, capture_processes, capture_stop, logger
+    )
+    retention.stop_retention(
+        retention_process, retention_counters, retention_stop, logger
+    )
+    board.close()
+    wakeup_recv.close()
+    wakeup_send.close()
+    for idx, box in enumerate(mailboxes):
+        box.close()
+        logger.debug(f"SHUTTING DOWN: mb{idx} closed")
+    debug_logger.stop_logger(logger)
 
 
 if __name__ == "__main__":
+    multiprocessing.set_start_method("spawn")
     main()
@@ -0,0 +1,401 @@
+from typing import Dict, List, Optional, Tuple
+import json
+import logging
+import math
+import multiprocessing
+import time
+
+import cv2
+import numpy as np
+
+import frame_ring
+import shared_mailbox
+import stats
+
+# defaults for the "mosaic" section of config.json. there is none in the
+# shipped config, one with "replace" set records the tiled stream alone,
+# one encode in place of one per camera, without it the mosaic is a
+# stream more on top of the cameras
+NAME = "mosaic"
+WIDTH = 1280
+HEIGHT = 720
+FPS = 25
+RING_SLOTS = 16
+# grey level of the canvas outside the tiles
+BACKGROUND = 0
+# seconds between the compositor's counters going to main
+COUNTERS_INTERVAL = 1.0
+COUNTERS_BYTES = 4096
+
+
+def layout(
+    shapes: List[Tuple[int, int, int]], width: int, height: int
+) -> List[Tuple[int, int, int, int]]:
+    """[a tile per frame shape on a grid as near square as the count
+    allows, each tile as big as its cell lets it be without changing the
+    frame's aspect ratio, centred in the cell
+
+    Returns:
+        List[Tuple[int, int, int, int]]: [top, left, height and width of
+        each tile]
+    """
+    columns = max(1, math.ceil(math.sqrt(len(shapes))))
+    rows = max(1, math.ceil(len(shapes) / columns))
+    cell_width, cell_height = width // columns, height // rows
+    tiles = []
+    for idx, shape in enumerate(shapes):
+        scale = min(cell_width / shape[1], cell_height / shape[0])
+        tile_width = max(1, min(cell_width, round(shape[1] * scale)))
+        tile_height = max(1, min(cell_height, round(shape[0] * scale)))
+        row, column = divmod(idx, columns)
+        top = row * cell_height + (cell_height - tile_height) // 2
+        left = column * cell_width + (cell_width - tile_width) // 2
+        tiles.append((top, left, tile_height, tile_width))
+    return tiles
+
+
+def mosaic_camera(settings: Dict) -> Dict:
+    """[the mosaic as a camera, for the encoder and the preview. a
+    "motion" section in the mosaic's settings gates its recording]"""
+    mosaic = settings["mosaic"]
+    camera = {
+        "name": mosaic.get("name", NAME),
+        "width": mosaic.get("width", WIDTH),
+        "height": mosaic.get("height", HEIGHT),
+        "fps": mosaic.get("fps", FPS),
+        "ring_slots": mosaic.get("ring_slots", RING_SLOTS),
+    }
+    if "motion" in mosaic:
+        camera["motion"] = mosaic["motion"]
+    return camera
+
+
+class Compositor:
+    def __init__(
+        self,
+        settings: Dict,
+        rings: List[frame_ring.FrameRing],
+    ) -> None:
+        """[tiles the newest frame of each of the mosaic's cameras into a
+        canvas allocated once. a camera's frame is resized straight into
+        its tile of the canvas, and only when it has a new one, a slower
+        camera's tile keeps its last frame. nothing is allocated per frame
+
+        Args:
+            settings (Dict): [package configuration file]
+            rings (List[frame_ring.FrameRing]): [frame rings in
+            settings["cameras"] order]
+        """
+        mosaic = settings["mosaic"]
+        camera = mosaic_camera(settings)
+        names = mosaic.get(
+            "cameras", [camera["name"] for camera in settings["cameras"]]
+        )
+        by_name = {
+            camera["name"]: ring
+            for camera, ring in zip(settings["cameras"], rings)
+        }
+        self.rings = [by_name[name] for name in names]
+        self.canvas = np.full(
+            (camera["height"], camera["width"], 3),
+            mosaic.get("background", BACKGROUND),
+            np.uint8,
+        )
+        tiles = layout(
+            [ring.shape for ring in self.rings],
+            camera["width"],
+            camera["height"],
+        )
+        # per camera, its tile as a view of the canvas and how to resize
+        # into it. halving with INTER_LINEAR is an exact 2x2 average and
+        # cheaper than INTER_AREA, which is kept for other shrinks
+        self.tiles: List[np.ndarray] = []
+        self.interpolations: List[int] = []
+        for ring, (top, left, height, width) in zip(self.rings, tiles):
+            self.tiles.append(
+                self.canvas[top : top + height, left : left + width]
+            )
+            shrink = width < ring.shape[1] and 2 * width != ring.shape[1]
+            self.interpolations.append(
+                cv2.INTER_AREA if shrink else cv2.INTER_LINEAR
+            )
+        # newest frame number drawn per camera
+        self.shown = [-1] * len(self.rings)
+        self.frames = 0
+        self.redrawn = 0
+        self.torn = 0
+        self.compose_ns = stats.Histogram()
+        self.pending: List[int] = []
+
+    def draw(self, idx: int) -> bool:
+        """[resize the camera's newest frame into its tile
+
+        Returns:
+            bool: [False if there was nothing new or it was overwritten
+            while being read]
+        """
+        ring = self.rings[idx]
+        number = ring.count - 1
+        if number <= self.shown[idx]:
+            return False
+        got = ring.get(number)
+        if got is None:
+            return False
+        tile = self.tiles[idx]
+        cv2.resize(
+            got[1],
+            (tile.shape[1], tile.shape[0]),
+            dst=tile,
+            interpolation=self.interpolations[idx],
+        )
+        # the slot view goes straight away, the ring never waits for us
+        got = None
+        if not ring.valid(number):
+            self.torn += 1
+            return False
+        self.shown[idx] = number
+        return True
+
+    def compose(self) -> int:
+        """[bring the canvas up to date
+
+        Returns:
+            int: [tiles redrawn]
+        """
+        start = time.perf_counter_ns()
+        count = 0
+        for idx in range(len(self.rings)):
+            # a torn tile is drawn again from the frame after
+            if self.draw(idx) or (
+                self.shown[idx] < self.rings[idx].count - 1 and self.draw(idx)
+            ):
+                count += 1
+        self.frames += 1
+        self.redrawn += count
+        self.pending.append(time.perf_counter_ns() - start)
+        if len(self.pending) >= stats.FOLD_AT:
+            self.fold()
+        return count
+
+    def publish(self, ring: frame_ring.FrameRing) -> int:
+        """[compose and copy the canvas into the mosaic's ring
+
+        Returns:
+            int: [the mosaic frame's number]
+        """
+        self.compose()
+        np.copyto(ring.begin(), self.canvas)
+        return ring.commit(time.time())
+
+    def fold(self) -> None:
+        if self.pending:
+            self.compose_ns.record(np.array(self.pending, np.int64))
+            self.pending = []
+
+    def counters(self) -> Dict:
+        self.fold()
+        return {
+            "frames": self.frames,
+            "redrawn": self.redrawn,
+            "torn": self.torn,
+            "compose_ns": self.compose_ns.summary(),
+        }
+
+    def close(self) -> None:
+        self.tiles = self.canvas = None
+        for ring in self.rings:
+            ring.close()
+
+
+def mosaic_process(
+    settings: Dict,
+    rings: List[frame_ring.FrameRing],
+    out: frame_ring.FrameRing,
+    counters: shared_mailbox.Mailbox,
+    stop: multiprocessing.Event,
+) -> None:
+    """[the compositor's own process, a mosaic frame every 1 / fps
+    seconds into out, its counters into the counters mailbox every
+    COUNTERS_INTERVAL]"""
+    logger = logging.getLogger("mosaic")
+    compositor = Compositor(settings, rings)
+    interval = 1 / mosaic_camera(settings)["fps"]
+    next_frame = time.monotonic()
+    next_counters = next_frame + COUNTERS_INTERVAL
+    while not stop.is_set():
+        compositor.publish(out)
+        now = time.monotonic()
+        if now >= next_counters:
+            counters.write(json.dumps(compositor.counters()).encode(), now)
+            next_counters = now + COUNTERS_INTERVAL
+        # a late frame pushes the schedule back rather than bunching up
+        next_frame = max(next_frame + interval, now)
+        stop.wait(max(0.0, next_frame - time.monotonic()))
+    summary = compositor.counters()
+    counters.write(json.dumps(summary).encode(), time.monotonic())
+    logger.info(
+        f"mosaic stopped, {summary['frames']} frames, "
+        f"{summary['compose_ns']['p50'] / 1e6:.2f} ms median to compose"
+    )
+    compositor.close()
+    out.close()
+    counters.close()
+
+
+def start_mosaic(
+    settings: Dict,
+    rings: List[frame_ring.FrameRing],
+    logger: logging.Logger,
+) -> Tuple[
+    Optional[frame_ring.FrameRing],
+    Optional[multiprocessing.Process],
+    Optional[shared_mailbox.Mailbox],
+    multiprocessing.Event,
+]:
+    """[the compositor process, if config.json has a "mosaic" section.
+    mosaic cameras that are not in "cameras" are left out, with none left
+    there is no mosaic
+
+    Returns:
+        Tuple: [the mosaic's ring, the process, the mailbox its counters
+        come in and the event that stops it, all but the event None
+        without a mosaic]
+    """
+    stop = multiprocessing.Event()
+    if "mosaic" not in settings:
+        return None, None, None, stop
+    mosaic = settings["mosaic"]
+    names = [camera["name"] for camera in settings["cameras"]]
+    known = []
+    for name in mosaic.get("cameras", names):
+        if name in names:
+            known.append(name)
+        else:
+            logger.warning(f"mosaic camera {name} is not a camera, left out")
+    if not known:
+        logger.warning("no cameras for the mosaic, it is not started")
+        return None, None, None, stop
+    settings = dict(settings, mosaic=dict(mosaic, cameras=known))
+    camera = mosaic_camera(settings)
+    ring = frame_ring.FrameRing(
+        camera["ring_slots"], (camera["height"], camera["width"], 3)
+    )
+    counters = shared_mailbox.Mailbox(COUNTERS_BYTES)
+    process = multiprocessing.Process(
+        name=camera["name"],
+        target=mosaic_process,
+        args=(settings, rings, ring, counters, stop),
+        daemon=True,
+    )
+    process.start()
+    logger.info(f"mosaic process started for {camera['name']}")
+    return ring, process, counters, stop
+
+
+def streams(
+    settings: Dict,
+    rings: List[frame_ring.FrameRing],
+    ring: Optional[frame_ring.FrameRing],
+) -> Tuple[Dict, List[frame_ring.FrameRing]]:
+    """[what is recorded and previewed: the cameras, and the mosaic after
+    them, or only the mosaic with "replace" set
+
+    Returns:
+        Tuple[Dict, List[frame_ring.FrameRing]]: [settings with "cameras"
+        swapped for the streams, and their rings]
+    """
+    if ring is None:
+        return settings, rings
+    cameras, stream_rings = list(settings["cameras"]), list(rings)
+    if settings["mosaic"].get("replace", False):
+        cameras, stream_rings = [], []
+    cameras.append(mosaic_camera(settings))
+    stream_rings.append(ring)
+    return dict(settings, cameras=cameras), stream_rings
+
+
+def read_counters(counters: Optional[shared_mailbox.Mailbox]) -> Dict:
+    """[the compositor's latest counters, for the stats]"""
+    if counters is None or not counters.count:
+        return {}
+    return json.loads(counters.read()[2])
+
+
+def stop_mosaic(
+    process: Optional[multiprocessing.Process],
+    ring: Optional[frame_ring.FrameRing],
+    counters: Optional[shared_mailbox.Mailbox],
+    stop: multiprocessing.Event,
+    logger: logging.Logger,
+) -> None:
+    stop.set()
+    if process is None:
+        return
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    ring.close()
+    counters.close()
+    logger.debug("SHUTTING DOWN: mosaic stopped")
+
+
+if __name__ == "__main__":
+    # testing code, four 720p cameras at different frame rates into a
+    # 1280x720 mosaic, the cost of each mosaic frame
+    import camera_capture
+
+    cameras = [
+        {"name": f"camera{num}", "width": 1280, "height": 720, "fps": fps}
+        for num, fps in enumerate((25, 25, 10, 5), 1)
+    ]
+    settings = {"cameras": cameras, "mosaic": {}}
+    sources = []
+    for camera in cameras:
+        ring = frame_ring.FrameRing(4, camera_capture.frame_shape(camera))
+        source = camera_capture.SyntheticCamera(camera)
+        source.interval = 0
+        sources.append((ring, source, camera["fps"]))
+    compositor = Compositor(settings, [ring for ring, _, _ in sources])
+    out = frame_ring.FrameRing(4, compositor.canvas.shape)
+    count = 250
+    publish_ns = 0
+    for number in range(count):
+        # a camera at fps has a new frame in this many mosaic frames
+        for ring, source, fps in sources:
+            if number % (FPS // fps) == 0:
+                source.read(ring.begin())
+                ring.commit(time.time())
+        start = time.perf_counter_ns()
+        compositor.publish(out)
+        publish_ns += time.perf_counter_ns() - start
+    # every tile resized into new arrays and stacked, every frame
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        small = [
+            cv2.resize(ring.get(ring.count - 1)[1], (640, 360))
+            for ring, _, _ in sources
+        ]
+        np.vstack([np.hstack(small[:2]), np.hstack(small[2:])])
+    naive_ns = (time.perf_counter_ns() - start) / count
+    small = None
+    # what recording the mosaic saves, one encode instead of four
+    start = time.perf_counter_ns()
+    for _ in range(20):
+        cv2.imencode(".jpg", compositor.canvas)
+    encode_ns = (time.perf_counter_ns() - start) / 20
+    summary = compositor.counters()
+    compose = summary["compose_ns"]
+    print(
+        f"compose: p50 {compose['p50'] / 1e6:.2f} ms, p99 "
+        f"{compose['p99'] / 1e6:.2f} ms, {summary['redrawn'] / count:.1f} "
+        "tiles redrawn a frame"
+    )
+    print(f"compose and copy out: {publish_ns / count / 1e6:.2f} ms/frame")
+    print(f"resize all and stack: {naive_ns / 1e6:.2f} ms/frame")
+    print(
+        f"jpeg of a 720p frame: {encode_ns / 1e6:.2f} ms, "
+        f"{len(cameras)} streams {len(cameras) * encode_ns / 1e6:.2f} ms"
+    )
+    compositor.close()
+    out.close()
@@ -0,0 +1,191 @@
+from typing import Dict, Tuple
+import math
+import struct
+import time
+
+import cv2
+import numpy as np
+
+# defaults for a camera's "motion" section of config.json
+# width of the grey copy frames are compared on
+WIDTH = 160
+# grey levels a pixel has to change by to count as changed
+PIXEL_THRESHOLD = 12
+# share of pixels changed that starts motion, and under which the scene
+# counts as still. in between, the gate stays as it is
+START = 0.01
+STOP = 0.002
+# still for this long before recording slows down
+HOLD_SECONDS = 2.0
+# seconds between frames recorded while still, 0 records none
+STILL_INTERVAL = 1.0
+# primed, moving, still since (nan for not still), kept at, then the grey
+# copy of the last frame
+STATE = struct.Struct("<??dd")
+
+
+class MotionGate:
+    def __init__(self, motion: Dict, shape: Tuple[int, int, int]) -> None:
+        """[decides which of a camera's frames are worth recording. each
+        frame is shrunk to a small grey copy and compared with the one
+        before it. while the scene moves every frame is kept, once it has
+        been still for hold seconds only one frame every still interval
+        is. the first frame that moves is kept itself, so recording is
+        back to full rate within a frame
+
+        Args:
+            motion (Dict): [the camera's "motion" section of config.json]
+            shape (Tuple[int, int, int]): [frame shape, from
+            camera_capture.frame_shape]
+        """
+        height, width = shape[:2]
+        small_width = min(motion.get("width", WIDTH), width)
+        small_height = max(1, round(height * small_width / width))
+        self.threshold = motion.get("pixel_threshold", PIXEL_THRESHOLD)
+        self.start = motion.get("start", START)
+        self.stop = motion.get("stop", STOP)
+        self.hold = motion.get("hold_seconds", HOLD_SECONDS)
+        self.still_interval = motion.get("still_interval", STILL_INTERVAL)
+        # a linear resize to twice the size then an exact halving, each
+        # grey pixel is an average of a few and sensor noise mostly cancels
+        self.sizes = [(small_width, small_height)]
+        if width >= 4 * small_width and height >= 4 * small_height:
+            self.sizes.insert(0, (2 * small_width, 2 * small_height))
+        self.colour = np.zeros((small_height, small_width, 3), np.uint8)
+        # grey copies of this frame and the one before, swapped each frame
+        self.grey = np.zeros((small_height, small_width), np.uint8)
+        self.previous = np.zeros_like(self.grey)
+        self.diff = np.zeros((small_height, small_width), np.int16)
+        self.pixels = small_width * small_height
+        self.primed = False
+        self.moving = True
+        self.still_since = None
+        self.kept_at = float("-inf")
+        self.share = 0.0
+        self.frames = 0
+        self.kept = 0
+        self.starts = 0
+        # time spent deciding (ns)
+        self.cost_ns = 0
+
+    def state(self) -> bytes:
+        """[what a gate needs to carry on where this one stopped, so the
+        next segment's gate does not start out moving]"""
+        still_since = self.still_since
+        if still_since is None:
+            still_since = math.nan
+        return (
+            STATE.pack(self.primed, self.moving, still_since, self.kept_at)
+            + self.grey.tobytes()
+        )
+
+    def resume(self, state: bytes) -> None:
+        """[carry on from another gate's state, of a gate with the same
+        settings and frame shape]"""
+        primed, moving, still_since, kept_at = STATE.unpack_from(state)
+        self.primed = primed
+        self.moving = moving
+        self.still_since = None if math.isnan(still_since) else still_since
+        self.kept_at = kept_at
+        # changed swaps it into previous before the next frame
+        grey = np.frombuffer(state, np.uint8, offset=STATE.size)
+        self.grey[...] = grey.reshape(self.grey.shape)
+
+    def changed(self, frame: np.ndarray) -> float:
+        """[share of the grey copy's pixels that changed since the last
+        frame, 1 for the first]"""
+        small = frame
+        for size in self.sizes:
+            out = self.colour if size == self.sizes[-1] else None
+            small = cv2.resize(
+                small, size, dst=out, interpolation=cv2.INTER_LINEAR
+            )
+        self.grey, self.previous = self.previous, self.grey
+        cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self.grey)
+        if not self.primed:
+            self.primed = True
+            return 1.0
+        np.subtract(self.grey, self.previous, out=self.diff, dtype=np.int16)
+        np.abs(self.diff, out=self.diff)
+        return np.count_nonzero(self.diff > self.threshold) / self.pixels
+
+    def keep(self, frame: np.ndarray, timestamp: float) -> bool:
+        """[whether the frame taken at timestamp (s) is to be recorded]"""
+        start = time.perf_counter_ns()
+        self.share = share = self.changed(frame)
+        if share >= self.start:
+            if not self.moving:
+                self.starts += 1
+            self.moving = True
+            self.still_since = None
+        elif share < self.stop:
+            if self.still_since is None:
+                self.still_since = timestamp
+            if self.moving and timestamp - self.still_since >= self.hold:
+                self.moving = False
+        else:
+            # not still enough to count towards the hold
+            self.still_since = None
+        keep = self.moving or (
+            self.still_interval > 0
+            and timestamp - self.kept_at >= self.still_interval
+        )
+        if keep:
+            self.kept_at = timestamp
+            self.kept += 1
+        self.frames += 1
+        self.cost_ns += time.perf_counter_ns() - start
+        return keep
+
+
+if __name__ == "__main__":
+    # testing code, a minute of 720p at 25 fps that is still but for
+    # sensor noise apart from 10 seconds of something moving across it,
+    # gated and then encoded as it would be recorded
+    import os
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    shape = (720, 1280, 3)
+    fps = 25
+    scene = rng.integers(40, 200, shape, np.uint8)
+    scene = cv2.GaussianBlur(scene, (0, 0), 6)
+    noise = [
+        rng.integers(-6, 7, shape, np.int16).astype(np.int8)
+        for _ in range(4)
+    ]
+    frames = 60 * fps
+    folder = tempfile.mkdtemp()
+    encode_ns = {"all": 0, "gated": 0}
+    sizes = {}
+    for mode in ("all", "gated"):
+        gate = MotionGate({}, shape)
+        path = os.path.join(folder, f"{mode}.avi")
+        writer = cv2.VideoWriter(
+            path, cv2.VideoWriter_fourcc(*"MJPG"), fps, shape[1::-1]
+        )
+        frame = np.empty(shape, np.uint8)
+        for number in range(frames):
+            np.add(scene, noise[number % 4], out=frame, casting="unsafe")
+            if 20 * fps <= number < 30 * fps:
+                left = (number - 20 * fps) * 4
+                frame[300:420, left : left + 120] = 255
+            if mode == "gated" and not gate.keep(frame, number / fps):
+                continue
+            start = time.perf_counter_ns()
+            writer.write(frame)
+            encode_ns[mode] += time.perf_counter_ns() - start
+        writer.release()
+        sizes[mode] = os.path.getsize(path)
+        os.remove(path)
+    os.rmdir(folder)
+    print(
+        f"kept {gate.kept} of {gate.frames} frames, motion started "
+        f"{gate.starts} times, {gate.cost_ns / gate.frames / 1e3:.0f} us "
+        "a frame to decide"
+    )
+    print(
+        f"encode {encode_ns['all'] / 1e9:.1f} s -> "
+        f"{(encode_ns['gated'] + gate.cost_ns) / 1e9:.1f} s with the gate, "
+        f"{sizes['all'] / 1e6:.0f} MB -> {sizes['gated'] / 1e6:.0f} MB"
+    )
@@ -0,0 +1,370 @@
+from typing import Dict, List, Union
+import logging
+
+import numpy as np
+
+import clock
+
+# numpy column type for each schema field type, text is stored as a code
+# into the decoder's table of interned strings
+FIELD_TYPES = {"datetime": "M8[ms]", "float": "f8", "text": "i4"}
+# default width, in bytes, kept of a text field
+TEXT_SIZE = 64
+# interned strings kept before the table is cut back to the ones the ring
+# still holds, free text that never repeats would grow it for ever
+MAX_TEXTS = 4096
+# below this many packets numpy's per call overhead costs more than the
+# row by row parse
+MIN_BATCH = 32
+COMMA = ord(",")
+NEWLINE = ord("\n")
+
+
+def build_dtype(fields: List[Dict]) -> np.dtype:
+    """[record layout for a field schema, every record also carries the
+    time its packet was received (ns, on the clock module's clock)]
+
+    Args:
+        fields (List[Dict]): [{"name": str, "type": "datetime" | "float" |
+        "text"} in packet order]
+
+    Returns:
+        np.dtype: [structured dtype with one column per field]
+    """
+    columns = [("received", "i8")]
+    for field in fields:
+        columns.append((field["name"], FIELD_TYPES[field["type"]]))
+    return np.dtype(columns)
+
+
+def renumber_texts(records: np.ndarray, fields: List[Dict]) -> np.ndarray:
+    """[renumber the text codes of records, in place, to count from 0 over
+    only the codes they hold
+
+    Args:
+        records (np.ndarray): [records of build_dtype(fields)]
+        fields (List[Dict]): [the schema]
+
+    Returns:
+        np.ndarray: [the old code of each new one, sorted]
+    """
+    names = [field["name"] for field in fields if field["type"] == "text"]
+    if not names:
+        return np.zeros(0, dtype="i4")
+    codes = np.unique(np.concatenate([records[name] for name in names]))
+    for name in names:
+        records[name] = np.searchsorted(codes, records[name])
+    return codes
+
+
+def gather(blob: np.ndarray, start: np.ndarray, end: np.ndarray, size: int):
+    """[copies variable length byte spans into a fixed width string array,
+    padded with NUL and truncated at size]"""
+    idx = start[:, None] + np.arange(size)
+    out = blob[np.minimum(idx, len(blob) - 1)]
+    out[idx >= end[:, None]] = 0
+    return out.view(f"S{size}").ravel()
+
+
+class OverlayRing:
+    def __init__(self, dtype: np.dtype, capacity: int) -> None:
+        """[fixed size ring of decoded records. every record is stored twice,
+        at its slot and at slot + capacity, so the newest records are always
+        one contiguous slice and can be handed out as a view]
+
+        Args:
+            dtype (np.dtype): [record layout from build_dtype]
+            capacity (int): [number of records kept]
+        """
+        self.capacity = capacity
+        self.data = np.zeros(capacity * 2, dtype=dtype)
+        # slot the next record goes in
+        self.head = 0
+        # records written since start up
+        self.total = 0
+
+    def extend(self, records: np.ndarray) -> None:
+        capacity = self.capacity
+        if len(records) > capacity:
+            records = records[-capacity:]
+        count = len(records)
+        first = min(count, capacity - self.head)
+        for offset in (0, capacity):
+            start = self.head + offset
+            self.data[start : start + first] = records[:first]
+            self.data[offset : offset + count - first] = records[first:]
+        self.head = (self.head + count) % capacity
+        self.total += count
+
+    def last(self, count: int) -> np.ndarray:
+        """[view of the newest count records, oldest first. the view is
+        overwritten as the ring wraps, copy it to keep it]"""
+        count = min(count, self.total, self.capacity)
+        end = self.head + self.capacity
+        return self.data[end - count : end]
+
+
+class OverlayDecoder:
+    def __init__(self, overlay: Dict, logger: logging.Logger) -> None:
+        """[parses overlay packets, comma separated fields in the order of
+        the schema, in batches into an OverlayRing]
+
+        Args:
+            overlay (Dict): [the "overlay" section of config.json]
+            logger (logging.Logger): [the logger for debug_logging]
+        """
+        self.logger = logger
+        self.fields = overlay["fields"]
+        self.dtype = build_dtype(self.fields)
+        capacity = int(overlay["rate"] * overlay["buffer_seconds"])
+        self.ring = OverlayRing(self.dtype, capacity)
+        # the ring is searched by the first datetime field, or by arrival
+        self.time_field = "received"
+        for field in self.fields:
+            if field["type"] == "datetime":
+                self.time_field = field["name"]
+                break
+        # datetime and float fields are parsed as one block, text apart
+        self.text_ids = [
+            idx
+            for idx, field in enumerate(self.fields)
+            if field["type"] == "text"
+        ]
+        self.parsed_ids = [
+            idx
+            for idx in range(len(self.fields))
+            if idx not in self.text_ids
+        ]
+        self.parsed_dtype = np.dtype(
+            [self.dtype.descr[idx + 1] for idx in self.parsed_ids]
+        )
+        # interned text, the ring holds indexes into this list
+        self.texts: List[str] = []
+        self.text_codes: Dict[bytes, int] = {}
+        self.max_texts = overlay.get("max_texts", MAX_TEXTS)
+        self.compactions = 0
+        self.pending: List[bytes] = []
+        self.pending_times: List[int] = []
+        self.decoded = 0
+        self.malformed = 0
+        logger.info(
+            f"overlay decoder {len(self.fields)} fields, {capacity} records"
+        )
+
+    def add(self, payload, timestamp: int = 0) -> None:
+        """[queue a packet for the next flush, payload may be a view into a
+        reused buffer so it is copied. timestamp is the packet's receive
+        time (ns), 0 for the time of the flush]"""
+        self.pending.append(bytes(payload).strip(b"\r\n"))
+        self.pending_times.append(timestamp)
+
+    def flush(self) -> int:
+        """[decode every queued packet into the ring in one batch]
+
+        Returns:
+            int: [number of records added]
+        """
+        if not self.pending:
+            return 0
+        packets = self.pending
+        self.pending = []
+        received = np.array(self.pending_times, dtype=np.int64)
+        self.pending_times = []
+        received[received == 0] = clock.now_ns()
+        records = self.decode(packets, received)
+        self.ring.extend(records)
+        self.decoded += len(records)
+        self.malformed += len(packets) - len(records)
+        if len(self.texts) > self.max_texts:
+            self.compact()
+        return len(records)
+
+    def compact(self) -> None:
+        """[cut the text table back to the texts the ring still holds. the
+        ring's codes are renumbered in place, so views of it stay good,
+        codes copied out of it before now are not]"""
+        codes = renumber_texts(self.ring.data, self.fields)
+        new = {int(old): code for code, old in enumerate(codes)}
+        self.texts = [self.texts[old] for old in codes]
+        self.text_codes = {
+            text: new[old]
+            for text, old in self.text_codes.items()
+            if old in new
+        }
+        self.compactions += 1
+
+    def intern(self, text: bytes) -> int:
+        code = self.text_codes.get(text)
+        if code is None:
+            code = len(self.texts)
+            self.texts.append(text.decode("utf-8", "replace"))
+            self.text_codes[text] = code
+        return code
+
+    def intern_column(
+        self, blob: np.ndarray, start: np.ndarray, end: np.ndarray, size: int
+    ) -> np.ndarray:
+        """[text codes for a column. text changes rarely, so only the rows
+        that differ from the row before are looked up, and the rest repeat
+        the code above them]"""
+        chars = gather(blob, start, end, size).view(np.uint8)
+        chars = chars.reshape(len(start), size)
+        changed = np.ones(len(start), dtype=bool)
+        changed[1:] = (chars[1:] != chars[:-1]).any(axis=1)
+        rows = np.flatnonzero(changed)
+        codes = np.empty(len(start), dtype="i4")
+        codes[rows] = [
+            self.intern(chars[row].tobytes().rstrip(b"\0")) for row in rows
+        ]
+        # carry each looked up code down to the unchanged rows below it
+        filled = np.where(changed, np.arange(len(start)), 0)
+        return codes[np.maximum.accumulate(filled)]
+
+    def decode(
+        self, packets: List[bytes], received: Union[int, np.ndarray]
+    ) -> np.ndarray:
+        """[vectorised parse of a batch of packets, each field is parsed for
+        every row at once. malformed packets are dropped
+
+        Args:
+            packets (List[bytes]): [one packet per row]
+            received (Union[int, np.ndarray]): [receive time of every packet
+            (ns), or one for them all]
+
+        Returns:
+            np.ndarray: [one record per good packet]
+        """
+        if len(packets) < MIN_BATCH:
+            return self.decode_naive(packets, received)
+        try:
+            return self._decode(packets, received)
+        except ValueError:
+            # some field would not parse, sort the good rows from the bad
+            return self.decode_naive(packets, received)
+
+    def _decode(
+        self, packets: List[bytes], received: Union[int, np.ndarray]
+    ) -> np.ndarray:
+        records = np.zeros(len(packets), dtype=self.dtype)
+        records["received"] = received
+        # numpy's C text reader does the datetime and float columns, commas
+        # inside a trailing text field only make extra columns it ignores
+        parsed = np.loadtxt(
+            packets,
+            dtype=self.parsed_dtype,
+            delimiter=",",
+            comments=None,
+            usecols=self.parsed_ids,
+            ndmin=1,
+        )
+        for name in self.parsed_dtype.names:
+            records[name] = parsed[name]
+        if not self.text_ids:
+            return records
+
+        nfields = len(self.fields)
+        # every row starts with a newline, which then acts as the separator
+        # in front of the first field just as a comma does for the others
+        blob = np.frombuffer(b"\n" + b"\n".join(packets), dtype=np.uint8)
+        newline = blob == NEWLINE
+        row_starts = np.flatnonzero(newline)
+        if len(row_starts) != len(packets):
+            raise ValueError("newline inside a packet")
+        row_ends = np.append(row_starts[1:], len(blob))
+        sep_pos = np.flatnonzero(newline | (blob == COMMA))
+        # index into sep_pos of each row's leading newline
+        row_first = np.flatnonzero(newline[sep_pos])
+        if (np.diff(np.append(row_first, len(sep_pos))) < nfields).any():
+            raise ValueError("missing field")
+        for idx in self.text_ids:
+            start = sep_pos[row_first + idx] + 1
+            if idx == nfields - 1:
+                # the last field runs to the end of the row, commas and all
+                end = row_ends
+            else:
+                end = sep_pos[row_first + idx + 1]
+            field = self.fields[idx]
+            records[field["name"]] = self.intern_column(
+                blob, start, end, field.get("size", TEXT_SIZE)
+            )
+        return records
+
+    def decode_naive(
+        self, packets: List[bytes], received: Union[int, np.ndarray]
+    ) -> np.ndarray:
+        """[row by row split(",") parse, the reference for decode]"""
+        nfields = len(self.fields)
+        received = np.broadcast_to(received, len(packets)).tolist()
+        rows = []
+        for packet, packet_received in zip(packets, received):
+            values = packet.split(b",", nfields - 1)
+            if len(values) != nfields:
+                continue
+            row = [packet_received]
+            try:
+                for field, value in zip(self.fields, values):
+                    kind = field["type"]
+                    if kind == "float":
+                        row.append(float(value))
+                    elif kind == "datetime":
+                        row.append(np.datetime64(value.decode(), "ms"))
+                    else:
+                        size = field.get("size", TEXT_SIZE)
+                        row.append(self.intern(value[:size]))
+            except ValueError:
+                continue
+            rows.append(tuple(row))
+        return np.array(rows, dtype=self.dtype)
+
+    def since(self, seconds: float) -> np.ndarray:
+        """[view of the records from the last seconds, measured back from
+        the newest record]"""
+        records = self.ring.last(self.ring.capacity)
+        if len(records) == 0:
+            return records
+        times = records[self.time_field]
+        if self.time_field == "received":
+            cutoff = times[-1] - int(seconds * 1e9)
+        else:
+            cutoff = times[-1] - np.timedelta64(int(seconds * 1000), "ms")
+        return records[np.searchsorted(times, cutoff, side="left") :]
+
+    def text(self, code: int) -> str:
+        return self.texts[code]
+
+
+if __name__ == "__main__":
+    # testing code, compares decode with the naive split(",") loop
+    import datetime
+    import json
+    import random
+    import time
+
+    with open("config.json", "r") as f:
+        settings = json.load(f)
+    logger = logging.getLogger("overlay_decoder")
+    count = 10_000
+    packets = []
+    start = datetime.datetime.now()
+    for num in range(count):
+        timestamp = start + datetime.timedelta(seconds=num)
+        overlay = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        for i in range(8):
+            overlay += "," + str(round(random.uniform(i * 10, i * 10 + 10), 3))
+        overlay += ",TASK: I'm the real Batman"
+        packets.append(overlay.encode())
+
+    decoder = OverlayDecoder(settings["overlay"], logger)
+    for batch in (1, 16, 256, 10_000):
+        for name, parse in (
+            ("naive", decoder.decode_naive),
+            ("vectorised", decoder.decode),
+        ):
+            begin = time.perf_counter()
+            for idx in range(0, count, batch):
+                parse(packets[idx : idx + batch], 0)
+            elapsed = time.perf_counter() - begin
+            print(
+                f"batch {batch:>5} {name:>10}: "
+                f"{count / elapsed:>10.0f} packets/s"
+            )
@@ -0,0 +1,294 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+import overlay_decoder
+
+# defaults for the "render" part of the "overlay" section of config.json
+FONT_SIZE = 16
+# top left corner of the panel the fields are drawn in, pixels
+ORIGIN = (8, 8)
+# how much the dark box behind the text hides the picture, 0 to 256
+BACKGROUND = 96
+# grey level of the text
+TEXT_LEVEL = 255
+# digits of a float field shown
+DECIMALS = 3
+# characters of room left for a value of each field type
+VALUE_CHARS = {"datetime": 19, "float": 10}
+# value tiles kept, oldest are dropped first
+TILE_CACHE = 1024
+PADDING = 4
+
+
+def load_font(path: Optional[str], size: int):
+    """[the font at path, or a truetype one Pillow can find, or its small
+    built in bitmap font]"""
+    for name in (path, "DejaVuSans.ttf", "DejaVuSansMono.ttf"):
+        if not name:
+            continue
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            pass
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # before Pillow 10.1 the default font had one size
+        return ImageFont.load_default()
+
+
+def raster(font, text: str, height: int) -> np.ndarray:
+    """[coverage, 0 to 255, of text drawn by Pillow, height rows by the
+    text's advance]"""
+    width = max(int(np.ceil(font.getlength(text))), 1)
+    image = Image.new("L", (width, height))
+    ImageDraw.Draw(image).text((0, 0), text, fill=255, font=font)
+    return np.asarray(image)
+
+
+class OverlayRenderer:
+    def __init__(
+        self,
+        overlay: Dict,
+        decoder: overlay_decoder.OverlayDecoder,
+        shape: Tuple[int, int, int],
+    ) -> None:
+        """[burns the overlay fields into video frames, a line of "name
+        value" per field. the names never change and are drawn once, a
+        value is only redrawn when its text changes, out of a cache of
+        value tiles built from a cache of glyphs, so Pillow is hardly
+        called once it has seen every character. each frame is one numpy
+        blend of the panel over its corner of the frame
+
+        Args:
+            overlay (Dict): [the "overlay" section of config.json, drawing
+            settings are in its optional "render" part]
+            decoder (overlay_decoder.OverlayDecoder): [the decoder samples
+            come from, for text fields]
+            shape (Tuple[int, int, int]): [height, width, channels of the
+            frames]
+        """
+        render = overlay.get("render", {})
+        self.decoder = decoder
+        self.fields = overlay["fields"]
+        self.font = load_font(
+            render.get("font"), render.get("font_size", FONT_SIZE)
+        )
+        ascent, descent = self.font.getmetrics()
+        self.line = ascent + descent + 2
+        self.background = render.get("background", BACKGROUND)
+        self.decimals = render.get("decimals", DECIMALS)
+        digit = self.font.getlength("0")
+        labels = [f"{field['name']}: " for field in self.fields]
+        label_width = int(max(self.font.getlength(text) for text in labels))
+        self.slots: List[Tuple[int, int, int]] = []
+        widths = []
+        for num, field in enumerate(self.fields):
+            chars = VALUE_CHARS.get(field["type"], field.get("size", 32))
+            widths.append(int(chars * digit))
+            top = PADDING + num * self.line
+            self.slots.append((top, PADDING + label_width, widths[-1]))
+
+        # the panel, drawn whole and shown as far as it fits in the frame
+        rows = 2 * PADDING + len(self.fields) * self.line
+        cols = 2 * PADDING + label_width + max(widths)
+        # out = (frame * inv + premult) >> 8, worked out from the text
+        # coverage whenever a value changes. a value per channel, numpy
+        # broadcasting one across the channels is many times slower
+        height, width, channels = shape
+        self.panel_inv = np.full(
+            (rows, cols, channels), 256 - self.background, np.uint16
+        )
+        self.panel_premult = np.zeros((rows, cols, channels), np.uint16)
+        x, y = render.get("origin", ORIGIN)
+        self.left = min(x, width)
+        self.top = min(y, height)
+        self.right = min(x + cols, width)
+        self.bottom = min(y + rows, height)
+        rows = self.bottom - self.top
+        cols = self.right - self.left
+        self.inv = self.panel_inv[:rows, :cols]
+        self.premult = self.panel_premult[:rows, :cols]
+        self.work = np.zeros((rows, cols, channels), np.uint16)
+        for (top, _, _), text in zip(self.slots, labels):
+            coverage = raster(self.font, text, self.line)
+            self.place(*self.shade(coverage), top, PADDING, label_width)
+
+        self.glyphs: Dict[str, Tuple[np.ndarray, float]] = {}
+        self.tiles: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self.shown: List[Optional[str]] = [None] * len(self.fields)
+        # values redrawn and value tiles and glyphs that had to be made
+        self.redrawn = 0
+        self.tile_misses = 0
+        self.glyph_misses = 0
+
+    def shade(self, coverage: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """[inv and premult of text with this coverage over the box]"""
+        cover = coverage.astype(np.uint16)
+        cover += cover >> 7
+        inv = ((256 - self.background) * (256 - cover)) >> 8
+        return inv[..., None], (TEXT_LEVEL * cover)[..., None]
+
+    def place(self, inv, premult, top: int, left: int, width: int) -> None:
+        """[put a tile into the panel at a slot, cut to the slot's width,
+        the rest of the slot is cleared]"""
+        inv = inv[:, :width]
+        premult = premult[:, :width]
+        end = top + self.line
+        used = left + inv.shape[1]
+        self.panel_inv[top:end, left:used] = inv
+        self.panel_premult[top:end, left:used] = premult
+        self.panel_inv[top:end, used : left + width] = 256 - self.background
+        self.panel_premult[top:end, used : left + width] = 0
+
+    def glyph(self, char: str) -> Tuple[np.ndarray, float]:
+        """[a character's coverage and advance]"""
+        glyph = self.glyphs.get(char)
+        if glyph is None:
+            self.glyph_misses += 1
+            glyph = self.glyphs[char] = (
+                raster(self.font, char, self.line),
+                self.font.getlength(char),
+            )
+        return glyph
+
+    def tile(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """[inv and premult of a value, glyphs laid side by side at their
+        advances]"""
+        tile = self.tiles.get(text)
+        if tile is not None:
+            return tile
+        self.tile_misses += 1
+        glyphs = [self.glyph(char) for char in text]
+        width = int(np.ceil(sum(advance for _, advance in glyphs))) + 1
+        coverage = np.zeros((self.line, width), np.uint8)
+        x = 0.0
+        for glyph, advance in glyphs:
+            start = int(round(x))
+            end = min(start + glyph.shape[1], width)
+            # glyphs can overhang their advance into the next one
+            np.maximum(
+                coverage[:, start:end],
+                glyph[:, : end - start],
+                out=coverage[:, start:end],
+            )
+            x += advance
+        if len(self.tiles) >= TILE_CACHE:
+            del self.tiles[next(iter(self.tiles))]
+        tile = self.tiles[text] = self.shade(coverage)
+        return tile
+
+    def values(self, sample: Optional[np.void]) -> List[str]:
+        """[each field's value as it is shown, blank with no sample]"""
+        if sample is None:
+            return [""] * len(self.fields)
+        out = []
+        for field in self.fields:
+            value = sample[field["name"]]
+            kind = field["type"]
+            if kind == "float":
+                out.append(f"{value:.{self.decimals}f}")
+            elif kind == "text":
+                out.append(self.decoder.text(int(value)))
+            else:
+                out.append(str(value.astype("M8[s]")).replace("T", " "))
+        return out
+
+    def update(self, sample: Optional[np.void]) -> int:
+        """[redraw the values that changed since the last sample
+
+        Returns:
+            int: [values redrawn]
+        """
+        redrawn = 0
+        for num, text in enumerate(self.values(sample)):
+            if text == self.shown[num]:
+                continue
+            top, left, width = self.slots[num]
+            inv, premult = self.tile(text)
+            self.place(inv, premult, top, left, width)
+            self.shown[num] = text
+            redrawn += 1
+        self.redrawn += redrawn
+        return redrawn
+
+    def blend(self, frame: np.ndarray) -> None:
+        """[composite the panel onto frame in place, only the panel's
+        corner of the frame is touched]"""
+        region = frame[self.top : self.bottom, self.left : self.right]
+        np.multiply(region, self.inv, out=self.work)
+        self.work += self.premult
+        self.work >>= 8
+        np.copyto(region, self.work, casting="unsafe")
+
+    def render(self, frame: np.ndarray, sample: Optional[np.void]) -> None:
+        """[burn sample into frame in place]"""
+        self.update(sample)
+        self.blend(frame)
+
+    def render_naive(self, frame: np.ndarray, sample: Optional[np.void]):
+        """[the same, with every line drawn again by Pillow each frame, for
+        comparison]"""
+        region = frame[self.top : self.bottom, self.left : self.right]
+        rows, cols = region.shape[:2]
+        box = Image.new("RGBA", (cols, rows), (0, 0, 0, self.background))
+        draw = ImageDraw.Draw(box)
+        for (top, left, _), field, text in zip(
+            self.slots, self.fields, self.values(sample)
+        ):
+            white = (TEXT_LEVEL,) * 3
+            label = f"{field['name']}: "
+            draw.text((PADDING, top), label, fill=white, font=self.font)
+            draw.text((left, top), text, fill=white, font=self.font)
+        panel = Image.fromarray(np.ascontiguousarray(region)).convert("RGBA")
+        panel.alpha_composite(box)
+        region[...] = np.asarray(panel.convert("RGB"))
+
+
+if __name__ == "__main__":
+    # testing code, renders a 720p frame per sample of changing telemetry
+    import json
+    import logging
+    import time
+
+    with open("config.json", "r") as f:
+        settings = json.load(f)
+    logger = logging.getLogger("overlay_renderer")
+    decoder = overlay_decoder.OverlayDecoder(settings["overlay"], logger)
+    camera = settings["cameras"][0]
+    shape = (camera["height"], camera["width"], 3)
+    # 25 fps against 10 Hz telemetry, a value changes every 2 or 3 frames,
+    # the task now and then
+    count = 500
+    packets = []
+    for num in range(count // 2):
+        values = ",".join(f"{(num * 7 + i) % 100 / 3:.3f}" for i in range(8))
+        packets.append(
+            f"2021-09-22 14:{num // 60 % 60:02d}:{num % 60:02d},{values},"
+            f"TASK: line {num // 50}".encode()
+        )
+    records = decoder.decode(packets, 0)
+    samples = [records[num * len(records) // count] for num in range(count)]
+    renderer = OverlayRenderer(settings["overlay"], decoder, shape)
+    frame = np.zeros(shape, np.uint8)
+    for name, fn in (
+        ("naive", renderer.render_naive),
+        ("cached", renderer.render),
+    ):
+        start = time.perf_counter()
+        for sample in samples:
+            fn(frame, sample)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {elapsed / count * 1e6:.0f} us/frame")
+    start = time.perf_counter()
+    for _ in range(count):
+        renderer.blend(frame)
+    elapsed = time.perf_counter() - start
+    print(
+        f"blend alone: {elapsed / count * 1e6:.0f} us/frame, panel "
+        f"{renderer.inv.shape[1]}x{renderer.inv.shape[0]}, "
+        f"{renderer.redrawn} values redrawn, {renderer.tile_misses} tiles "
+        f"and {renderer.glyph_misses} glyphs made"
+    )
@@ -0,0 +1,162 @@
+import os
+import struct
+from typing import Iterator, Optional, Tuple
+from multiprocessing import shared_memory
+
+# header: bytes ever written, bytes ever consumed, records dropped because
+# the ring was full, and the time (ns) the writer has written every record
+# up to. the writer only moves written, the reader only consumed
+WORD = struct.Struct("<Q")
+WRITTEN = 0
+CONSUMED = 8
+DROPPED = 16
+DRAINED = 24
+HEADER_SIZE = 64
+# record: payload length, input id (free for the caller), timestamp (ns),
+# payload padded to 8 bytes. a length of WRAP sends the reader back to the
+# start
+RECORD = struct.Struct("<IIq")
+WRAP = 0xFFFFFFFF
+ALIGN = 8
+
+
+def padded(nbytes: int) -> int:
+    return (nbytes + ALIGN - 1) & ~(ALIGN - 1)
+
+
+class PacketRing:
+    def __init__(
+        self, capacity: int, name: Optional[str] = None, create: bool = True
+    ) -> None:
+        """[variable size packet records in a shared memory ring, one writer
+        process and one reader process. the writer never waits, a record
+        that does not fit is dropped and counted]
+
+        Args:
+            capacity (int): [bytes of records the ring holds, a multiple of 8]
+            name (str, optional): [shared memory block name, made up when
+            creating and None]
+            create (bool): [True for the owner, False to attach]
+        """
+        self.capacity = padded(capacity)
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=HEADER_SIZE + self.capacity
+        )
+        self.name = self.shm.name
+        # only the owner unlinks, see shared_mailbox.Mailbox
+        self.owner = create
+        # a forked child holds the owner's object, it must not unlink
+        self.owner_pid = os.getpid()
+        self.buf = self.shm.buf
+        self.data = self.buf[HEADER_SIZE:]
+        # reader side, consumed up to here once release is called
+        self.pending = 0
+        if create:
+            for offset in (WRITTEN, CONSUMED, DROPPED, DRAINED):
+                WORD.pack_into(self.buf, offset, 0)
+
+    def __reduce__(self):
+        # pass by name so a child process attaches to the same block
+        return (PacketRing, (self.capacity, self.name, False))
+
+    @property
+    def dropped(self) -> int:
+        return WORD.unpack_from(self.buf, DROPPED)[0]
+
+    @property
+    def drained(self) -> int:
+        return WORD.unpack_from(self.buf, DRAINED)[0]
+
+    @property
+    def backlog(self) -> int:
+        """[bytes written and not released yet]"""
+        written = WORD.unpack_from(self.buf, WRITTEN)[0]
+        return written - WORD.unpack_from(self.buf, CONSUMED)[0]
+
+    def mark(self, timestamp: int) -> None:
+        """[writer side, no record older than timestamp (ns) is still to
+        come. called after the records it covers are written]"""
+        WORD.pack_into(self.buf, DRAINED, max(timestamp, 0))
+
+    def write(self, payload, timestamp: int, tag: int = 0) -> bool:
+        """[append a record, visible to the reader straight away
+
+        Returns:
+            bool: [False if the ring was full and the record dropped]
+        """
+        written = WORD.unpack_from(self.buf, WRITTEN)[0]
+        consumed = WORD.unpack_from(self.buf, CONSUMED)[0]
+        size = RECORD.size + padded(len(payload))
+        offset = written % self.capacity
+        tail = self.capacity - offset
+        # a record never wraps, the rest of the ring is skipped instead
+        needed = size + tail if size > tail else size
+        if self.capacity - (written - consumed) < needed:
+            WORD.pack_into(self.buf, DROPPED, self.dropped + 1)
+            return False
+        if size > tail:
+            if tail >= RECORD.size:
+                RECORD.pack_into(self.data, offset, WRAP, 0, 0)
+            written += tail
+            offset = 0
+        RECORD.pack_into(self.data, offset, len(payload), tag, timestamp)
+        start = offset + RECORD.size
+        self.data[start : start + len(payload)] = payload
+        # publish last, the reader goes no further than written
+        WORD.pack_into(self.buf, WRITTEN, written + size)
+        return True
+
+    def read(self) -> Iterator[Tuple[int, int, memoryview]]:
+        """[every record written so far, as (timestamp, tag, payload). a
+        payload is a view into the ring and only valid until release]"""
+        written = WORD.unpack_from(self.buf, WRITTEN)[0]
+        consumed = WORD.unpack_from(self.buf, CONSUMED)[0]
+        self.pending = consumed
+        while consumed < written:
+            offset = consumed % self.capacity
+            tail = self.capacity - offset
+            if tail < RECORD.size:
+                consumed += tail
+                self.pending = consumed
+                continue
+            nbytes, tag, timestamp = RECORD.unpack_from(self.data, offset)
+            if nbytes == WRAP:
+                consumed += tail
+                self.pending = consumed
+                continue
+            start = offset + RECORD.size
+            yield timestamp, tag, self.data[start : start + nbytes]
+            consumed += RECORD.size + padded(nbytes)
+            self.pending = consumed
+
+    def release(self) -> None:
+        """[hand the space of every record read back to the writer]"""
+        WORD.pack_into(self.buf, CONSUMED, self.pending)
+
+    def close(self) -> None:
+        self.data.release()
+        self.buf = self.data = None
+        self.shm.close()
+        if self.owner and os.getpid() == self.owner_pid:
+            self.shm.unlink()
+
+
+if __name__ == "__main__":
+    # testing code
+    import time
+
+    ring = PacketRing(1 << 22)
+    reader = PacketRing(1 << 22, ring.name, create=False)
+    count = 200_000
+    packet = b"x" * 100
+    total = 0
+    start = time.perf_counter()
+    for num in range(count):
+        ring.write(packet, time.time_ns())
+        if num % 1000 == 999:
+            total += sum(len(p) for _, _, p in reader.read())
+            reader.release()
+    elapsed = time.perf_counter() - start
+    print(f"write and read: {elapsed / count * 1e9:.0f} ns/packet, {total}")
+    reader.close()
+    ring.close()
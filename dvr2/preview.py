@@ -0,0 +1,357 @@
+from typing import Dict, List, Optional, Tuple
+import logging
+import multiprocessing
+import os
+import socket
+import struct
+import time
+
+import cv2
+import numpy as np
+
+import backpressure
+import frame_ring
+
+# datagram header: magic, camera index, frame number, frame time (ns),
+# chunk index and chunks in the frame, the jpeg follows
+HEADER = struct.Struct("<4sBIqHH")
+MAGIC = b"DVRP"
+# jpeg bytes per datagram, header and all fit an ethernet frame so
+# nothing is fragmented, a lost datagram loses only its own chunk
+CHUNK = 1400
+# defaults for the "preview" section of config.json
+WIDTH = 320
+FPS = 5
+QUALITY = 70
+# share of one core the preview process may use
+CPU = 0.25
+NICE = 10
+
+
+def chunks(
+    camera: int, number: int, timestamp: int, jpeg: bytes
+) -> List[bytes]:
+    """[one frame's jpeg cut into datagrams]"""
+    count = max(1, -(-len(jpeg) // CHUNK))
+    return [
+        HEADER.pack(MAGIC, camera, number, timestamp, idx, count)
+        + jpeg[idx * CHUNK : (idx + 1) * CHUNK]
+        for idx in range(count)
+    ]
+
+
+class Reassembler:
+    def __init__(self) -> None:
+        """[puts preview frames back together on the receiving end, a
+        frame with a chunk missing is given up when a chunk of a newer
+        frame of the same camera comes in]"""
+        # camera -> (frame number, timestamp, chunk count, chunks so far)
+        self.frames: Dict[int, Tuple[int, int, int, Dict[int, bytes]]] = {}
+        self.incomplete = 0
+
+    def add(self, datagram: bytes) -> Optional[Tuple[int, int, int, bytes]]:
+        """[one datagram
+
+        Returns:
+            Optional[Tuple[int, int, int, bytes]]: [camera, frame number,
+            timestamp (ns) and jpeg once a frame is whole]
+        """
+        magic, camera, number, timestamp, idx, count = HEADER.unpack_from(
+            datagram
+        )
+        if magic != MAGIC:
+            return None
+        frame = self.frames.get(camera)
+        if frame is None or frame[0] != number:
+            if frame is not None and frame[0] > number:
+                # a straggler from an older frame
+                return None
+            if frame is not None:
+                self.incomplete += 1
+            frame = self.frames[camera] = (number, timestamp, count, {})
+        parts = frame[3]
+        parts[idx] = datagram[HEADER.size :]
+        if len(parts) < count:
+            return None
+        del self.frames[camera]
+        jpeg = b"".join(parts[num] for num in range(count))
+        return camera, number, timestamp, jpeg
+
+
+class Preview:
+    def __init__(
+        self,
+        settings: Dict,
+        rings: List[frame_ring.FrameRing],
+        board: Optional[backpressure.Board] = None,
+    ) -> None:
+        """[small jpegs of the newest frame of every camera, a few times a
+        second, sent to the preview output. frames are shrunk straight
+        out of their ring slot and the slot checked afterwards, so nothing
+        is held that the capture process would have to wait for
+
+        Args:
+            settings (Dict): [package configuration file]
+            rings (List[frame_ring.FrameRing]): [frame rings in
+            settings["cameras"] order]
+            board (backpressure.Board, optional): [the policy's board, the
+            preview is the first thing shed]
+        """
+        preview = settings["preview"]
+        output = next(
+            output
+            for output in settings["outputs"]
+            if output["name"] == preview["output"]
+        )
+        self.address = (output["ip"], output["port"])
+        self.rings = rings
+        self.interval = 1 / preview.get("fps", FPS)
+        self.cpu = preview.get("cpu", CPU)
+        self.params = [
+            cv2.IMWRITE_JPEG_QUALITY,
+            preview.get("quality", QUALITY),
+        ]
+        # per camera, the buffers a frame is shrunk through. halving with
+        # INTER_LINEAR is an exact 2x2 average, far cheaper than one
+        # INTER_AREA resize and within a grey level of it, INTER_AREA only
+        # does what is left
+        self.steps: List[List[np.ndarray]] = []
+        for camera in settings["cameras"]:
+            width = min(preview.get("width", WIDTH), camera["width"])
+            height = round(camera["height"] * width / camera["width"])
+            height = max(1, height)
+            steps = []
+            size = (camera["width"], camera["height"])
+            while size[0] >= 2 * width and size[1] >= 2 * height:
+                size = (size[0] // 2, size[1] // 2)
+                steps.append(np.zeros((size[1], size[0], 3), np.uint8))
+            if size != (width, height) or not steps:
+                # a full size preview is still copied out of the slot
+                steps.append(np.zeros((height, width, 3), np.uint8))
+            self.steps.append(steps)
+        self.stages = [None] * len(rings)
+        if board is not None:
+            self.stages = [
+                board.stage(
+                    f"{camera['name']}_{backpressure.PREVIEW}",
+                    backpressure.PREVIEW,
+                )
+                for camera in settings["cameras"]
+            ]
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        # newest frame number previewed per camera
+        self.shown = [-1] * len(rings)
+        self.sent = 0
+        self.torn = 0
+        self.dropped = 0
+
+    def shrink(self, idx: int) -> Optional[Tuple[int, float, np.ndarray]]:
+        """[the camera's newest frame, shrunk, None if there is no new
+        one or it was overwritten while being read]"""
+        ring = self.rings[idx]
+        number = ring.count - 1
+        if number <= self.shown[idx]:
+            return None
+        got = ring.get(number)
+        if got is None:
+            return None
+        timestamp, frame = got
+        small = frame
+        for step in self.steps[idx]:
+            halving = step.shape[0] * 2 <= small.shape[0]
+            cv2.resize(
+                small,
+                (step.shape[1], step.shape[0]),
+                dst=step,
+                interpolation=cv2.INTER_LINEAR if halving else cv2.INTER_AREA,
+            )
+            small = step
+        # the slot view goes straight away, the ring never waits for us
+        frame = got = None
+        if not ring.valid(number):
+            self.torn += 1
+            return None
+        return number, timestamp, small
+
+    def send(self, datagrams: List[bytes]) -> None:
+        for datagram in datagrams:
+            try:
+                self.sock.sendto(datagram, self.address)
+            except OSError:
+                # nobody listening or the send buffer is full
+                self.dropped += 1
+            else:
+                self.sent += 1
+
+    def step(self) -> int:
+        """[preview every camera with a new frame
+
+        Returns:
+            int: [frames sent]
+        """
+        count = 0
+        for idx, stage in enumerate(self.stages):
+            ring = self.rings[idx]
+            number = ring.count - 1
+            if stage is not None:
+                # frames come in faster than they are shown, and how old
+                # the one to show is, 0 with nothing new
+                waiting = max(0, number - self.shown[idx])
+                lag = 0
+                if waiting:
+                    taken = ring.headers["timestamp"][number % ring.slots]
+                    lag = max(0, int((time.time() - taken) * 1e9))
+                stage.report(waiting, ring.slots, lag)
+            if number <= self.shown[idx]:
+                continue
+            if stage is not None and not stage.admit(number):
+                self.shown[idx] = number
+                continue
+            got = self.shrink(idx)
+            if got is None:
+                continue
+            number, timestamp, small = got
+            self.shown[idx] = number
+            ok, jpeg = cv2.imencode(".jpg", small, self.params)
+            if not ok:
+                continue
+            timestamp = int(timestamp * 1e9)
+            self.send(chunks(idx, number, timestamp, jpeg.tobytes()))
+            count += 1
+        return count
+
+    def run(self, stop: multiprocessing.Event) -> None:
+        """[step at the preview fps until stop is set. each step's cpu
+        time is paid for with sleep, so over any stretch the process uses
+        at most its cpu share of a core]"""
+        next_step = time.monotonic()
+        while not stop.is_set():
+            used = time.process_time()
+            self.step()
+            used = time.process_time() - used
+            next_step = max(
+                next_step + self.interval,
+                time.monotonic() + used * (1 / self.cpu - 1),
+            )
+            stop.wait(max(0.0, next_step - time.monotonic()))
+
+    def close(self) -> None:
+        self.sock.close()
+        self.stages = None
+        for ring in self.rings:
+            ring.close()
+
+
+def preview_process(
+    settings: Dict,
+    rings: List[frame_ring.FrameRing],
+    board: Optional[backpressure.Board],
+    stop: multiprocessing.Event,
+) -> None:
+    """[the preview's own process, at a lower priority than capture and
+    recording]"""
+    logger = logging.getLogger("preview")
+    try:
+        os.nice(settings["preview"].get("nice", NICE))
+    except (AttributeError, OSError):
+        pass
+    preview = Preview(settings, rings, board)
+    preview.run(stop)
+    logger.info(
+        f"preview stopped, {preview.sent} datagrams sent, "
+        f"{preview.dropped} dropped, {preview.torn} frames torn"
+    )
+    preview.close()
+    if board is not None:
+        board.close()
+
+
+def start_preview(
+    settings: Dict,
+    rings: List[frame_ring.FrameRing],
+    board: Optional[backpressure.Board],
+    logger: logging.Logger,
+) -> Tuple[Optional[multiprocessing.Process], multiprocessing.Event]:
+    """[the preview process, if config.json has a "preview" section
+
+    Returns:
+        Tuple[Optional[multiprocessing.Process], multiprocessing.Event]:
+        [the process, None without a preview, and the event that stops it]
+    """
+    stop = multiprocessing.Event()
+    if "preview" not in settings:
+        return None, stop
+    process = multiprocessing.Process(
+        name="preview",
+        target=preview_process,
+        args=(settings, rings, board, stop),
+        daemon=True,
+    )
+    process.start()
+    logger.info(
+        f"preview process started for {settings['preview']['output']}"
+    )
+    return process, stop
+
+
+def stop_preview(
+    process: Optional[multiprocessing.Process],
+    stop: multiprocessing.Event,
+    logger: logging.Logger,
+) -> None:
+    stop.set()
+    if process is None:
+        return
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    logger.debug("SHUTTING DOWN: preview stopped")
+
+
+if __name__ == "__main__":
+    # testing code, previews 720p synthetic frames as fast as the cpu
+    # share allows and times each part
+    import camera_capture
+
+    settings = {
+        "cameras": [
+            {"name": f"camera{num}", "width": 1280, "height": 720, "fps": 25}
+            for num in (1, 2)
+        ],
+        "outputs": [{"name": "preview", "ip": "127.0.0.1", "port": 30002}],
+        "preview": {"output": "preview", "fps": 1000, "cpu": 1.0},
+    }
+    rings = []
+    for camera in settings["cameras"]:
+        ring = frame_ring.FrameRing(16, camera_capture.frame_shape(camera))
+        source = camera_capture.SyntheticCamera(camera)
+        source.interval = 0
+        rings.append((ring, source))
+    preview = Preview(settings, [ring for ring, _ in rings])
+    count = 200
+    timings = {"shrink": 0.0, "jpeg": 0.0, "send": 0.0}
+    for _ in range(count):
+        for ring, source in rings:
+            source.read(ring.begin())
+            ring.commit(time.time())
+        for idx in range(len(rings)):
+            start = time.perf_counter()
+            number, timestamp, small = preview.shrink(idx)
+            preview.shown[idx] = number
+            shrunk = time.perf_counter()
+            jpeg = cv2.imencode(".jpg", small, preview.params)[1].tobytes()
+            encoded = time.perf_counter()
+            preview.send(chunks(idx, number, int(timestamp * 1e9), jpeg))
+            timings["shrink"] += shrunk - start
+            timings["jpeg"] += encoded - shrunk
+            timings["send"] += time.perf_counter() - encoded
+    frames = count * len(rings)
+    for name, elapsed in timings.items():
+        print(f"{name}: {elapsed / frames * 1e3:.2f} ms/frame")
+    print(
+        f"{len(jpeg)} byte jpegs, {preview.sent} datagrams sent, "
+        f"{preview.dropped} dropped"
+    )
+    preview.close()
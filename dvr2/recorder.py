@@ -0,0 +1,170 @@
+from typing import Deque, Dict, List, Optional
+from collections import deque
+from pathlib import Path
+import logging
+import threading
+
+import clock
+import debug_logger
+import telemetry_file
+
+# rough per entry cost of the python objects holding a pre-roll record, so
+# the byte cap tracks real memory for small packets too
+ENTRY_OVERHEAD = 120
+
+
+class PreRoll:
+    def __init__(self, seconds: float, max_bytes: int) -> None:
+        """[the last seconds of recordable data, kept while not recording so
+        a recording can start from before the start command. bounded by age
+        and by bytes, whichever is hit first]
+
+        Args:
+            seconds (float): [age of the oldest record kept]
+            max_bytes (int): [memory cap for all streams together]
+        """
+        self.seconds = seconds
+        self.span = int(seconds * 1e9)
+        self.max_bytes = max_bytes
+        self.records: Deque = deque()
+        self.size = 0
+        # records thrown away to stay under max_bytes rather than for age
+        self.evicted = 0
+
+    def append(self, stream: str, timestamp: int, payload: bytes) -> None:
+        self.records.append((stream, timestamp, payload))
+        self.size += len(payload) + ENTRY_OVERHEAD
+        records = self.records
+        while self.size > self.max_bytes:
+            _, _, old = records.popleft()
+            self.size -= len(old) + ENTRY_OVERHEAD
+            self.evicted += 1
+        cutoff = timestamp - self.span
+        while records and records[0][1] < cutoff:
+            _, _, old = records.popleft()
+            self.size -= len(old) + ENTRY_OVERHEAD
+
+    def drain(self):
+        """[hand over every record, oldest first, and empty the buffer]"""
+        records = self.records
+        self.records = deque()
+        self.size = 0
+        return records
+
+
+class Recorder:
+    def __init__(
+        self,
+        recording: Dict,
+        inputs: List[str],
+        logger: logging.Logger,
+        disk: Optional[Dict] = None,
+    ) -> None:
+        """[writes every input of a session to a telemetry file while
+        recording, and into the pre-roll while not. the file rotates with
+        the debug log. add is called from the ingest thread, the rest
+        from main]
+
+        Args:
+            recording (Dict): [the "recording" section of config.json]
+            inputs (List[str]): [input names, in settings["inputs"] order]
+            logger (logging.Logger): [the logger for debug_logging]
+            disk (Dict, optional): [the "disk" section of config.json]
+        """
+        self.folder = recording["folder"]
+        self.chunk_bytes = recording["chunk_bytes"]
+        self.inputs = inputs
+        self.disk = disk
+        self.input_ids = {name: idx for idx, name in enumerate(inputs)}
+        self.logger = logger
+        self.preroll = PreRoll(
+            recording["preroll_seconds"], recording["preroll_max_bytes"]
+        )
+        self.lock = threading.Lock()
+        self.session: Optional[Path] = None
+        self.writer: Optional[telemetry_file.TelemetryWriter] = None
+        # records the closed files dropped with the disk behind
+        self.closed_dropped = 0
+
+    def add(self, stream: str, timestamp: int, payload) -> None:
+        """[record a payload, which may be a view into a reused buffer,
+        timestamp in ns on the clock module's clock]"""
+        with self.lock:
+            if self.writer is None:
+                self.preroll.append(stream, timestamp, bytes(payload))
+            else:
+                self.write(stream, timestamp, payload)
+
+    def write(self, stream: str, timestamp: int, payload) -> None:
+        self.writer.write(timestamp, self.input_ids[stream], payload)
+
+    def open_file(self) -> None:
+        path = debug_logger.get_new_log_file_name(
+            str(self.session), "telemetry", "tlm"
+        )
+        # every file of every session has the process's one anchor
+        self.writer = telemetry_file.TelemetryWriter(
+            str(path),
+            self.inputs,
+            self.chunk_bytes,
+            anchor=clock.ANCHOR,
+            disk=self.disk,
+        )
+        self.logger.info(f"telemetry file {path}")
+
+    def start(self) -> Path:
+        """[open a new session, starting with the pre-roll]
+
+        Returns:
+            Path: [the session's folder]
+        """
+        with self.lock:
+            if self.session is not None:
+                return self.session
+            Path(self.folder).mkdir(parents=True, exist_ok=True)
+            name = debug_logger.file_time((self.folder, "session"))
+            session = Path(self.folder) / f"session_{name}"
+            # an existing session is never written into
+            session.mkdir()
+            self.session = session
+            self.open_file()
+            records = self.preroll.drain()
+            for stream, timestamp, payload in records:
+                self.write(stream, timestamp, payload)
+            self.logger.info(
+                f"recording {self.session}, {len(records)} pre-roll records"
+            )
+            return self.session
+
+    @property
+    def dropped(self) -> int:
+        """[records dropped by every file so far, the disk was behind]"""
+        writer = self.writer
+        return self.closed_dropped + (writer.dropped if writer else 0)
+
+    def close_file(self, writer: telemetry_file.TelemetryWriter) -> None:
+        # flushes and fdatasyncs, called without the lock so add goes on
+        writer.close()
+        self.closed_dropped += writer.dropped
+        if writer.dropped:
+            self.logger.warning(
+                f"{writer.path} dropped {writer.dropped} records, the disk "
+                "was behind"
+            )
+
+    def rotate(self) -> None:
+        """[close the telemetry file and carry on in a new one]"""
+        with self.lock:
+            old = self.writer
+            if old is None:
+                return
+            self.open_file()
+        self.close_file(old)
+
+    def stop(self) -> None:
+        with self.lock:
+            old = self.writer
+            self.writer = None
+            self.session = None
+        if old is not None:
+            self.close_file(old)
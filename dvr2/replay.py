@@ -0,0 +1,242 @@
+from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import json
+import socket
+import time
+
+import numpy as np
+
+import session_index
+import stats
+
+# the last stretch before a packet is due is spun rather than slept, sleep
+# wakes up late by up to about this much. spinning holds a core, --spin
+# trades timing for cpu
+SPIN_SECONDS = 0.001
+# this far behind, after a stall or a seek, the schedule starts again from
+# now rather than sending the backlog as one burst
+RESYNC_SECONDS = 0.5
+# a packet sent later than this counts as late
+LATE_NS = 1_000_000
+# the controller's packets are commands, a replay leaves them out unless
+# asked, so a recorded "close" does not shut the live system down
+SKIP_INPUTS = ("controller",)
+
+
+class Pacer:
+    def __init__(self, speed: float, spin: float = SPIN_SECONDS) -> None:
+        """[works out when a recorded packet is due and waits for it. every
+        due time is worked out from one anchor, not from the packet before,
+        so sleep's errors never add up: a late packet makes the next wait
+        shorter
+
+        Args:
+            speed (float): [recorded seconds per second, 0 for as fast as
+            possible]
+            spin (float): [seconds before a packet is due that sleep hands
+            over to a busy wait]
+        ]"""
+        self.speed = speed
+        self.spin = int(spin * 1e9)
+        # recorded time and perf_counter_ns that line up
+        self.anchor: Optional[Tuple[int, int]] = None
+        self.resyncs = 0
+
+    def restart(self) -> None:
+        self.anchor = None
+
+    def due(self, timestamp: int) -> int:
+        """[perf_counter_ns the packet recorded at timestamp goes at]"""
+        now = time.perf_counter_ns()
+        if self.anchor is None:
+            self.anchor = (timestamp, now)
+        recorded, wall = self.anchor
+        due = wall + int((timestamp - recorded) / self.speed)
+        if now - due > RESYNC_SECONDS * 1e9:
+            self.anchor = (timestamp, now)
+            self.resyncs += 1
+            due = now
+        return due
+
+    def wait(self, due: int) -> int:
+        """[sleep, then spin, until due
+
+        Returns:
+            int: [perf_counter_ns when done]
+        """
+        now = time.perf_counter_ns()
+        if due - now > self.spin:
+            time.sleep((due - now - self.spin) / 1e9)
+        while True:
+            now = time.perf_counter_ns()
+            if now >= due:
+                return now
+
+
+class Replay:
+    def __init__(
+        self,
+        session: str,
+        settings: Dict,
+        speed: float = 1.0,
+        inputs: Optional[List[str]] = None,
+        host: Optional[str] = None,
+        spin: float = SPIN_SECONDS,
+    ) -> None:
+        """[sends a recorded session's packets back out to the ports of the
+        inputs they came in on, with the time between them they arrived
+        with. the telemetry files are read from their memory maps as the
+        replay goes, a session is never loaded whole
+
+        Args:
+            session (str): [the session's folder]
+            settings (Dict): [package configuration file, for the inputs'
+            addresses]
+            speed (float): [1 for real time, 10 for ten times faster, 0 for
+            as fast as possible]
+            inputs (List[str], optional): [inputs to replay, all of them
+            but the controller if None]
+            host (str, optional): [send here instead of each input's ip]
+        """
+        self.index = session_index.SessionIndex(session)
+        segments = self.index.streams.get("telemetry", [])
+        self.addresses = {
+            conn["name"]: (host or conn["ip"], conn["port"])
+            for conn in settings["inputs"]
+            if (inputs is None and conn["name"] not in SKIP_INPUTS)
+            or (inputs is not None and conn["name"] in inputs)
+        }
+        self.first = segments[0].start if segments else 0
+        self.position = self.first
+        self.pacer = Pacer(speed, spin) if speed else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sent = 0
+        self.failed = 0
+        self.late = 0
+        self.error_ns = stats.Histogram()
+        # the error of the last packet, how far the replay has drifted
+        self.drift = 0
+
+    def seek(self, timestamp: int) -> None:
+        """[carry on from timestamp (ns), the pacing starts again there]"""
+        self.position = timestamp
+        if self.pacer is not None:
+            self.pacer.restart()
+
+    def run(self, duration: Optional[float] = None) -> int:
+        """[replay from the current position to the end of the session or
+        for duration recorded seconds
+
+        Returns:
+            int: [packets sent]
+        """
+        end = None
+        if duration is not None:
+            end = self.position + int(duration * 1e9)
+        records = self.index.iter_telemetry(self.position, end)
+        addresses = self.addresses
+        sock = self.sock
+        pacer = self.pacer
+        errors: List[int] = []
+        count = 0
+        try:
+            for timestamp, name, payload in records:
+                address = addresses.get(name)
+                if address is None:
+                    continue
+                if pacer is not None:
+                    due = pacer.due(timestamp)
+                    sent_at = pacer.wait(due)
+                    errors.append(sent_at - due)
+                try:
+                    sock.sendto(payload, address)
+                except OSError:
+                    # nobody listening or the send buffer is full
+                    self.failed += 1
+                else:
+                    count += 1
+                self.position = timestamp + 1
+                if len(errors) >= stats.FOLD_AT:
+                    self.fold(errors)
+                    errors = []
+        finally:
+            # the views of the mapped files go before the session can close
+            payload = None
+            records.close()
+            self.fold(errors)
+            self.sent += count
+        return count
+
+    def fold(self, errors: List[int]) -> None:
+        if not errors:
+            return
+        errors = np.array(errors, dtype=np.int64)
+        self.error_ns.record(errors)
+        self.late += int((errors > LATE_NS).sum())
+        self.drift = int(errors[-1])
+
+    def report(self) -> Dict:
+        """[what was sent and how close to its time]"""
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "speed": self.pacer.speed if self.pacer is not None else 0,
+            "error_ns": self.error_ns.summary(),
+            "late": self.late,
+            "drift_ns": self.drift,
+            "resyncs": self.pacer.resyncs if self.pacer is not None else 0,
+        }
+
+    def close(self) -> None:
+        self.sock.close()
+        self.index.close()
+
+
+if __name__ == "__main__":
+    # replay a recorded session into the inputs in config.json:
+    #   python replay.py recordings/session_<time> --speed 10 --seek 30
+    parser = argparse.ArgumentParser(description="dvr2 session replay")
+    parser.add_argument("session", help="recorded session folder")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="1 is real time"
+    )
+    parser.add_argument(
+        "--fast", action="store_true", help="as fast as possible"
+    )
+    parser.add_argument(
+        "--seek",
+        help="seconds from the start, or a local time 2021-09-22T14:32:07",
+    )
+    parser.add_argument("--duration", type=float, help="recorded seconds")
+    parser.add_argument(
+        "--inputs", nargs="+", help="inputs to replay, all but controller"
+    )
+    parser.add_argument("--host", help="send here instead of config.json's")
+    parser.add_argument(
+        "--spin", type=float, default=SPIN_SECONDS, help="busy wait seconds"
+    )
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+    with open(args.config, "r") as f:
+        settings = json.load(f)
+    replay = Replay(
+        str(Path(args.session)),
+        settings,
+        0 if args.fast else args.speed,
+        args.inputs,
+        args.host,
+        args.spin,
+    )
+    if args.seek:
+        replay.seek(session_index.parse_time(args.seek, replay.first))
+    started = time.perf_counter()
+    try:
+        replay.run(args.duration)
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - started
+    result = replay.report()
+    result["seconds"] = elapsed
+    print(json.dumps(result, indent=4))
+    replay.close()
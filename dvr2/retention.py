@@ -0,0 +1,525 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from pathlib import Path
+import argparse
+import ctypes
+import ctypes.util
+import datetime
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import re
+import shutil
+import time
+
+import numpy as np
+
+import shared_mailbox
+import time_index
+
+# defaults for the "retention" section of config.json
+# seconds between sweeps of the folders
+INTERVAL = 10.0
+# a file is only taken once it is not the newest of its folder and has
+# not been written for this long, the logger may still be finishing it
+SETTLE_SECONDS = 5.0
+# input bytes in each gzip member, the unit the time index points at
+BLOCK_BYTES = 1 << 20
+LEVEL = 6
+# input bytes read a second at most, so the worker's i/o stays a trickle
+# even where the disk's scheduler ignores the idle class
+RATE_BYTES = 8 << 20
+NICE = 19
+# defaults for each folder of the section
+MAX_BYTES = 1 << 30
+MAX_AGE_DAYS = 30.0
+COUNTERS_BYTES = 4096
+# linux ioprio_set, the idle class only gets the disk when nobody else
+# wants it
+IOPRIO_SET = {"x86_64": 251, "aarch64": 30, "i686": 289, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+# where the time of a line is, the debug log's asctime or a stats line's
+# "time", looked for near the start of the line only
+LOG_TIME = re.compile(
+    rb"(\d{4})-(\d\d)-(\d\d) (\d\d):(\d\d):(\d\d)(?:,(\d{3}))?"
+)
+JSON_TIME = re.compile(rb'"time": ([0-9.]+)')
+# the time a file was started, from get_new_log_file_name
+NAME_TIME = re.compile(r"(\d{4}-\d\d-\d\d_\d{6})(\d{3})?")
+TIME_SPAN = 64
+
+
+def line_time(line: bytes) -> Optional[int]:
+    """[when a log or stats line was written (ns), None for lines without
+    a time, like the rest of a traceback]"""
+    match = LOG_TIME.search(line, 0, TIME_SPAN)
+    if match is not None:
+        *fields, millis = match.groups()
+        when = datetime.datetime(*(int(field) for field in fields))
+        return int(when.timestamp()) * 1_000_000_000 + int(
+            millis or 0
+        ) * 1_000_000
+    match = JSON_TIME.search(line, 0, TIME_SPAN)
+    if match is not None:
+        return int(float(match.group(1)) * 1e9)
+    return None
+
+
+def name_time(path: Path) -> Optional[int]:
+    """[when a rotated file was started (ns), from its name]"""
+    match = NAME_TIME.search(path.name)
+    if match is None:
+        return None
+    when = datetime.datetime.strptime(match.group(1), "%Y-%m-%d_%H%M%S")
+    millis = int(match.group(2) or 0)
+    return int(when.timestamp()) * 1_000_000_000 + millis * 1_000_000
+
+
+def lower_priority(nice: int) -> Dict[str, bool]:
+    """[put the calling process behind everything else for cpu and disk.
+    SCHED_IDLE where there is one, as even nice 19 gets a share of a busy
+    core, and the idle i/o class
+
+    Returns:
+        Dict[str, bool]: [which of the two took]
+    ]"""
+    done = {"cpu": False, "io": False}
+    try:
+        os.sched_setscheduler(0, os.SCHED_IDLE, os.sched_param(0))
+        done["cpu"] = True
+    except (AttributeError, OSError):
+        try:
+            os.nice(nice)
+            done["cpu"] = True
+        except (AttributeError, OSError):
+            pass
+    number = IOPRIO_SET.get(platform.machine())
+    if number is not None:
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            done["io"] = (
+                libc.syscall(
+                    number,
+                    IOPRIO_WHO_PROCESS,
+                    0,
+                    IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT,
+                )
+                == 0
+            )
+        except (OSError, AttributeError, TypeError):
+            pass
+    return done
+
+
+def compress(
+    path: Path,
+    block_bytes: int = BLOCK_BYTES,
+    level: int = LEVEL,
+    rate_bytes: int = RATE_BYTES,
+    stop: Optional[multiprocessing.Event] = None,
+) -> Optional[Tuple[int, int]]:
+    """[gzip a closed file to path.gz, next to an index of where each
+    block's member starts and the time of its first line, then remove it.
+    blocks end on a line, each is a gzip member of its own, so the file
+    is still one .gz to zcat and a search by time decompresses from the
+    block it wants on
+
+    Args:
+        path (Path): [file to compress]
+        block_bytes (int): [input bytes in a block]
+        level (int): [gzip level]
+        rate_bytes (int): [input bytes read a second at most, 0 for no
+        limit]
+        stop (multiprocessing.Event, optional): [give up between blocks
+        once set]
+
+    Returns:
+        Optional[Tuple[int, int]]: [bytes read and written, None if it
+        was stopped, the file is left as it was then]
+    """
+    out = Path(f"{path}.gz")
+    parts = (Path(f"{out}.part"), Path(f"{out}.idx.part"))
+    index = time_index.IndexWriter(str(parts[1]))
+    started = time.monotonic()
+    read = written = 0
+    with open(path, "rb") as source, open(parts[0], "wb") as sink:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(
+                source.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL
+            )
+        while True:
+            if stop is not None and stop.is_set():
+                break
+            block = source.read(block_bytes)
+            if not block:
+                break
+            # run on to the end of the line so no line spans two blocks
+            block += source.readline()
+            for line in block.splitlines():
+                when = line_time(line)
+                if when is not None:
+                    index.add(when, written)
+                    break
+            member = gzip.compress(block, level, mtime=0)
+            sink.write(member)
+            read += len(block)
+            written += len(member)
+            if rate_bytes:
+                # sleep off what was read ahead of the rate
+                ahead = read / rate_bytes - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+        if hasattr(os, "posix_fadvise"):
+            # the log was read once and will not be again, its pages are
+            # better spent on the recordings
+            os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    index.close()
+    if stop is not None and stop.is_set():
+        for part in parts:
+            part.unlink()
+        return None
+    os.replace(parts[1], f"{out}.idx")
+    os.replace(parts[0], out)
+    path.unlink()
+    return read, written
+
+
+def search_file(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """[the lines of a log or stats file, compressed or not, written from
+    start to end (ns). a compressed file is only decompressed from the
+    block the index says holds start, and no further than end. lines
+    without a time go with the line before them]"""
+    offset = 0
+    index_path = Path(f"{path}.idx")
+    if path.suffix == ".gz" and index_path.exists():
+        index = time_index.read_index(str(index_path))
+        block = int(np.searchsorted(index["timestamp"], start, "right"))
+        if block:
+            offset = int(index["position"][block - 1])
+        del index
+    with open(path, "rb") as f:
+        f.seek(offset)
+        lines = gzip.GzipFile(fileobj=f) if path.suffix == ".gz" else f
+        when = None
+        for line in lines:
+            when = line_time(line) or when
+            if when is None or when < start:
+                continue
+            if when > end:
+                break
+            yield line
+
+
+def search(
+    folder: str, pattern: str, start: int, end: int
+) -> Iterator[bytes]:
+    """[the lines written from start to end (ns) across a folder of
+    rotated files, in time order. a file runs from the time in its name
+    to the next file's, only the files overlapping start to end are
+    opened
+
+    Args:
+        folder (str): [the folder, "log" say]
+        pattern (str): [its files, "debug_*.log" say]
+        start (int): [from (ns)]
+        end (int): [to (ns)]
+    """
+    files = sorted(
+        (when, path)
+        for path in files_of(Path(folder), pattern)
+        for when in [name_time(path)]
+        if when is not None
+    )
+    for num, (when, path) in enumerate(files):
+        following = files[num + 1][0] if num + 1 < len(files) else None
+        if when > end or (following is not None and following <= start):
+            continue
+        yield from search_file(path, start, end)
+
+
+def files_of(folder: Path, pattern: str) -> List[Path]:
+    """[a folder's files, compressed or not, oldest first]"""
+    found = list(folder.glob(pattern)) + list(folder.glob(f"{pattern}.gz"))
+    return sorted(found, key=lambda path: path.name)
+
+
+def directories_of(folder: Path, pattern: str) -> List[Path]:
+    """[a folder's directories, oldest first]"""
+    found = [path for path in folder.glob(pattern) if path.is_dir()]
+    return sorted(found, key=lambda path: path.name)
+
+
+def tree(path: Path) -> Tuple[int, float]:
+    """[bytes in a directory and everything under it, and when the last of
+    it was written]"""
+    total = 0
+    modified = path.stat().st_mtime
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(root, name))
+            except FileNotFoundError:
+                continue
+            total += stat.st_size
+            modified = max(modified, stat.st_mtime)
+    return total, modified
+
+
+class Retention:
+    def __init__(
+        self,
+        settings: Dict,
+        stop: Optional[multiprocessing.Event] = None,
+    ) -> None:
+        """[compresses the rotated files of each folder once they are
+        closed and keeps each folder inside its size and age limits,
+        removing the oldest files first. the newest file of a folder is
+        the one being written and is never touched. a folder with
+        "directories" set, like the recordings' session folders or the
+        exports, has whole directories kept the same way, uncompressed,
+        and one with anything written in the last settle_seconds is left
+        alone as well
+
+        Args:
+            settings (Dict): [the "retention" section of config.json]
+            stop (multiprocessing.Event, optional): [ends a sweep early]
+        """
+        self.folders = settings.get("folders", [])
+        self.settle_seconds = settings.get("settle_seconds", SETTLE_SECONDS)
+        self.block_bytes = settings.get("block_bytes", BLOCK_BYTES)
+        self.level = settings.get("level", LEVEL)
+        self.rate_bytes = settings.get("rate_bytes", RATE_BYTES)
+        self.stop = stop
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.compress_seconds = 0.0
+        self.removed = 0
+        self.removed_bytes = 0
+        # parts of a compression cut short, by a crash say
+        self.removed_parts = 0
+        self.pending = 0
+        self.kept_bytes = 0
+
+    def sweep(self, now: Optional[float] = None) -> None:
+        """[one pass over the folders, compressing then enforcing limits]"""
+        now = time.time() if now is None else now
+        self.pending = 0
+        self.kept_bytes = 0
+        for folder in self.folders:
+            if not folder.get("directories", False):
+                self.remove_parts(folder, now)
+                self.compress_folder(folder, now)
+            self.enforce(folder, now)
+
+    def remove_parts(self, folder: Dict, now: float) -> None:
+        path = Path(folder["folder"])
+        pattern = folder["pattern"]
+        for part in list(path.glob(f"{pattern}.gz.part")) + list(
+            path.glob(f"{pattern}.gz.idx.part")
+        ):
+            # one still growing is another sweep's, from the command line
+            if now - part.stat().st_mtime >= self.settle_seconds:
+                part.unlink()
+                self.removed_parts += 1
+
+    def closed(self, folder: Dict, now: float) -> List[Path]:
+        files = sorted(
+            Path(folder["folder"]).glob(folder["pattern"]),
+            key=lambda path: path.name,
+        )
+        return [
+            path
+            for path in files[:-1]
+            if now - path.stat().st_mtime >= self.settle_seconds
+        ]
+
+    def compress_folder(self, folder: Dict, now: float) -> None:
+        waiting = self.closed(folder, now)
+        self.pending += len(waiting)
+        for path in waiting:
+            started = time.perf_counter()
+            done = compress(
+                path, self.block_bytes, self.level, self.rate_bytes, self.stop
+            )
+            if done is None:
+                return
+            self.compressed += 1
+            self.pending -= 1
+            self.bytes_in += done[0]
+            self.bytes_out += done[1]
+            self.compress_seconds += time.perf_counter() - started
+
+    def enforce(self, folder: Dict, now: float) -> None:
+        directories = folder.get("directories", False)
+        if directories:
+            files = directories_of(Path(folder["folder"]), folder["pattern"])
+        else:
+            files = files_of(Path(folder["folder"]), folder["pattern"])
+        if not files:
+            return
+        max_age = folder.get("max_age_days", MAX_AGE_DAYS) * 86400
+        max_bytes = folder.get("max_bytes", MAX_BYTES)
+        modified = {}
+        if directories:
+            sizes = {}
+            for path in files:
+                sizes[path], modified[path] = tree(path)
+        else:
+            sizes = {path: self.size(path) for path in files}
+        total = sum(sizes.values())
+        newest = max(files, key=lambda path: path.name)
+        for path in files:
+            if path == newest:
+                break
+            if path in modified and now - modified[path] < self.settle_seconds:
+                # an export still running, say
+                continue
+            # a compressed file's mtime is when it was compressed, its
+            # name says when it was started
+            when = name_time(path)
+            started = path.stat().st_mtime if when is None else when / 1e9
+            old = now - started > max_age
+            if not old and total <= max_bytes:
+                break
+            self.remove(path)
+            total -= sizes[path]
+        self.kept_bytes += total
+
+    @staticmethod
+    def size(path: Path) -> int:
+        index = Path(f"{path}.idx")
+        extra = index.stat().st_size if index.exists() else 0
+        return path.stat().st_size + extra
+
+    def remove(self, path: Path) -> None:
+        if path.is_dir():
+            self.removed_bytes += tree(path)[0]
+            shutil.rmtree(path)
+        else:
+            self.removed_bytes += self.size(path)
+            Path(f"{path}.idx").unlink(missing_ok=True)
+            path.unlink()
+        self.removed += 1
+
+    def counters(self) -> Dict:
+        return {
+            "compressed": self.compressed,
+            "pending": self.pending,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "ratio": self.bytes_in / max(self.bytes_out, 1),
+            "compress_seconds": self.compress_seconds,
+            "removed": self.removed,
+            "removed_bytes": self.removed_bytes,
+            "removed_parts": self.removed_parts,
+            "kept_bytes": self.kept_bytes,
+        }
+
+
+def retention_process(
+    settings: Dict,
+    counters: shared_mailbox.Mailbox,
+    stop: multiprocessing.Event,
+) -> None:
+    """[the retention worker's own process, below ingest and recording
+    for both cpu and disk, a sweep every interval seconds]"""
+    logger = logging.getLogger("retention")
+    priority = lower_priority(settings.get("nice", NICE))
+    retention = Retention(settings, stop)
+    interval = settings.get("interval", INTERVAL)
+    while not stop.is_set():
+        retention.sweep()
+        summary = dict(retention.counters(), priority=priority)
+        counters.write(json.dumps(summary).encode(), time.monotonic())
+        stop.wait(interval)
+    logger.info(
+        f"retention stopped, {retention.compressed} files compressed "
+        f"{retention.bytes_in / max(retention.bytes_out, 1):.1f} to 1, "
+        f"{retention.removed} removed"
+    )
+    counters.close()
+
+
+def start_retention(
+    settings: Dict, logger: logging.Logger
+) -> Tuple[
+    Optional[multiprocessing.Process],
+    Optional[shared_mailbox.Mailbox],
+    multiprocessing.Event,
+]:
+    """[the retention process, if config.json has a "retention" section
+
+    Returns:
+        Tuple: [the process, the mailbox its counters come in and the
+        event that stops it, all but the event None without retention]
+    """
+    stop = multiprocessing.Event()
+    if "retention" not in settings:
+        return None, None, stop
+    counters = shared_mailbox.Mailbox(COUNTERS_BYTES)
+    process = multiprocessing.Process(
+        name="retention",
+        target=retention_process,
+        args=(settings["retention"], counters, stop),
+        daemon=True,
+    )
+    process.start()
+    logger.info("retention process started")
+    return process, counters, stop
+
+
+def read_counters(counters: Optional[shared_mailbox.Mailbox]) -> Dict:
+    """[the retention worker's latest counters, for the stats]"""
+    if counters is None or not counters.count:
+        return {}
+    return json.loads(counters.read()[2])
+
+
+def stop_retention(
+    process: Optional[multiprocessing.Process],
+    counters: Optional[shared_mailbox.Mailbox],
+    stop: multiprocessing.Event,
+    logger: logging.Logger,
+) -> None:
+    stop.set()
+    if process is None:
+        return
+    process.join(timeout=5)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+    counters.close()
+    logger.debug("SHUTTING DOWN: retention stopped")
+
+
+if __name__ == "__main__":
+    # sweep the folders once, or search them by time:
+    #   python retention.py sweep
+    #   python retention.py search log "debug_*.log" 2021-09-22T14:32 \
+    #       2021-09-22T14:40
+    parser = argparse.ArgumentParser(description="dvr2 log retention")
+    parser.add_argument("action", choices=("sweep", "search"))
+    parser.add_argument("folder", nargs="?")
+    parser.add_argument("pattern", nargs="?")
+    parser.add_argument("start", nargs="?", help="local time, iso format")
+    parser.add_argument("end", nargs="?", help="local time, iso format")
+    parser.add_argument("--config", default="config.json")
+    args = parser.parse_args()
+    if args.action == "sweep":
+        with open(args.config, "r") as f:
+            settings = json.load(f)
+        retention = Retention(settings.get("retention", {}))
+        retention.sweep()
+        print(json.dumps(retention.counters(), indent=4))
+    else:
+        start, end = (
+            int(datetime.datetime.fromisoformat(text).timestamp() * 1e9)
+            for text in (args.start, args.end)
+        )
+        for line in search(args.folder, args.pattern, start, end):
+            print(line.decode(errors="replace").rstrip("\n"))
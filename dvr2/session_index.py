@@ -0,0 +1,164 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from pathlib import Path
+import bisect
+import datetime
+
+import numpy as np
+
+import telemetry_file
+import time_index
+
+# telemetry segment extension, anything else with an index is video
+TELEMETRY_EXT = ".tlm"
+
+
+def parse_time(text: str, first: int) -> int:
+    """[a time given as seconds from the start of the session or as a
+    local date and time, 2021-09-22T14:32:07, to a timestamp (ns)
+
+    Args:
+        text (str): [the time]
+        first (int): [the session's first timestamp (ns)]
+    """
+    if ":" in text:
+        moment = datetime.datetime.fromisoformat(text)
+        return int(moment.timestamp() * 1e9)
+    return first + int(float(text) * 1e9)
+
+
+class Segment:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.index = time_index.read_index(f"{path}.idx")
+        self.start = int(self.index["timestamp"][0]) if len(self.index) else 0
+
+    def position(self, timestamp: int) -> Optional[Tuple[int, int]]:
+        """[last index entry at or before timestamp, as (timestamp,
+        position)]"""
+        idx = np.searchsorted(self.index["timestamp"], timestamp, "right")
+        if idx == 0:
+            return None
+        entry = self.index[idx - 1]
+        return int(entry["timestamp"]), int(entry["position"])
+
+
+class SessionIndex:
+    def __init__(self, session: str) -> None:
+        """[time lookups across every segment of a recorded session, a
+        bisect over the segments then one over the segment's index]
+
+        Args:
+            session (str): [the session's folder]
+        """
+        self.streams: Dict[str, List[Segment]] = {}
+        for path in sorted(Path(session).glob("*.idx")):
+            segment = Segment(path.with_suffix(""))
+            if not len(segment.index):
+                continue
+            stream = segment.path.stem.rsplit("_", 2)[0]
+            if segment.path.suffix == TELEMETRY_EXT:
+                stream = "telemetry"
+            self.streams.setdefault(stream, []).append(segment)
+        self.starts: Dict[str, List[int]] = {}
+        for stream, segments in self.streams.items():
+            segments.sort(key=lambda segment: segment.start)
+            self.starts[stream] = [segment.start for segment in segments]
+        self.readers: Dict[Path, telemetry_file.TelemetryReader] = {}
+
+    def segment(self, stream: str, timestamp: int) -> Optional[Segment]:
+        starts = self.starts.get(stream, [])
+        idx = bisect.bisect_right(starts, timestamp)
+        if idx == 0:
+            return None
+        return self.streams[stream][idx - 1]
+
+    @property
+    def cameras(self) -> List[str]:
+        return [stream for stream in self.streams if stream != "telemetry"]
+
+    def frame(self, camera: str, timestamp: int) -> Optional[Tuple]:
+        """[the camera's last frame at or before timestamp (ns)
+
+        Returns:
+            Optional[Tuple]: [segment path, frame number in the segment and
+            the frame's timestamp]
+        """
+        segment = self.segment(camera, timestamp)
+        if segment is None:
+            return None
+        frame_timestamp, number = segment.position(timestamp)
+        return segment.path, number, frame_timestamp
+
+    def reader(self, path: Path) -> telemetry_file.TelemetryReader:
+        if path not in self.readers:
+            self.readers[path] = telemetry_file.TelemetryReader(str(path))
+        return self.readers[path]
+
+    def iter_telemetry(
+        self, start: int, end: Optional[int] = None
+    ) -> Iterator[Tuple[int, str, memoryview]]:
+        """[telemetry records timestamped from start to end (ns), or to the
+        end of the session, found by seeking to the index entry before start
+        and reading on from there a record at a time
+
+        Returns:
+            Iterator[Tuple[int, str, memoryview]]: [(timestamp, input name,
+            payload) in file order, payloads are views of the mapped files]
+        """
+        segment = self.segment("telemetry", start)
+        segments = self.streams.get("telemetry", [])
+        first = segments.index(segment) if segment is not None else 0
+        for segment in segments[first:]:
+            if end is not None and segment.start > end:
+                return
+            entry = segment.position(start)
+            reader = self.reader(segment.path)
+            offset = entry[1] if entry is not None else reader.start
+            for timestamp, input_id, payload in reader.iter_from(offset):
+                if end is not None and timestamp > end:
+                    break
+                if timestamp >= start:
+                    yield timestamp, reader.inputs[input_id], payload
+
+    def telemetry(self, start: int, end: int) -> List[Tuple]:
+        """[iter_telemetry as a list]"""
+        return list(self.iter_telemetry(start, end))
+
+    def at(self, timestamp: int, window: int = 1_000_000_000) -> Dict:
+        """[what happened at timestamp (ns): the telemetry of the window
+        before it and every camera's frame]"""
+        result = {"telemetry": self.telemetry(timestamp - window, timestamp)}
+        for camera in self.cameras:
+            result[camera] = self.frame(camera, timestamp)
+        return result
+
+    def close(self) -> None:
+        for reader in self.readers.values():
+            reader.close()
+        self.readers = {}
+
+
+if __name__ == "__main__":
+    # testing code, time lookups on a recorded session:
+    #   python session_index.py recordings/session_<time>
+    import random
+    import sys
+    import time
+
+    session = SessionIndex(sys.argv[1])
+    for stream, segments in session.streams.items():
+        entries = sum(len(segment.index) for segment in segments)
+        print(f"{stream}: {len(segments)} segments, {entries} index entries")
+    first = min(starts[0] for starts in session.starts.values())
+    last = max(
+        int(segments[-1].index["timestamp"][-1])
+        for segments in session.streams.values()
+    )
+    count = 1000
+    start = time.perf_counter()
+    for _ in range(count):
+        moment = session.at(random.randint(first, last), window=100_000_000)
+    elapsed = time.perf_counter() - start
+    print(f"lookup: {elapsed / count * 1e6:.0f} us")
+    del moment
+    session.close()
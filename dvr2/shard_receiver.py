@@ -0,0 +1,293 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+from itertools import takewhile
+import heapq
+import logging
+import multiprocessing
+import selectors
+import socket
+import time
+
+import clock
+import packet_ring
+import shared_mailbox
+import socket_connections
+
+# bytes of packets each shard can hold for main before it drops
+RING_BYTES = 1 << 22
+# seconds a shard blocks before checking whether it should stop, and
+# marking its ring drained up to now so main can release what other shards
+# wrote. also how often main looks again while it is holding packets back
+POLL = 0.01
+# a packet is stamped a little before it can be read off the socket, a
+# ring is marked drained this far (ns) behind the time of its last drain
+MARK_MARGIN = 1_000_000
+
+
+def bind_shard(setting: Dict, shards: int) -> socket.socket:
+    """[a non-blocking socket on the input's port, shared with the input's
+    other shards through SO_REUSEPORT so the kernel spreads senders over
+    them]"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if shards > 1:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((setting["ip"], setting["port"]))
+    sock.setblocking(False)
+    return sock
+
+
+def receive_shard(
+    setting: Dict,
+    shards: int,
+    mailbox: shared_mailbox.Mailbox,
+    lock: multiprocessing.Lock,
+    ring: packet_ring.PacketRing,
+    wakeup: Tuple[str, int],
+    stop: multiprocessing.Event,
+    anchor: Tuple[int, int],
+) -> None:
+    """[shard process, the same drain as main.get_packets on its own core.
+    every packet goes into the shard's ring for main to record, the newest
+    one into the input's mailbox unless another shard has published a
+    newer packet already]
+
+    Args:
+        setting (Dict): [the input's settings]
+        shards (int): [number of shards of the input]
+        mailbox (shared_mailbox.Mailbox): [the input's latest value]
+        lock (multiprocessing.Lock): [shared by the input's shards, held
+        while comparing and writing the mailbox]
+        ring (packet_ring.PacketRing): [this shard's packets for main]
+        wakeup (Tuple[str, int]): [main's wakeup socket, a datagram is sent
+        per drain]
+        stop (multiprocessing.Event): [set to end the process]
+        anchor (Tuple[int, int]): [main's clock.ANCHOR, so packets are
+        stamped on main's clock]
+    """
+    clock.set_anchor(*anchor)
+    sock = bind_shard(setting, shards)
+    kernel_stamps = setting.get(
+        "kernel_timestamps", True
+    ) and clock.kernel_timestamps(sock)
+    notify = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    notify.setblocking(False)
+    buffer = bytearray(socket_connections.MAX_DATAGRAM)
+    buffers = [buffer]
+    view = memoryview(buffer)
+    sel = selectors.DefaultSelector()
+    sel.register(sock, selectors.EVENT_READ)
+    while not stop.is_set():
+        # drained or not, the socket is looked at, a packet can come in
+        # between the select timing out and the mark
+        sel.select(timeout=POLL)
+        if kernel_stamps:
+            shift = clock.kernel_shift()
+        nbytes = -1
+        while True:
+            drained = clock.now_ns()
+            try:
+                if kernel_stamps:
+                    nbytes, ancdata, _, _ = sock.recvmsg_into(
+                        buffers, clock.ANCILLARY_SIZE
+                    )
+                else:
+                    nbytes = sock.recv_into(buffer)
+            except (BlockingIOError, InterruptedError):
+                break
+            if kernel_stamps and ancdata:
+                seconds, nanoseconds = clock.TIMESPEC.unpack(ancdata[0][2])
+                timestamp = seconds * 1_000_000_000 + nanoseconds + shift
+            else:
+                timestamp = clock.now_ns()
+            ring.write(view[:nbytes], timestamp)
+        ring.mark(drained - MARK_MARGIN)
+        if nbytes < 0:
+            continue
+        with lock:
+            if mailbox.timestamp <= timestamp:
+                mailbox.write(view[:nbytes], timestamp)
+        try:
+            notify.sendto(b"\x00", wakeup)
+        except OSError:
+            # main has wakeups queued already, one is enough
+            pass
+    sel.close()
+    sock.close()
+    notify.close()
+    ring.close()
+    mailbox.close()
+
+
+def ordered(
+    rings: List[packet_ring.PacketRing],
+) -> Iterator[Tuple[int, int, memoryview]]:
+    """[the records of an input's shard rings merged into timestamp order,
+    up to the time every shard has drained to. a newer record could still
+    be followed by an older one from a shard further behind, it is left in
+    its ring for a later drain. release the rings once done]"""
+    watermark = min(ring.drained for ring in rings)
+    # each ring is in order already, only the shards need merging
+    return heapq.merge(
+        *(
+            takewhile(lambda record: record[0] <= watermark, ring.read())
+            for ring in rings
+        ),
+        key=lambda record: record[0],
+    )
+
+
+class ShardGroup:
+    def __init__(
+        self,
+        setting: Dict,
+        index: int,
+        shards: int,
+        mailbox: shared_mailbox.Mailbox,
+        ring_bytes: int = RING_BYTES,
+    ) -> None:
+        """[main's side of a sharded input: the shard processes, their rings
+        and the sockets they wake main with. main reads the rings in
+        timestamp order and records and decodes the packets as get_packets
+        does for an input it receives itself]
+
+        Args:
+            setting (Dict): [the input's settings]
+            index (int): [the input's position in settings["inputs"]]
+            shards (int): [receiver processes]
+            mailbox (shared_mailbox.Mailbox): [the input's latest value]
+            ring_bytes (int): [size of each shard's ring]
+        """
+        self.name = setting["name"]
+        self.index = index
+        self.decoder = None
+        self.forward = None
+        self.stats = None
+        self.stop = multiprocessing.Event()
+        # kept, a spawned shard attaches to it by name after start returns
+        self.lock = multiprocessing.Lock()
+        self.rings: List[packet_ring.PacketRing] = []
+        self.processes: List[multiprocessing.Process] = []
+        # every shard of the input wakes main through this one socket
+        self.wakeup = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wakeup.bind(("127.0.0.1", 0))
+        self.wakeup.setblocking(False)
+        for shard in range(shards):
+            ring = packet_ring.PacketRing(ring_bytes)
+            process = multiprocessing.Process(
+                name=f"{self.name}_shard{shard}",
+                target=receive_shard,
+                args=(
+                    setting,
+                    shards,
+                    mailbox,
+                    self.lock,
+                    ring,
+                    self.wakeup.getsockname(),
+                    self.stop,
+                    clock.ANCHOR,
+                ),
+                daemon=True,
+            )
+            process.start()
+            self.rings.append(ring)
+            self.processes.append(process)
+
+    @property
+    def holding(self) -> bool:
+        """[packets are left in the rings for a later drain]"""
+        return any(ring.backlog for ring in self.rings)
+
+    @property
+    def dropped(self) -> int:
+        """[packets the shards could not hand to main, their rings full]"""
+        return sum(ring.dropped for ring in self.rings)
+
+    def get_packets(self, session_recorder=None) -> int:
+        """[read every shard's ring, merged into timestamp order, into the
+        decoder and the recorder
+
+        Returns:
+            int: [number of packets read]
+        ]"""
+        if self.stats is not None:
+            started = time.perf_counter_ns()
+        while True:
+            try:
+                self.wakeup.recv(16)
+            except BlockingIOError:
+                break
+        decoder = self.decoder
+        forward = self.forward
+        count = 0
+        total = 0
+        if len(self.rings) == 1:
+            records = self.rings[0].read()
+        else:
+            records = ordered(self.rings)
+        for timestamp, _, payload in records:
+            count += 1
+            total += len(payload)
+            if decoder is not None:
+                decoder.add(payload, timestamp)
+            if forward is not None:
+                forward.send(payload)
+            if session_recorder is not None:
+                session_recorder.add(self.name, timestamp, payload)
+        payload = None
+        for ring in self.rings:
+            ring.release()
+        if count == 0:
+            return 0
+        if self.stats is not None:
+            drained = decoded = time.perf_counter_ns()
+        if decoder is not None:
+            decoder.flush()
+            if self.stats is not None:
+                decoded = time.perf_counter_ns()
+        if self.stats is not None:
+            # the shards publish, main has nothing to time for it
+            self.stats.pending.append(
+                (started, drained, decoded, decoded, count, total)
+            )
+        return count
+
+    def close(self) -> None:
+        self.stop.set()
+        for process in self.processes:
+            process.join()
+        self.wakeup.close()
+        for ring in self.rings:
+            ring.close()
+
+
+def start_shards(
+    settings: Dict, mailboxes: List, logger: logging.Logger
+) -> Dict[str, ShardGroup]:
+    """[a ShardGroup for every input with "shards" set in config.json, the
+    controller is always read by main]
+
+    Returns:
+        Dict[str, ShardGroup]: [by input name]
+    """
+    groups = {}
+    for index, setting in enumerate(settings["inputs"]):
+        shards = setting.get("shards", 0)
+        if not shards or setting["name"] == "controller":
+            continue
+        if shards > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            logger.warning(
+                f"no SO_REUSEPORT here, {setting['name']} gets one shard"
+            )
+            shards = 1
+        groups[setting["name"]] = ShardGroup(
+            setting, index, shards, mailboxes[index]
+        )
+        logger.info(f"{setting['name']} received by {shards} shard processes")
+    return groups
+
+
+def stop_shards(groups: Dict[str, ShardGroup], logger: logging.Logger) -> None:
+    for name, group in groups.items():
+        group.close()
+        logger.debug(f"SHUTTING DOWN: {name} shards stopped")
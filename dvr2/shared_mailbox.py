@@ -0,0 +1,161 @@
+import os
+import struct
+from typing import Optional, Tuple, Union
+from multiprocessing import shared_memory
+
+# slot layout: sequence number, timestamp, payload length, then the payload
+SEQ = struct.Struct("<Q")
+META = struct.Struct("<dI")
+# the same with the timestamp as integer ns, packet receive stamps are
+# kept to the ns that a float of seconds would round off
+META_NS = struct.Struct("<qI")
+HEADER_SIZE = 24
+
+
+class Mailbox:
+    def __init__(
+        self,
+        size: int,
+        name: Optional[str] = None,
+        create: bool = True,
+        ns: bool = False,
+    ) -> None:
+        """[a single "latest value" slot in shared memory guarded by a
+        seqlock. one writer overwrites the slot without locking, readers in
+        any process copy out the newest payload and can tell how many
+        updates they missed]
+
+        Args:
+            size (int): [largest payload the slot can hold in bytes]
+            name (str, optional): [shared memory block name, made up when
+            creating and None]
+            create (bool): [True for the owner, False to attach]
+            ns (bool): [timestamps are integer ns rather than float
+            seconds, every process using the mailbox has to agree]
+        """
+        self.size = size
+        self.ns = ns
+        self.meta = META_NS if ns else META
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=HEADER_SIZE + size
+        )
+        self.name = self.shm.name
+        # only the owner unlinks, child processes share its resource
+        # tracker so attaching does not register the block twice
+        self.owner = create
+        # a forked child holds the owner's object, it must not unlink
+        self.owner_pid = os.getpid()
+        self.buf = self.shm.buf
+        # update count of the newest packet this reader has seen
+        self.seen = 0
+        if create:
+            SEQ.pack_into(self.buf, 0, 0)
+
+    def __reduce__(self):
+        # pass by name so a child process attaches to the same block
+        return (Mailbox, (self.size, self.name, False, self.ns))
+
+    def write(self, payload, timestamp: Union[float, int]) -> None:
+        """[overwrite the slot, only one process may write to a mailbox]
+
+        Args:
+            payload ([bytes-like]): [packet data, at most size bytes]
+            timestamp (Union[float, int]): [packet time, ns with ns set]
+        """
+        buf = self.buf
+        nbytes = len(payload)
+        if nbytes > self.size:
+            raise ValueError(
+                f"{nbytes} byte payload too big for {self.size} byte mailbox"
+            )
+        seq = SEQ.unpack_from(buf, 0)[0]
+        # an odd sequence tells readers a write is under way
+        SEQ.pack_into(buf, 0, seq + 1)
+        self.meta.pack_into(buf, 8, timestamp, nbytes)
+        buf[HEADER_SIZE : HEADER_SIZE + nbytes] = payload
+        SEQ.pack_into(buf, 0, seq + 2)
+
+    def _read(self, out) -> Tuple[int, Union[float, int], int]:
+        buf = self.buf
+        while True:
+            seq = SEQ.unpack_from(buf, 0)[0]
+            if seq & 1:
+                continue
+            timestamp, nbytes = self.meta.unpack_from(buf, 8)
+            if nbytes > self.size:
+                # torn header, the writer moved on mid read
+                continue
+            if out is None:
+                data = bytes(buf[HEADER_SIZE : HEADER_SIZE + nbytes])
+            else:
+                out[:nbytes] = buf[HEADER_SIZE : HEADER_SIZE + nbytes]
+                data = nbytes
+            if SEQ.unpack_from(buf, 0)[0] == seq:
+                return seq, timestamp, data
+
+    def read(self) -> Tuple[int, Union[float, int], bytes, int]:
+        """[copy out the newest packet]
+
+        Returns:
+            Tuple[int, Union[float, int], bytes, int]: [update count (0 =
+            never written), timestamp, payload, updates missed since the
+            last read]
+        """
+        seq, timestamp, data = self._read(None)
+        return (seq // 2, timestamp, data, self._missed(seq))
+
+    def read_into(self, out) -> Tuple[int, Union[float, int], int, int]:
+        """[same as read, but copies the payload into a preallocated
+        writable buffer of at least size bytes]
+
+        Returns:
+            Tuple[int, Union[float, int], int, int]: [update count,
+            timestamp, payload length, updates missed since the last read]
+        """
+        seq, timestamp, nbytes = self._read(out)
+        return (seq // 2, timestamp, nbytes, self._missed(seq))
+
+    def _missed(self, seq: int) -> int:
+        count = seq // 2
+        missed = max(0, count - self.seen - 1)
+        self.seen = max(self.seen, count)
+        return missed
+
+    @property
+    def timestamp(self) -> Union[float, int]:
+        """[timestamp of the newest write, not torn for a writer holding
+        the lock writers share, a reader should use read]"""
+        return self.meta.unpack_from(self.buf, 8)[0]
+
+    @property
+    def count(self) -> int:
+        """[number of writes so far, without copying the payload]"""
+        return SEQ.unpack_from(self.buf, 0)[0] // 2
+
+    def close(self) -> None:
+        self.buf = None
+        self.shm.close()
+        if self.owner and os.getpid() == self.owner_pid:
+            self.shm.unlink()
+
+
+if __name__ == "__main__":
+    # testing code
+    import time
+
+    box = Mailbox(1024)
+    reader = Mailbox(1024, box.name, create=False)
+    count = 200_000
+    packet = b"x" * 100
+    start = time.perf_counter()
+    for _ in range(count):
+        box.write(packet, time.time())
+    elapsed = time.perf_counter() - start
+    print(f"write: {elapsed / count * 1e9:.0f} ns/packet")
+    start = time.perf_counter()
+    for _ in range(count):
+        reader.read()
+    elapsed = time.perf_counter() - start
+    print(f"read: {elapsed / count * 1e9:.0f} ns/packet")
+    reader.close()
+    box.close()
@@ -2,6 +2,9 @@ import socket
 import logging
 import debug_logger
 
+# largest payload a UDP datagram can carry over IPv4
+MAX_DATAGRAM = 65507
+
 
 class Connection:
     def __init__(
@@ -19,6 +22,21 @@ class Connection:
         self.host = host
         self.port = port
         self.logger = logger
+        # position in the settings list, set once by get_connections
+        self.index = -1
+        # receive buffer reused for every datagram, so the hot path does
+        # not allocate a new bytes object per packet
+        self.buffer = bytearray(MAX_DATAGRAM)
+        self.view = memoryview(self.buffer)
+        self.buffers = [self.buffer]
+        # True once the socket hands out kernel receive timestamps
+        self.kernel_stamps = False
+        # optional stage fed every datagram, e.g. overlay_decoder
+        self.decoder = None
+        # optional forwarder.Route sent every datagram
+        self.forward = None
+        # optional stats.InputStats kept up to date by get_packets
+        self.stats = None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         # used so it can stop start without locking up the ports
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -28,6 +46,8 @@ class Connection:
 
     def bind_open(self):
         self.sock.bind((self.host, self.port))
+        # non-blocking so a reader can drain the socket until it is empty
+        self.sock.setblocking(False)
         self.logger.info(f"Port {self.port} open")
 
 
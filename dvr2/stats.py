@@ -0,0 +1,324 @@
+from typing import Callable, Deque, Dict, List, Tuple
+from collections import deque
+import errno
+import json
+import socket
+import threading
+import time
+
+import numpy as np
+
+# log-linear buckets like HdrHistogram: values below LINEAR get a bucket
+# each, above that every power of two is split into SUB_COUNT buckets, so a
+# value is known to within 1 / SUB_COUNT (3%) at any size
+SUB_BITS = 5
+SUB_COUNT = 1 << SUB_BITS
+LINEAR = 2 * SUB_COUNT
+# largest power of two tracked, 2^46 ns is most of a day
+MAX_SHIFT = 40
+BUCKETS = LINEAR + MAX_SHIFT * SUB_COUNT
+PERCENTILES = (50, 90, 99, 99.9)
+# wakeups get_packets leaves pending before it folds them itself
+FOLD_AT = 4096
+# the most a udp datagram can carry, a bigger reply is cut down to fit
+MAX_REPLY = 65507
+
+
+def bucket_high(idx: int) -> int:
+    """[largest value that falls in bucket idx]"""
+    if idx < LINEAR:
+        return idx
+    shift, sub = divmod(idx - LINEAR, SUB_COUNT)
+    shift += 1
+    return ((sub + SUB_COUNT + 1) << shift) - 1
+
+
+class Histogram:
+    def __init__(self) -> None:
+        """[counts of non-negative integer values (ns, packets) in log-linear
+        buckets, values are added a batch at a time]"""
+        self.counts = np.zeros(BUCKETS, dtype=np.int64)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, values: np.ndarray) -> None:
+        values = np.maximum(values.astype(np.int64), 0)
+        idx = values.copy()
+        big = values >= LINEAR
+        if big.any():
+            large = values[big]
+            # frexp's exponent is the bit length
+            shift = np.frexp(large.astype(np.float64))[1] - SUB_BITS - 1
+            idx[big] = (
+                LINEAR + (shift - 1) * SUB_COUNT + (large >> shift) - SUB_COUNT
+            )
+        self.counts += np.bincount(
+            np.minimum(idx, BUCKETS - 1), minlength=BUCKETS
+        )
+        self.count += len(values)
+        self.total += int(values.sum())
+        self.max = max(self.max, int(values.max()))
+
+    def percentile(self, percentile: float) -> int:
+        """[value at or below which percentile % of the values fall, to
+        within a bucket]"""
+        if self.count == 0:
+            return 0
+        target = max(1, round(self.count * percentile / 100))
+        idx = int(np.searchsorted(np.cumsum(self.counts), target))
+        return min(bucket_high(idx), self.max)
+
+    def summary(self) -> Dict:
+        summary = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+        }
+        for percentile in PERCENTILES:
+            summary[f"p{percentile}"] = self.percentile(percentile)
+        summary["max"] = self.max
+        return summary
+
+
+class InputStats:
+    def __init__(self) -> None:
+        """[counters and stage times of one input. get_packets only appends
+        a tuple per wakeup to pending, the counting is done by fold, off the
+        ingest path or once enough has piled up]"""
+        # perf_counter_ns at the start, after the drain loop, after the
+        # decoder (the same as after the drain without one) and after the
+        # mailbox write, then packets and bytes drained
+        self.pending: Deque[Tuple[int, int, int, int, int, int]] = deque()
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.bytes = 0
+        # drained but never published, a newer packet came in the same
+        # wakeup
+        self.superseded = 0
+        self.wakeups = 0
+        # controller datagrams, every one of them goes to main
+        self.commands = 0
+        # per wakeup: the drain loop (receive, decoder add, recorder add),
+        # the decoder batch, the mailbox write and the packets drained
+        self.drain_ns = Histogram()
+        self.decode_ns = Histogram()
+        self.publish_ns = Histogram()
+        self.batch_packets = Histogram()
+
+    def fold(self) -> None:
+        with self.lock:
+            rows = []
+            for _ in range(len(self.pending)):
+                rows.append(self.pending.popleft())
+            if not rows:
+                return
+            wakeups = np.array(rows, dtype=np.int64)
+            started, drained, decoded, published, packets, nbytes = (
+                wakeups.T
+            )
+            self.drain_ns.record(drained - started)
+            decoders = decoded != drained
+            if decoders.any():
+                self.decode_ns.record((decoded - drained)[decoders])
+            self.publish_ns.record(published - decoded)
+            self.batch_packets.record(packets)
+            count = int(packets.sum())
+            self.wakeups += len(rows)
+            self.packets += count
+            self.bytes += int(nbytes.sum())
+            # a controller's packets are all commands, none superseded
+            if not self.commands:
+                self.superseded += count - len(rows)
+
+    def snapshot(self) -> Dict:
+        self.fold()
+        snapshot = {}
+        for name, value in vars(self).items():
+            if isinstance(value, Histogram):
+                snapshot[name] = value.summary()
+            elif isinstance(value, int):
+                snapshot[name] = value
+        return snapshot
+
+
+class Stats:
+    def __init__(self) -> None:
+        """[every input's stats plus named sources, functions returning a
+        dict of another component's counters, for the snapshot]"""
+        self.started = time.time()
+        self.inputs: Dict[str, InputStats] = {}
+        self.sources: Dict[str, Callable[[], Dict]] = {}
+
+    def input(self, name: str) -> InputStats:
+        if name not in self.inputs:
+            self.inputs[name] = InputStats()
+        return self.inputs[name]
+
+    def add_source(self, name: str, source: Callable[[], Dict]) -> None:
+        self.sources[name] = source
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        snapshot = {
+            "time": now,
+            "uptime": now - self.started,
+            "inputs": {
+                name: stats.snapshot() for name, stats in self.inputs.items()
+            },
+        }
+        for name, source in self.sources.items():
+            snapshot[name] = source()
+        return snapshot
+
+    def write(self, path: str) -> None:
+        """[append a snapshot to path as a line of json]"""
+        with open(path, "a") as f:
+            f.write(json.dumps(self.snapshot()) + "\n")
+
+
+def fit(snapshot: Dict, limit: int) -> bytes:
+    """[the snapshot as json in at most limit bytes, sections are kept in
+    order while they fit and the names of the rest listed in
+    "truncated"]"""
+    parts = [
+        f"{json.dumps(name)}: {json.dumps(value)}"
+        for name, value in snapshot.items()
+    ]
+    names = list(snapshot)
+    # room for the list of everything left out, at worst
+    size = len(json.dumps({"truncated": names})) + 2
+    kept: List[str] = []
+    left_out: List[str] = []
+    for name, part in zip(names, parts):
+        if size + len(part) + 2 <= limit:
+            kept.append(part)
+            size += len(part) + 2
+        else:
+            left_out.append(name)
+    kept.append(f'"truncated": {json.dumps(left_out)}')
+    return ("{" + ", ".join(kept) + "}").encode()
+
+
+class StatsServer:
+    def __init__(self, stats: Stats, host: str, port: int) -> None:
+        """[answers any datagram sent to host:port with a json snapshot.
+        the socket is non-blocking and read by the ingest selector, so a
+        query is served between packet drains. a snapshot too big for one
+        datagram goes out without the sections that do not fit, named in
+        its "truncated" list]"""
+        self.stats = stats
+        # replies that had to be cut down
+        self.truncated = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind((host, port))
+        self.sock.setblocking(False)
+
+    def handle(self) -> None:
+        while True:
+            try:
+                _, address = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                return
+            snapshot = self.stats.snapshot()
+            try:
+                try:
+                    self.sock.sendto(json.dumps(snapshot).encode(), address)
+                except OSError as error:
+                    if error.errno != errno.EMSGSIZE:
+                        raise
+                    self.truncated += 1
+                    self.sock.sendto(fit(snapshot, MAX_REPLY), address)
+            except OSError:
+                # the querier went away, nothing to do about it
+                pass
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+def query(host: str, port: int, timeout: float = 1.0) -> Dict:
+    """[ask a running dvr2 for its stats]"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(timeout)
+    try:
+        sock.sendto(b"stats", (host, port))
+        data, _ = sock.recvfrom(65507)
+    finally:
+        sock.close()
+    return json.loads(data)
+
+
+def measure_overhead(count: int = 2000, rounds: int = 5) -> List[float]:
+    """[ingest time per packet (select and get_packets) without and with
+    an InputStats, best of a few rounds, for packets arriving one per wakeup
+    (the worst case, the stats cost is per wakeup) and in bursts of count]"""
+    import logging
+    import queue
+    import selectors
+
+    import io_connections
+    import main
+    import shared_mailbox
+
+    logger = logging.getLogger("stats_overhead")
+    logger.setLevel(logging.WARNING)
+    conn = io_connections.get_connections(
+        [{"name": "overhead", "ip": "127.0.0.1", "port": 0}], True, logger
+    )[0]
+    conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+    address = conn.sock.getsockname()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True)]
+    commands: queue.SimpleQueue = queue.SimpleQueue()
+    sel = selectors.DefaultSelector()
+    sel.register(conn.sock, selectors.EVENT_READ)
+    packet = b"x" * 100
+    results = []
+    for burst in (1, count):
+        times = {}
+        for stats in (None, InputStats()):
+            conn.stats = stats
+            best = float("inf")
+            for _ in range(rounds):
+                elapsed = 0.0
+                for _ in range(count // burst):
+                    for _ in range(burst):
+                        sender.sendto(packet, address)
+                    start = time.perf_counter()
+                    sel.select()
+                    main.get_packets(conn, logger, mailboxes, commands)
+                    elapsed += time.perf_counter() - start
+                best = min(best, elapsed)
+            times[stats is not None] = best / count
+        results.append((burst, times[False], times[True]))
+    sel.close()
+    sender.close()
+    conn.sock.close()
+    mailboxes[0].close()
+    return results
+
+
+if __name__ == "__main__":
+    # testing code, query a running dvr2 or measure the ingest overhead
+    import argparse
+
+    parser = argparse.ArgumentParser(description="dvr2 stats")
+    parser.add_argument("--overhead", action="store_true")
+    args = parser.parse_args()
+    if args.overhead:
+        for burst, without, with_stats in measure_overhead():
+            print(
+                f"burst {burst}: {without * 1e9:.0f} ns/packet without stats, "
+                f"{with_stats * 1e9:.0f} with, "
+                f"{(with_stats / without - 1) * 100:+.1f}%"
+            )
+    else:
+        with open("config.json", "r") as f:
+            settings = json.load(f)
+        print(
+            json.dumps(
+                query(settings["stats"]["ip"], settings["stats"]["port"]),
+                indent=4,
+            )
+        )
@@ -0,0 +1,245 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+import json
+import mmap
+import os
+import struct
+
+import clock
+import disk_writer
+import time_index
+
+# file layout:
+#   header: magic, version, length of the input name table, the wall clock
+#   and monotonic clock of the anchor the timestamps are on (ns, see clock),
+#   then the name table as a json list
+#   records: payload length, timestamp (ns), input id, payload
+# a sync block, a record with input id SYNC_ID, starts every chunk so a
+# reader can find its feet again after a damaged record
+MAGIC = b"DVR2TLM\0"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIqq")
+RECORD = struct.Struct("<IqH")
+SYNC_ID = 0xFFFF
+SYNC_MAGIC = b"DVR2SYNC"
+# sync payload: magic, records written before it, offset of the sync
+# block before it (0 for the first)
+SYNC = struct.Struct("<8sQQ")
+CHUNK_BYTES = 1 << 20
+# at most one time index entry per this much recorded time (ns)
+INDEX_INTERVAL = 1_000_000_000
+# records kept in memory while the disk is behind, past this they are
+# dropped rather than waited for
+SPILL_BYTES = 64 << 20
+
+
+class TelemetryWriter:
+    def __init__(
+        self,
+        path: str,
+        inputs: List[str],
+        chunk_bytes: int = CHUNK_BYTES,
+        index_interval: int = INDEX_INTERVAL,
+        anchor: Optional[Tuple[int, int]] = None,
+        disk: Optional[Dict] = None,
+    ) -> None:
+        """[append only telemetry file, records are gathered in memory and
+        handed a chunk at a time to a disk_writer.DiskWriter. a time index
+        goes alongside it in path.idx, each entry written once the writer
+        has written the data it points to. write never waits for the disk,
+        while the writer is backed up records pile up in the chunk, up to
+        spill_bytes, and are then dropped and counted
+
+        Args:
+            path (str): [file to create]
+            inputs (List[str]): [input names, a record's input id is its
+            index in here]
+            chunk_bytes (int): [size of each write]
+            index_interval (int): [ns of records between index entries]
+            anchor (Tuple[int, int], optional): [wall and monotonic ns the
+            timestamps are anchored at, this process's clock.ANCHOR if None]
+            disk (Dict, optional): [the "disk" section of config.json]
+        ]"""
+        self.path = path
+        self.chunk_bytes = chunk_bytes
+        self.spill_bytes = (disk or {}).get("spill_bytes", SPILL_BYTES)
+        # a file already there is another recording's, never truncated
+        self.file = disk_writer.DiskWriter(path, disk, exclusive=True)
+        self.index = time_index.IndexWriter(f"{path}.idx")
+        self.index_interval = index_interval
+        self.next_index = 0
+        names = json.dumps(inputs).encode()
+        wall, monotonic = anchor or clock.ANCHOR
+        self.chunk = bytearray(
+            HEADER.pack(MAGIC, VERSION, 0, len(names), wall, monotonic)
+        )
+        self.chunk += names
+        # file offset the chunk will be written at
+        self.offset = 0
+        self.records = 0
+        # records lost because the disk was too far behind
+        self.dropped = 0
+        self.last_sync = 0
+        self.sync()
+
+    def sync(self) -> None:
+        position = self.offset + len(self.chunk)
+        self.chunk += RECORD.pack(SYNC.size, 0, SYNC_ID)
+        self.chunk += SYNC.pack(SYNC_MAGIC, self.records, self.last_sync)
+        self.last_sync = position
+
+    def write(self, timestamp: int, input_id: int, payload) -> None:
+        """[add a record, a full chunk goes to disk once the writer has
+        room for it and the next chunk starts with a sync block]
+
+        Args:
+            timestamp (int): [ns]
+            input_id (int): [index into the file's input names]
+            payload ([bytes-like]): [packet data]
+        """
+        if len(self.chunk) >= self.spill_bytes:
+            self.dropped += 1
+            return
+        if timestamp >= self.next_index:
+            self.index.add(timestamp, self.offset + len(self.chunk))
+            self.next_index = timestamp + self.index_interval
+        self.chunk += RECORD.pack(len(payload), timestamp, input_id)
+        self.chunk += payload
+        self.records += 1
+        if len(self.chunk) >= self.chunk_bytes and not self.file.full(
+            len(self.chunk)
+        ):
+            self.flush()
+            self.sync()
+
+    def flush(self) -> None:
+        self.file.write(self.chunk)
+        self.offset += len(self.chunk)
+        self.chunk = bytearray()
+        # the writer has only taken whole chunks of it so far, the index
+        # entries for those go to disk after them, on the writer's thread
+        entries = self.index.take(self.file.offset)
+        if entries:
+            self.file.call(lambda: self.index.write(entries))
+
+    def close(self) -> None:
+        self.file.write(self.chunk)
+        self.file.close()
+        self.index.close()
+
+
+class TelemetryReader:
+    def __init__(self, path: str) -> None:
+        """[memory maps a telemetry file, records come back as memoryviews
+        of the map so nothing is copied. drop every view before close. the
+        file is only scanned for record offsets when they are first needed,
+        iter_from reads on from an offset out of the time index]"""
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        magic, self.version, _, names_len, *anchor = HEADER.unpack_from(
+            self.view, 0
+        )
+        # a timestamp less anchor[0] is ns since the anchor
+        self.anchor: Tuple[int, int] = tuple(anchor)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a telemetry file")
+        start = HEADER.size
+        self.inputs = json.loads(bytes(self.view[start : start + names_len]))
+        self.start = start + names_len
+        self._offsets: Optional[List[int]] = None
+        self.damaged = 0
+
+    @property
+    def offsets(self) -> List[int]:
+        if self._offsets is None:
+            self.scan()
+        return self._offsets
+
+    def scan(self) -> None:
+        """[find every record's offset]"""
+        self._offsets = list(self.walk(self.start))
+
+    def walk(self, offset: int) -> Iterator[int]:
+        """[record offsets from offset on, skipping sync blocks. a damaged
+        record is stepped over by searching for the next sync block, a
+        record cut short at the end of the file is left out]"""
+        view = self.view
+        size = len(view)
+        while offset + RECORD.size <= size:
+            length, _, input_id = RECORD.unpack_from(view, offset)
+            end = offset + RECORD.size + length
+            if input_id == SYNC_ID:
+                if view[offset + RECORD.size : offset + RECORD.size + 8] != (
+                    SYNC_MAGIC
+                ):
+                    offset = self.resync(offset + 1)
+                    continue
+            elif end > size or input_id >= len(self.inputs):
+                if end > size and self.map.find(SYNC_MAGIC, offset) < 0:
+                    # cut short by a crash, nothing after it
+                    break
+                offset = self.resync(offset + 1)
+                continue
+            else:
+                yield offset
+            offset = end
+
+    def resync(self, offset: int) -> int:
+        self.damaged += 1
+        found = self.map.find(SYNC_MAGIC, offset)
+        if found < 0:
+            return len(self.view)
+        return found - RECORD.size
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def record(self, offset: int) -> Tuple[int, int, memoryview]:
+        length, timestamp, input_id = RECORD.unpack_from(self.view, offset)
+        start = offset + RECORD.size
+        return timestamp, input_id, self.view[start : start + length]
+
+    def __getitem__(self, idx):
+        """[one record as (timestamp ns, input id, payload) or, for a
+        slice, a list of them]"""
+        if isinstance(idx, slice):
+            return [self.record(offset) for offset in self.offsets[idx]]
+        return self.record(self.offsets[idx])
+
+    def __iter__(self) -> Iterator[Tuple[int, int, memoryview]]:
+        for offset in self.offsets:
+            yield self.record(offset)
+
+    def iter_from(self, offset: int) -> Iterator[Tuple[int, int, memoryview]]:
+        """[records from the one at offset to the end of the file]"""
+        for offset in self.walk(offset):
+            yield self.record(offset)
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+if __name__ == "__main__":
+    # testing code, write then read back a file of overlay sized packets
+    import time
+
+    path = "telemetry_test.tlm"
+    packet = b"2021-09-22 14:32:07,3.471,11.447,28.111,TASK: I'm the real Batman"
+    count = 200_000
+    writer = TelemetryWriter(path, ["overlay", "controller"])
+    start = time.perf_counter()
+    for num in range(count):
+        writer.write(num, 0, packet)
+    writer.close()
+    elapsed = time.perf_counter() - start
+    print(f"write: {elapsed / count * 1e9:.0f} ns/record")
+    start = time.perf_counter()
+    reader = TelemetryReader(path)
+    total = sum(len(payload) for _, _, payload in reader)
+    elapsed = time.perf_counter() - start
+    print(f"read: {elapsed / count * 1e9:.0f} ns/record, {total} bytes")
+    reader.close()
+    os.remove(path)
+    os.remove(f"{path}.idx")
@@ -0,0 +1,355 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import logging
+
+import numpy as np
+
+import overlay_decoder
+import session_index
+
+NEAREST = "nearest"
+INTERPOLATE = "interpolate"
+# a frame with no sample closer than this (ns) gets none, the telemetry had
+# stopped or not started
+MAX_GAP = 1_000_000_000
+# samples a cursor steps over one at a time before it searches instead
+GALLOP = 8
+
+
+def blend_fields(decoder: overlay_decoder.OverlayDecoder) -> List[str]:
+    """[fields that can be interpolated, text is a code into the decoder's
+    table and is not]"""
+    return ["received"] + [
+        field["name"] for field in decoder.fields if field["type"] != "text"
+    ]
+
+
+def field_runs(dtype: np.dtype, names: Sequence[str]) -> List[Tuple]:
+    """[the named 8 byte fields in runs that lie side by side in a record
+    and sum alike, floats ("f") or ns and datetimes as integers ("i")]"""
+    runs: List[Tuple] = []
+    for name in sorted(names, key=lambda name: dtype.fields[name][1]):
+        field, offset = dtype.fields[name][:2]
+        kind = "f" if field.kind == "f" else "i"
+        if runs and runs[-1][0] == kind and runs[-1][2] == offset:
+            runs[-1][1].append(name)
+            runs[-1][2] += 8
+        else:
+            runs.append([kind, [name], offset + 8])
+    return [(kind, run) for kind, run, _ in runs]
+
+
+def columns(records: np.ndarray, run: List[str]) -> np.ndarray:
+    """[a 2-D view, a row per record, of a run from field_runs]"""
+    dtype = records.dtype
+    field, offset = dtype.fields[run[0]][:2]
+    return np.ndarray(
+        (len(records), len(run)),
+        np.float64 if field.kind == "f" else np.int64,
+        records,
+        offset,
+        (dtype.itemsize, 8),
+    )
+
+
+def pick(
+    records: np.ndarray,
+    times: np.ndarray,
+    frames: np.ndarray,
+    mode: str = NEAREST,
+    max_gap: int = MAX_GAP,
+    blend: Sequence[str] = (),
+) -> Tuple[np.ndarray, np.ndarray]:
+    """[the telemetry sample for each frame time, one searchsorted for the
+    whole batch
+
+    Args:
+        records (np.ndarray): [decoded overlay records, sorted by times]
+        times (np.ndarray): [each record's time (ns)]
+        frames (np.ndarray): [frame times (ns)]
+        mode (str): [NEAREST, or INTERPOLATE between the samples either
+        side]
+        max_gap (int): [furthest a sample may be from its frame (ns)]
+        blend (Sequence[str]): [fields interpolated, the rest come from
+        the nearer sample]
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: [one record per frame and whether
+        it is good, a frame too far from any sample gets a zeroed record]
+    ]"""
+    frames = np.asarray(frames, dtype=np.int64)
+    count = len(times)
+    if count == 0:
+        return (
+            np.zeros(len(frames), dtype=records.dtype),
+            np.zeros(len(frames), dtype=bool),
+        )
+    after = np.searchsorted(times, frames, "right")
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, count - 1)
+    to_before = np.abs(frames - times[before])
+    to_after = np.abs(times[after] - frames)
+    nearer = np.where(to_after < to_before, after, before)
+    valid = np.minimum(to_before, to_after) <= max_gap
+    samples = records[nearer]
+    if mode == INTERPOLATE:
+        span = times[after] - times[before]
+        weight = np.zeros(len(frames))
+        moving = span > 0
+        weight[moving] = (frames - times[before])[moving] / span[moving]
+        np.clip(weight, 0.0, 1.0, out=weight)
+        first, second = records[before], records[after]
+        for name in blend:
+            if records.dtype[name].kind == "f":
+                samples[name] = first[name] + weight * (
+                    second[name] - first[name]
+                )
+            else:
+                # ns and datetime64 blend as integers
+                low = first[name].view(np.int64)
+                high = second[name].view(np.int64)
+                step = np.round(weight * (high - low)).astype(np.int64)
+                samples[name] = (low + step).view(records.dtype[name])
+    samples[~valid] = np.zeros(1, dtype=records.dtype)
+    return samples, valid
+
+
+class TelemetrySync:
+    def __init__(
+        self,
+        decoder: overlay_decoder.OverlayDecoder,
+        mode: str = NEAREST,
+        max_gap: int = MAX_GAP,
+    ) -> None:
+        """[live telemetry for frames as they are captured, out of the
+        decoder's ring. every camera has a cursor into the ring that moves
+        forward with its frames, so a lookup steps over a sample or two
+        rather than searching. a frame newer than the newest sample gets the
+        newest sample, the one after has not arrived yet]
+
+        Args:
+            decoder (overlay_decoder.OverlayDecoder): [decodes the overlay
+            input, its records are stamped with their receive times]
+            mode (str): [NEAREST or INTERPOLATE]
+            max_gap (int): [furthest a sample may be from its frame (ns)]
+        """
+        self.decoder = decoder
+        self.mode = mode
+        self.max_gap = max_gap
+        self.blend = blend_fields(decoder)
+        # looking fields up by name costs more than the lookup, so single
+        # frames blend these views of the ring's columns
+        data = decoder.ring.data
+        self.times = data["received"]
+        self.out = np.zeros(1, dtype=data.dtype)
+        self.columns = [
+            (columns(data, run), columns(self.out, run), kind == "i")
+            for kind, run in field_runs(data.dtype, self.blend)
+        ]
+        # per camera, the number (counted since start up) of the first
+        # record newer than the camera's last frame
+        self.cursors: Dict[str, int] = {}
+        # lookups that had to search, cursor behind the ring or moved back
+        self.searches = 0
+
+    def locate(self, camera: str, times: np.ndarray, first: int, frame: int):
+        """[index into times of the first sample newer than frame]"""
+        idx = self.cursors.get(camera, first) - first
+        if idx < 0 or (idx > 0 and times[idx - 1] > frame):
+            self.searches += 1
+            return int(np.searchsorted(times, frame, "right"))
+        end = len(times)
+        steps = 0
+        while idx < end and times[idx] <= frame:
+            idx += 1
+            steps += 1
+            if steps == GALLOP:
+                self.searches += 1
+                return idx + int(np.searchsorted(times[idx:], frame, "right"))
+        return idx
+
+    def samples(
+        self, camera: str, frames: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """[telemetry for a camera's frames, times (ns) in capture order
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: [as pick]
+        ]"""
+        ring = self.decoder.ring
+        records = ring.last(ring.capacity)
+        times = records["received"]
+        first = ring.total - len(records)
+        # only the samples either side of the frames matter
+        start = self.locate(camera, times, first, int(frames[0]))
+        end = start
+        if len(frames) > 1:
+            end = self.locate(camera, times, first, int(frames[-1]))
+        window = slice(max(0, start - 1), min(end + 1, len(times)))
+        self.cursors[camera] = first + end
+        return pick(
+            records[window],
+            times[window],
+            frames,
+            self.mode,
+            self.max_gap,
+            self.blend,
+        )
+
+    def sample(self, camera: str, frame: int) -> Optional[np.void]:
+        """[telemetry for one frame, None if there is none near it. the
+        same as samples, worked out on the ring's columns without the
+        batch's numpy calls. the record is a view, copy it to keep it]"""
+        ring = self.decoder.ring
+        count = min(ring.total, ring.capacity)
+        if not count:
+            return None
+        end = ring.head + ring.capacity
+        base = end - count
+        times = self.times[base:end]
+        first = ring.total - count
+        after = self.locate(camera, times, first, frame)
+        self.cursors[camera] = first + after
+        before = base + max(after - 1, 0)
+        after = base + min(after, count - 1)
+        to_before = abs(frame - int(self.times[before]))
+        to_after = abs(int(self.times[after]) - frame)
+        if min(to_before, to_after) > self.max_gap:
+            return None
+        nearer = ring.data[after if to_after < to_before else before]
+        span = to_before + to_after
+        if self.mode == NEAREST or before == after or not span:
+            return nearer
+        weight = min(to_before / span, 1.0)
+        out = self.out
+        out[0] = nearer
+        for column, target, whole in self.columns:
+            pairs = zip(column[before].tolist(), column[after].tolist())
+            # python numbers, a numpy call per field costs more than the sum
+            if whole:
+                target[0] = [
+                    low + round(weight * (high - low)) for low, high in pairs
+                ]
+            else:
+                target[0] = [
+                    low + weight * (high - low) for low, high in pairs
+                ]
+        return out[0]
+
+
+class SessionSync:
+    def __init__(
+        self,
+        session: str,
+        overlay: Dict,
+        logger: logging.Logger,
+        mode: str = NEAREST,
+        max_gap: int = MAX_GAP,
+    ) -> None:
+        """[telemetry for every frame of a recorded session. the overlay
+        packets of the session are decoded once, then each camera's frame
+        times out of its time indexes are matched in one batch
+
+        Args:
+            session (str): [the session's folder]
+            overlay (Dict): [the "overlay" section of config.json]
+            logger (logging.Logger): [the logger for debug_logging]
+            mode (str): [NEAREST or INTERPOLATE]
+            max_gap (int): [furthest a sample may be from its frame (ns)]
+        """
+        self.index = session_index.SessionIndex(session)
+        self.decoder = overlay_decoder.OverlayDecoder(overlay, logger)
+        self.mode = mode
+        self.max_gap = max_gap
+        self.blend = blend_fields(self.decoder)
+        packets: List[bytes] = []
+        times: List[int] = []
+        for segment in self.index.streams.get("telemetry", []):
+            reader = self.index.reader(segment.path)
+            if overlay["input"] not in reader.inputs:
+                continue
+            input_id = reader.inputs.index(overlay["input"])
+            for timestamp, record_id, payload in reader:
+                if record_id == input_id:
+                    packets.append(bytes(payload).strip(b"\r\n"))
+                    times.append(timestamp)
+            payload = None
+        records = self.decoder.decode(packets, np.array(times, np.int64))
+        # segments are in order, sorting only puts right what overlapped
+        self.records = records[np.argsort(records["received"], kind="stable")]
+        self.times = self.records["received"]
+
+    def frames(self, camera: str) -> np.ndarray:
+        """[every frame of the camera, as the time index entries of its
+        segments, in time order]"""
+        segments = self.index.streams.get(camera, [])
+        if not segments:
+            return np.zeros(0, dtype=[("timestamp", "<i8")])
+        return np.concatenate([segment.index for segment in segments])
+
+    def align(self, camera: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """[the camera's frames and their telemetry
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: [frame time index
+            entries, one record per frame and whether it is good]
+        ]"""
+        frames = self.frames(camera)
+        samples, valid = pick(
+            self.records,
+            self.times,
+            frames["timestamp"],
+            self.mode,
+            self.max_gap,
+            self.blend,
+        )
+        return frames, samples, valid
+
+    def close(self) -> None:
+        self.index.close()
+
+
+if __name__ == "__main__":
+    # testing code, live lookups for several fast cameras against a ring of
+    # telemetry, then a batch align of an hour of frames
+    import json
+    import time
+
+    with open("config.json", "r") as f:
+        settings = json.load(f)
+    logger = logging.getLogger("telemetry_sync")
+    overlay = dict(settings["overlay"], rate=100, buffer_seconds=60)
+    decoder = overlay_decoder.OverlayDecoder(overlay, logger)
+    packet = b"2021-09-22 14:32:07,1,2,3,4,5,6,7,8,TASK: I'm the real Batman"
+    cameras = [f"camera{num}" for num in range(4)]
+    fps = 1000
+    seconds = 10
+    for mode in (NEAREST, INTERPOLATE):
+        sync = TelemetrySync(decoder, mode)
+        start_ns = 1_000_000_000_000
+        elapsed = 0.0
+        for second in range(seconds):
+            # a second of telemetry at 100 Hz, then that second's frames
+            base = start_ns + second * 1_000_000_000
+            for num in range(100):
+                decoder.add(packet, base + num * 10_000_000)
+            decoder.flush()
+            begin = time.perf_counter()
+            for frame in range(fps):
+                for camera in cameras:
+                    sync.sample(camera, base + frame * 1_000_000)
+            elapsed += time.perf_counter() - begin
+        lookups = seconds * fps * len(cameras)
+        print(
+            f"live {mode}: {elapsed / lookups * 1e6:.1f} us/frame, "
+            f"{sync.searches} searches in {lookups} lookups"
+        )
+        records = decoder.ring.last(decoder.ring.capacity)
+        frames = np.arange(3600 * 30 * len(cameras), dtype=np.int64)
+        frames = records["received"][0] + frames * 8_000_000
+        begin = time.perf_counter()
+        pick(records, records["received"], frames, mode, MAX_GAP, sync.blend)
+        elapsed = time.perf_counter() - begin
+        print(
+            f"batch {mode}: {elapsed / len(frames) * 1e9:.0f} ns/frame "
+            f"for {len(frames)} frames"
+        )
@@ -0,0 +1,60 @@
+from pathlib import Path
+import struct
+
+import numpy as np
+
+# sidecar index, next to its segment as <segment>.idx: magic, then fixed
+# size entries of timestamp (ns) and a position in the segment, a byte
+# offset for telemetry or a frame number for video
+MAGIC = b"DVR2IDX\0"
+ENTRY = np.dtype([("timestamp", "<i8"), ("position", "<i8")])
+ENTRY_STRUCT = struct.Struct("<qq")
+
+
+class IndexWriter:
+    def __init__(self, path: str) -> None:
+        """[appends entries to a sidecar index. entries are held until
+        flush, which the segment writer calls once the data they point to
+        is on disk]"""
+        self.file = open(path, "wb", buffering=0)
+        self.file.write(MAGIC)
+        self.pending = bytearray()
+        self.last = None
+
+    def add(self, timestamp: int, position: int) -> None:
+        # timestamps only go forwards in an index, so it can be bisected
+        if self.last is not None and timestamp <= self.last:
+            return
+        self.pending += ENTRY_STRUCT.pack(timestamp, position)
+        self.last = timestamp
+
+    def flush(self) -> None:
+        if self.pending:
+            self.file.write(self.pending)
+            self.pending = bytearray()
+
+    def take(self, before: int) -> bytes:
+        """[hand over the entries with a position before before, for a
+        segment whose data is written by another thread, see write]"""
+        positions = np.frombuffer(bytes(self.pending), ENTRY)["position"]
+        count = int(np.searchsorted(positions, before))
+        taken = bytes(self.pending[: count * ENTRY.itemsize])
+        del self.pending[: count * ENTRY.itemsize]
+        return taken
+
+    def write(self, entries: bytes) -> None:
+        self.file.write(entries)
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+def read_index(path: str) -> np.ndarray:
+    """[map a sidecar index, a segment still being recorded may have
+    fewer entries on disk than it will end up with]"""
+    size = Path(path).stat().st_size - len(MAGIC)
+    count = max(size, 0) // ENTRY.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=ENTRY)
+    return np.memmap(path, ENTRY, "r", offset=len(MAGIC), shape=(count,))
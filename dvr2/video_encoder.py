@@ -0,0 +1,568 @@
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+import datetime
+import logging
+import os
+import time
+
+import cv2
+
+import avi
+import backpressure
+import debug_logger
+import frame_ring
+import motion_gate
+import shared_mailbox
+import time_index
+
+# seconds a segment waits past its end for frames still on the way
+END_GRACE = 1.0
+# frames between writes of the segment's time index
+INDEX_FLUSH_FRAMES = 25
+# room in a boundary for the session folder it starts, the pre-roll jobs
+# write their frames there
+BOUNDARY_BYTES = 4096
+# jpeg quality of the frames kept for the pre-roll
+PREROLL_QUALITY = 90
+# default for "preroll_video_max_bytes" in the "recording" section, the
+# memory each camera's pre-roll jpegs may take
+PREROLL_MAX_BYTES = 256 << 20
+# sessions SegmentEncoder keeps totals for, the oldest are let go so the
+# stats snapshot stays small
+SESSIONS_KEPT = 16
+# what SegmentEncoder adds up per session
+SESSION_TOTALS = (
+    "segments",
+    "written",
+    "gated",
+    "encode_ns",
+    "gate_ns",
+    "bytes",
+)
+
+
+def first_frame_at(ring: frame_ring.FrameRing, timestamp: float) -> int:
+    """[number of the oldest frame still in the ring taken at or after
+    timestamp, or the next frame to come if there is none]"""
+    number = ring.count
+    while True:
+        got = ring.get(number - 1)
+        if got is None or got[0] < timestamp:
+            return number
+        number -= 1
+
+
+def encode_segment(
+    camera: Dict,
+    ring: frame_ring.FrameRing,
+    boundary: shared_mailbox.Mailbox,
+    path: str,
+    start: float,
+    video: Dict,
+    board: Optional[backpressure.Board] = None,
+    handoff: Optional[shared_mailbox.Mailbox] = None,
+    resume: bool = False,
+) -> Tuple[str, int, int, int, int, int, Dict]:
+    """[pool job, encodes one camera's frames from start until the next
+    boundary main publishes after start, then finishes the file. every
+    frame's timestamp goes into the time index at path.idx against its
+    number in the file. with a board, the job says how far behind the
+    camera it is and leaves out the frames the policy sheds. a camera with
+    a "motion" section only has the frames its motion gate keeps encoded.
+    the gate's state is handed on to the next segment's job at the
+    boundary, so the gate runs on across segments as if it were one]
+
+    Args:
+        camera (Dict): [the camera's settings]
+        ring (frame_ring.FrameRing): [the camera's frames]
+        boundary (shared_mailbox.Mailbox): [its timestamp is where the
+        running segment ends, main moves it on rotation and stop]
+        path (str): [segment file]
+        start (float): [time of the first frame wanted]
+        video (Dict): [the "video" section of config.json]
+        board (backpressure.Board, optional): [the backpressure board]
+        handoff (shared_mailbox.Mailbox, optional): [the camera's gate
+        state, written at the end boundary for the next segment]
+        resume (bool): [carry on from the gate state the segment before
+        hands off at start, rather than start the gate afresh]
+
+    Returns:
+        Tuple[str, int, int, int, int, int, Dict]: [path, first and last
+        frame number, frames written, frames dropped, frames shed and what
+        the frames cost: frames gated, encode and gate time (ns), the
+        file's size and 1 if the gate started afresh for want of the
+        handoff]
+    """
+    if os.path.exists(path):
+        # opencv would write over it
+        raise FileExistsError(path)
+    writer = cv2.VideoWriter(
+        path,
+        cv2.VideoWriter_fourcc(*video["fourcc"]),
+        camera["fps"],
+        (camera["width"], camera["height"]),
+    )
+    index = time_index.IndexWriter(f"{path}.idx")
+    interval = 1 / camera["fps"]
+    number = first_frame_at(ring, start)
+    first = last = -1
+    written = dropped = shed = 0
+    stage = None
+    if board is not None:
+        name = f"{camera['name']}_{backpressure.RECORD}"
+        stage = board.stage(name, backpressure.RECORD)
+    gate = None
+    # the gate started afresh, the segment before was too late with its
+    # state
+    handoff_missed = 0
+    if "motion" in camera:
+        gate = motion_gate.MotionGate(
+            camera["motion"], (camera["height"], camera["width"], 3)
+        )
+        if resume and handoff is not None:
+            # the segment before finishes just after start. it is waited
+            # for while the frames since start fill half the ring at most,
+            # longer and they would be overwritten before being encoded
+            while True:
+                _, ended, state, _ = handoff.read()
+                if ended == start:
+                    gate.resume(state)
+                    break
+                if (
+                    ring.count - number >= ring.slots // 2
+                    or time.time() > start + 2 * END_GRACE
+                ):
+                    handoff_missed = 1
+                    break
+                time.sleep(interval / 4)
+    gated = encode_ns = 0
+    # frames in the file, including any overwritten while being encoded
+    frames = 0
+    while True:
+        _, end, _, _ = boundary.read()
+        if end <= start:
+            end = float("inf")
+        if number >= ring.count:
+            if time.time() > end + END_GRACE:
+                break
+            time.sleep(interval / 4)
+            continue
+        got = ring.get(number)
+        if got is None:
+            # overwritten before we got to it
+            dropped += 1
+            if stage is not None:
+                stage.lose()
+            number += 1
+            continue
+        timestamp, frame = got
+        if timestamp < start:
+            number += 1
+            continue
+        if timestamp >= end:
+            break
+        if stage is not None:
+            stage.report(
+                ring.count - number,
+                ring.slots,
+                int((time.time() - timestamp) * 1e9),
+            )
+            if not stage.admit(number):
+                shed += 1
+                number += 1
+                continue
+        if gate is not None and not gate.keep(frame, timestamp):
+            gated += 1
+            number += 1
+            continue
+        encode_start = time.perf_counter_ns()
+        writer.write(frame)
+        encode_ns += time.perf_counter_ns() - encode_start
+        index.add(int(timestamp * 1e9), frames)
+        frames += 1
+        if frames % INDEX_FLUSH_FRAMES == 0:
+            index.flush()
+        if not ring.valid(number):
+            # overwritten while it was being encoded
+            dropped += 1
+            if stage is not None:
+                stage.lose()
+        else:
+            written += 1
+            last = number
+            if first < 0:
+                first = number
+        number += 1
+    if gate is not None and handoff is not None and end != float("inf"):
+        handoff.write(gate.state(), end)
+    writer.release()
+    index.close()
+    ring.close()
+    boundary.close()
+    if handoff is not None:
+        handoff.close()
+    if board is not None:
+        # the stage's row is a view of the board
+        stage = None
+        board.close()
+    costs = {
+        "gated": gated,
+        "encode_ns": encode_ns,
+        "gate_ns": gate.cost_ns if gate is not None else 0,
+        "handoff_missed": handoff_missed,
+        "bytes": os.path.getsize(path) if os.path.exists(path) else 0,
+    }
+    return path, first, last, written, dropped, shed, costs
+
+
+def keep_preroll(
+    camera: Dict,
+    ring: frame_ring.FrameRing,
+    boundary: shared_mailbox.Mailbox,
+    since: float,
+    seconds: float,
+    video: Dict,
+    quality: int = PREROLL_QUALITY,
+    max_bytes: int = PREROLL_MAX_BYTES,
+) -> Tuple[Optional[str], int, int, int]:
+    """[pool job run between recordings, keeps the camera's last seconds
+    of frames as jpegs. the ring only holds a fraction of a second, this
+    holds the whole pre-roll at a fraction of the memory, and never more
+    than max_bytes of it, the oldest frames go first. when main
+    publishes a boundary the frames before it go into a segment of their
+    own in the session folder the boundary names, as they are, or are let
+    go if it names none
+
+    Args:
+        camera (Dict): [the camera's settings]
+        ring (frame_ring.FrameRing): [the camera's frames]
+        boundary (shared_mailbox.Mailbox): [the camera's boundary]
+        since (float): [the last boundary, frames before it are recorded
+        already]
+        seconds (float): [length of the pre-roll]
+        video (Dict): [the "video" section of config.json]
+        quality (int): [jpeg quality]
+        max_bytes (int): [memory cap for the jpegs]
+
+    Returns:
+        Tuple[Optional[str], int, int, int]: [the segment, None if there
+        was no session, frames written, frames the job fell too far behind
+        to keep and frames thrown away to stay under max_bytes]
+    """
+    frames: Deque[Tuple[float, bytes]] = deque()
+    size = evicted = 0
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    interval = 1 / camera["fps"]
+    number = first_frame_at(ring, max(since, time.time() - seconds))
+    dropped = 0
+    end = float("inf")
+    session = b""
+    while True:
+        if end == float("inf"):
+            _, published, payload, _ = boundary.read()
+            if published > since:
+                # catch up with the frames taken before the boundary, the
+                # next one may come before that is done
+                end, session = published, payload
+        if number >= ring.count:
+            if end < float("inf"):
+                break
+            time.sleep(interval / 4)
+            continue
+        got = ring.get(number)
+        number += 1
+        if got is None:
+            dropped += 1
+            continue
+        timestamp, frame = got
+        if timestamp >= end:
+            break
+        if timestamp < since:
+            continue
+        jpeg = cv2.imencode(".jpg", frame, params)[1].tobytes()
+        if not ring.valid(number - 1):
+            # overwritten while it was being encoded
+            dropped += 1
+            continue
+        frames.append((timestamp, jpeg))
+        size += len(jpeg)
+        while size > max_bytes:
+            size -= len(frames.popleft()[1])
+            evicted += 1
+        while frames and frames[0][0] < timestamp - seconds:
+            size -= len(frames.popleft()[1])
+    frame = got = None
+    ring.close()
+    boundary.close()
+    if not session or not frames:
+        return None, 0, dropped, evicted
+    path = str(
+        debug_logger.get_new_log_file_name(
+            session.decode(),
+            camera["name"],
+            video["ext"],
+            datetime.datetime.fromtimestamp(frames[0][0]),
+        )
+    )
+    if os.path.exists(path):
+        raise FileExistsError(path)
+    writer = avi.AviWriter(
+        path, camera["width"], camera["height"], camera["fps"]
+    )
+    index = time_index.IndexWriter(f"{path}.idx")
+    for position, (timestamp, jpeg) in enumerate(frames):
+        writer.write(jpeg)
+        index.add(int(timestamp * 1e9), position)
+    writer.close()
+    index.close()
+    return path, len(frames), dropped, evicted
+
+
+class SegmentEncoder:
+    def __init__(
+        self,
+        settings: Dict,
+        rings: List,
+        logger: logging.Logger,
+        board: Optional[backpressure.Board] = None,
+    ) -> None:
+        """[records every camera into segment files while recording. each
+        segment is a job in a process pool sized to the cores, so a
+        segment finishes in the background while the next one starts.
+        between recordings a job per camera keeps its last preroll_seconds
+        of frames, on start they become the session's first segment]
+
+        Args:
+            settings (Dict): [package configuration file]
+            rings (List): [frame rings in settings["cameras"] order]
+            logger (logging.Logger): [the logger for debug_logging]
+            board (backpressure.Board, optional): [where the segment jobs
+            report and get told what to shed]
+        """
+        self.cameras = settings["cameras"]
+        self.video = settings["video"]
+        self.rings = rings
+        self.logger = logger
+        self.board = board
+        workers = os.cpu_count() or 1
+        if workers < 2 * len(self.cameras):
+            logger.warning(
+                f"{workers} cores for {len(self.cameras)} cameras, segment "
+                "changes may drop frames"
+            )
+        recording = settings.get("recording", {})
+        self.preroll_seconds = recording.get("preroll_seconds", 0)
+        self.preroll_max_bytes = recording.get(
+            "preroll_video_max_bytes", PREROLL_MAX_BYTES
+        )
+        # the pre-roll is kept as jpegs, which only an MJPG file can take
+        # as they are, otherwise it is what the rings still hold
+        self.preroll = bool(self.preroll_seconds) and (
+            self.video["fourcc"] == "MJPG"
+        )
+        if self.preroll:
+            # a pre-roll job per camera runs the whole time between
+            # recordings and is still writing as the segments start, a
+            # job queued behind one would wait for it
+            workers = max(workers, 2 * len(self.cameras))
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        # one boundary per camera, shared by all of its segment jobs
+        self.boundaries = [
+            shared_mailbox.Mailbox(BOUNDARY_BYTES) for _ in self.cameras
+        ]
+        # each gated camera's motion gate state, handed from one segment's
+        # job to the next
+        self.handoffs = []
+        for camera in self.cameras:
+            handoff = None
+            if "motion" in camera:
+                gate = motion_gate.MotionGate(
+                    camera["motion"], (camera["height"], camera["width"], 3)
+                )
+                handoff = shared_mailbox.Mailbox(len(gate.state()))
+            self.handoffs.append(handoff)
+        self.session: Optional[Path] = None
+        # latest boundary published, a new segment may not start before it
+        self.boundary = 0.0
+        self.jobs: List[Future] = []
+        self.results: List = []
+        self.prerolls: List = []
+        # per session totals of the segments' costs, the last
+        # SESSIONS_KEPT sessions
+        self.sessions: Dict[str, Dict] = {}
+        for camera in self.cameras:
+            held = camera["ring_slots"] / camera["fps"]
+            if self.preroll_seconds > held and not self.preroll:
+                logger.warning(
+                    f"{camera['name']} ring holds {held:.2f} s of a "
+                    f"{self.preroll_seconds} s pre-roll"
+                )
+        self.start_preroll()
+
+    def start_preroll(self) -> None:
+        if not self.preroll:
+            return
+        for camera, ring, boundary in zip(
+            self.cameras, self.rings, self.boundaries
+        ):
+            job = self.pool.submit(
+                keep_preroll,
+                camera,
+                ring,
+                boundary,
+                self.boundary,
+                self.preroll_seconds,
+                self.video,
+                PREROLL_QUALITY,
+                self.preroll_max_bytes,
+            )
+            job.add_done_callback(self.preroll_finished)
+            self.jobs.append(job)
+
+    def preroll_finished(self, job: Future) -> None:
+        try:
+            result = job.result()
+        except Exception as error:
+            self.logger.error(f"pre-roll failed: {error!r}")
+            return
+        path, written, dropped, evicted = result
+        if evicted:
+            self.logger.warning(
+                f"pre-roll over preroll_video_max_bytes, {evicted} frames "
+                "thrown away"
+            )
+        if path is None:
+            return
+        self.prerolls.append(result)
+        self.logger.info(
+            f"pre-roll {path}, {written} frames, {dropped} dropped, "
+            f"{evicted} evicted"
+        )
+
+    def end_segments(self, session: bytes = b"") -> float:
+        # boundaries only move forwards, a pre-roll job waits for one
+        # past the last
+        now = max(time.time(), self.boundary + 1e-6)
+        for boundary in self.boundaries:
+            boundary.write(session, now)
+        self.boundary = now
+        return now
+
+    def start_segments(self, start: float, resume: bool = False) -> None:
+        for camera, ring, boundary, handoff in zip(
+            self.cameras, self.rings, self.boundaries, self.handoffs
+        ):
+            path = debug_logger.get_new_log_file_name(
+                str(self.session), camera["name"], self.video["ext"]
+            )
+            job = self.pool.submit(
+                encode_segment,
+                camera,
+                ring,
+                boundary,
+                str(path),
+                start,
+                self.video,
+                self.board,
+                handoff,
+                resume,
+            )
+            job.add_done_callback(self.finished)
+            self.jobs.append(job)
+
+    def finished(self, job: Future) -> None:
+        try:
+            result = job.result()
+        except Exception as error:
+            self.logger.error(f"segment failed: {error!r}")
+            return
+        self.results.append(result)
+        path, first, last, written, dropped, shed, costs = result
+        self.logger.info(
+            f"segment {path} frames {first}-{last}, {written} written, "
+            f"{dropped} dropped, {shed} shed, {costs['gated']} gated"
+        )
+        if costs.get("handoff_missed"):
+            self.logger.warning(
+                f"segment {path} started its motion gate afresh, the "
+                "segment before was too late handing it over"
+            )
+        totals = self.sessions.setdefault(
+            Path(path).parent.name, dict.fromkeys(SESSION_TOTALS, 0)
+        )
+        while len(self.sessions) > SESSIONS_KEPT:
+            del self.sessions[next(iter(self.sessions))]
+        totals["segments"] += 1
+        totals["written"] += written
+        for key in ("gated", "encode_ns", "gate_ns", "bytes"):
+            totals[key] += costs[key]
+
+    def start(self, session: Path, start: float) -> None:
+        """[start recording into session, from start onwards, so frames
+        still in the rings from before the start command are kept]"""
+        if self.session is not None:
+            return
+        self.session = session
+        if self.preroll:
+            # the pre-roll jobs write what came before now
+            self.start_segments(self.end_segments(str(session).encode()))
+            return
+        # frames before the last stop are in the last session already
+        self.start_segments(max(start, self.boundary))
+
+    def rotate(self) -> None:
+        """[end the running segments now and start the next ones]"""
+        if self.session is None:
+            return
+        self.start_segments(self.end_segments(), resume=True)
+
+    def stop(self) -> None:
+        if self.session is None:
+            return
+        self.end_segments()
+        self.session = None
+        self.jobs = [job for job in self.jobs if not job.done()]
+        self.start_preroll()
+
+    def counters(self) -> Dict:
+        """[per session, what recording cost and what the motion gates
+        saved. the savings are estimates, gated frames at the mean encode
+        time and size of the frames that were written]"""
+        out = {}
+        for session, totals in list(self.sessions.items()):
+            written = max(totals["written"], 1)
+            gated = totals["gated"]
+            saved_ns = gated * totals["encode_ns"] / written
+            out[session] = {
+                "segments": totals["segments"],
+                "written": totals["written"],
+                "gated": gated,
+                "gated_share": gated / max(totals["written"] + gated, 1),
+                "encode_s": totals["encode_ns"] / 1e9,
+                "gate_s": totals["gate_ns"] / 1e9,
+                "encode_saved_s": (saved_ns - totals["gate_ns"]) / 1e9,
+                "bytes": totals["bytes"],
+                "bytes_saved": int(gated * totals["bytes"] / written),
+            }
+        return out
+
+    def close(self) -> None:
+        """[stop, wait for every segment to finish and free the pool]"""
+        self.stop()
+        # and let the pre-roll jobs go without writing anything
+        self.end_segments()
+        self.pool.shutdown(wait=True)
+        for boundary in self.boundaries:
+            boundary.close()
+        for handoff in self.handoffs:
+            if handoff is not None:
+                handoff.close()
+        for session, totals in self.counters().items():
+            if totals["gated"]:
+                self.logger.info(
+                    f"{session}: {totals['gated']} frames gated, "
+                    f"{totals['encode_saved_s']:.1f} s of encoding and "
+                    f"{totals['bytes_saved'] / 1e6:.0f} MB saved"
+                )
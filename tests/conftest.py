@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the dvr2 modules import each other as top level modules, the same way
+# they are run from inside the package folder
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "dvr2"))
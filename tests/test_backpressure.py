@@ -0,0 +1,54 @@
+import logging
+
+import backpressure
+
+SECOND = 1_000_000_000
+
+
+def test_policy_sheds_preview_then_recorded_frames_and_recovers():
+    logger = logging.getLogger("test_backpressure")
+    board = backpressure.Board(["camera1_record", "camera1_preview"])
+    policy = backpressure.Policy(board, {"hold_seconds": 1.0}, logger)
+    record = board.stage("camera1_record", backpressure.RECORD)
+    preview = board.stage("camera1_preview", backpressure.PREVIEW)
+
+    record.report(2, 16, 0)
+    assert policy.evaluate(record.row["updated"][0]) == 0
+    assert all(record.admit(number) for number in range(8))
+    assert all(preview.admit(number) for number in range(8))
+
+    # the encoder is 12 frames behind, the level goes up one step a check
+    record.report(12, 16, 0)
+    now = int(record.row["updated"][0])
+    assert policy.evaluate(now) == backpressure.SHED_PREVIEW
+    assert not any(preview.admit(number) for number in range(8))
+    assert all(record.admit(number) for number in range(8))
+    assert policy.evaluate(now) == 2
+    # one recorded frame in four is shed
+    kept = [record.admit(number) for number in range(8)]
+    assert kept == [True, True, True, False] * 2
+    # lag alone counts too, up to the last level where one in two goes
+    record.report(0, 16, 2 * SECOND)
+    for _ in range(5):
+        policy.evaluate(now)
+    assert board.level == policy.max_level
+    kept = [record.admit(number) for number in range(8)]
+    assert kept == [True, False] * 4
+
+    # back under low, the level comes down a step per hold
+    record.report(1, 16, 0)
+    assert policy.evaluate(now) == policy.max_level
+    assert policy.evaluate(now + SECOND) == policy.max_level - 1
+    assert policy.evaluate(now + SECOND + SECOND // 2) == 3
+    # a stage that stopped reporting is idle, not backed up
+    record.report(16, 16, 0)
+    assert policy.evaluate(now + 10 * SECOND) == 2
+    record.lose(3)
+
+    counters = policy.counters()
+    stage = counters["stages"]["camera1_record"]
+    assert (stage["passed"], stage["shed"], stage["lost"]) == (26, 6, 3)
+    assert counters["stages"]["camera1_preview"]["shed"] == 8
+    assert (counters["raised"], counters["lowered"]) == (4, 2)
+    assert counters["worst"] == "camera1_record"
+    board.close()
@@ -0,0 +1,66 @@
+import logging
+import time
+
+import cv2
+import numpy as np
+
+import camera_capture
+
+
+def camera(**settings):
+    camera = {
+        "name": "test_camera",
+        "driver": "synthetic",
+        "width": 64,
+        "height": 48,
+        "fps": 200,
+        "ring_slots": 4,
+    }
+    camera.update(settings)
+    return camera
+
+
+def wait_for_frames(ring, count: int) -> None:
+    deadline = time.monotonic() + 20
+    while ring.count < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_synthetic_camera_fills_ring_from_capture_process():
+    logger = logging.getLogger("test_camera_capture")
+    settings = {"cameras": [camera()]}
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    ring = rings[0]
+    wait_for_frames(ring, 10)
+
+    number, timestamp, frame = ring.latest(np.empty((48, 64, 3), np.uint8))
+    assert number >= 9
+    assert int.from_bytes(frame[0, :8, 0].tobytes(), "little") == number
+    assert frame[1, 10, 2] == (10 + number) % 256
+    # only the last ring_slots frames are kept
+    assert ring.get(number - 4) is None
+    older, _ = ring.get(number - 1)
+    assert older <= timestamp
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+    assert not processes[0].is_alive()
+
+
+def test_file_camera_decodes_into_ring(tmp_path):
+    path = str(tmp_path / "clip.avi")
+    writer = cv2.VideoWriter(
+        path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (64, 48)
+    )
+    for level in range(0, 250, 50):
+        writer.write(np.full((48, 64, 3), level, np.uint8))
+    writer.release()
+
+    logger = logging.getLogger("test_camera_capture")
+    settings = {
+        "cameras": [camera(driver="file", path=path, fps=25, ring_slots=16)]
+    }
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    wait_for_frames(rings[0], 8)
+    # the clip loops, frames 5 to 7 are the first three again
+    levels = [int(rings[0].get(n)[1].mean()) for n in range(5, 8)]
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+    assert [round(level, -1) for level in levels] == [0, 50, 100]
@@ -0,0 +1,65 @@
+import logging
+import queue
+import socket
+import time
+
+import clock
+import io_connections
+import main
+import shared_mailbox
+
+
+class ListRecorder:
+    def __init__(self):
+        self.records = []
+
+    def add(self, stream, timestamp, payload):
+        self.records.append((stream, timestamp, bytes(payload)))
+
+
+def test_packets_keep_their_arrival_times_when_drained_together():
+    logger = logging.getLogger("test_clock")
+    logger.setLevel(logging.WARNING)
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True)]
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    gaps = {}
+    for kernel in (True, False):
+        conn = io_connections.get_connections(
+            [
+                {
+                    "name": "gyro",
+                    "ip": "127.0.0.1",
+                    "port": 0,
+                    "kernel_timestamps": kernel,
+                }
+            ],
+            True,
+            logger,
+        )[0]
+        assert conn.kernel_stamps == (kernel and clock.SO_TIMESTAMPNS is not None)
+        # linux turns receive timestamping on a moment after the first socket
+        # asks for it, a packet before that is stamped when it is read
+        time.sleep(0.05)
+        sent = []
+        for num in range(3):
+            sent.append(clock.now_ns())
+            client.sendto(bytes([num]), conn.sock.getsockname())
+            time.sleep(0.05)
+        recorder = ListRecorder()
+        main.get_packets(
+            conn, logger, mailboxes, queue.SimpleQueue(), recorder
+        )
+        timestamps = [timestamp for _, timestamp, _ in recorder.records]
+        assert all(isinstance(timestamp, int) for timestamp in timestamps)
+        assert timestamps == sorted(timestamps)
+        assert timestamps[0] >= sent[0] - 1_000_000
+        # to the ns, as received
+        assert mailboxes[0].timestamp == timestamps[-1]
+        gaps[conn.kernel_stamps] = timestamps[-1] - timestamps[0]
+        conn.sock.close()
+    # stamped on arrival, 50 ms apart, rather than all at the drain
+    if True in gaps:
+        assert gaps[True] > 80_000_000
+    assert gaps[False] < 20_000_000
+    client.close()
+    mailboxes[0].close()
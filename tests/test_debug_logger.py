@@ -0,0 +1,55 @@
+import logging
+import queue
+
+import debug_logger
+
+
+def lines(path):
+    with open(path, "r") as f:
+        return [line.rsplit("MSG:", 1)[1].strip() for line in f]
+
+
+def test_a_full_queue_drops_and_counts_instead_of_waiting():
+    handler = debug_logger.AsyncQueueHandler(queue.Queue(maxsize=2))
+    logger = logging.getLogger("test_debug_logger_full")
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    # nothing reads the queue
+    for num in range(5):
+        logger.info("line %d", num)
+    assert debug_logger.dropped(logger) == 3
+    assert handler.queue.qsize() == 2
+    logger.removeHandler(handler)
+
+
+def test_rotation_switches_files_without_losing_records(tmp_path):
+    first = debug_logger.get_new_log_file_name(str(tmp_path), "a", "log")
+    second = tmp_path / "b.log"
+    logger = debug_logger.init_logger(
+        "test_debug_logger_rotate", "info", str(first), asynchronous=True
+    )
+    for num in range(500):
+        logger.info("line %d", num)
+    logger = debug_logger.update_handler(logger, str(second))
+    for num in range(500, 1000):
+        logger.info("line %d", num)
+    assert debug_logger.dropped(logger) == 0
+    debug_logger.stop_logger(logger)
+    # everything before the marker went to the first file
+    assert lines(first) == [f"line {num}" for num in range(500)]
+    assert lines(second) == [f"line {num}" for num in range(500, 1000)]
+
+
+def test_stop_logger_drains_the_queue(tmp_path):
+    path = tmp_path / "debug.log"
+    logger = debug_logger.init_logger(
+        "test_debug_logger_stop", "debug", str(path), asynchronous=True
+    )
+    for num in range(20_000):
+        logger.debug("line %d", num)
+    (handler,) = logger.handlers
+    debug_logger.stop_logger(logger)
+    assert handler.dropped == 0
+    assert handler.queue.empty()
+    assert lines(path) == [f"line {num}" for num in range(20_000)]
+    assert not logger.handlers
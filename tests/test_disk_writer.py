@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+
+import disk_writer
+import telemetry_file
+import time_index
+
+DISK = {"chunk_bytes": 4096, "fsync_bytes": 16384, "flush_seconds": 0.05}
+
+
+def wait_for(writer: disk_writer.DiskWriter) -> None:
+    done = threading.Event()
+    writer.call(done.set)
+    assert done.wait(5)
+
+
+def test_small_writes_go_out_in_aligned_chunks(tmp_path):
+    path = str(tmp_path / "out.bin")
+    writer = disk_writer.DiskWriter(path, DISK)
+    data = bytes(range(250)) * 200
+    for start in range(0, len(data), 100):
+        writer.write(data[start : start + 100])
+    wait_for(writer)
+    # only whole chunks so far, the rest waits for more
+    assert os.path.getsize(path) == len(data) // 4096 * 4096
+    counters = writer.counters()
+    # one pwrite per chunk rather than per 100 byte write
+    assert counters["write_ns"]["count"] == 12
+    assert counters["written"] == 12 * 4096
+    assert counters["fsyncs"] == 3
+    assert counters["queued"] == 0
+    # a quiet file is written out after flush_seconds, then again whole
+    time.sleep(0.2)
+    assert os.path.getsize(path) == len(data)
+    writer.write(b"x" * 4096)
+    writer.close()
+    with open(path, "rb") as f:
+        assert f.read() == data + b"x" * 4096
+    # the 848 byte tail was written once early and once more by close
+    assert writer.counters()["written"] == 13 * 4096 + 2 * 848
+
+
+def test_writes_wait_once_queue_bytes_are_waiting(tmp_path):
+    writer = disk_writer.DiskWriter(
+        str(tmp_path / "out.bin"), dict(DISK, queue_bytes=3 * 4096)
+    )
+    release = threading.Event()
+    writer.call(release.wait)
+    done = threading.Event()
+
+    def fill():
+        for _ in range(5):
+            writer.write(b"y" * 4096)
+        done.set()
+
+    threading.Thread(target=fill).start()
+    # three chunks fit, the fourth waits for the stuck disk
+    time.sleep(0.2)
+    assert not done.is_set()
+    assert writer.queued == 3 * 4096
+    release.set()
+    assert done.wait(5)
+    writer.close()
+    counters = writer.counters()
+    assert counters["stalls"] >= 1
+    assert counters["max_queued"] == 3 * 4096
+    assert counters["written"] == 5 * 4096
+    assert str(tmp_path / "out.bin") not in [
+        writer.path for writer in disk_writer.WRITERS.values()
+    ]
+
+
+def test_telemetry_index_never_points_past_the_data(tmp_path):
+    path = str(tmp_path / "telemetry.tlm")
+    writer = telemetry_file.TelemetryWriter(
+        path, ["overlay"], 1000, index_interval=10, disk=DISK
+    )
+    for num in range(200):
+        writer.write(num * 10, 0, b"p" * 90)
+        if num % 50 == 49:
+            wait_for(writer.file)
+            writer.index.file.flush()
+            entries = time_index.read_index(f"{path}.idx")
+            assert len(entries)
+            assert entries["position"][-1] < os.path.getsize(path)
+    writer.close()
+    reader = telemetry_file.TelemetryReader(path)
+    entries = time_index.read_index(f"{path}.idx")
+    assert len(entries) == 200
+    for timestamp, position in entries[::37]:
+        record = next(reader.iter_from(int(position)))
+        assert record[0] == timestamp
+        record = None
+    reader.close()
+
+
+def test_telemetry_spills_then_drops_rather_than_waiting(tmp_path):
+    path = str(tmp_path / "telemetry.tlm")
+    disk = dict(DISK, queue_bytes=2 * 4096, spill_bytes=20_000)
+    writer = telemetry_file.TelemetryWriter(path, ["overlay"], 4096, disk=disk)
+    release = threading.Event()
+    writer.file.call(release.wait)
+    start = time.monotonic()
+    # far more than the stuck disk and the spill together hold
+    for num in range(1000):
+        writer.write(num, 0, b"p" * 90)
+    assert time.monotonic() - start < 1
+    assert writer.file.stalls == 0
+    assert 0 < writer.dropped < 1000
+    release.set()
+    writer.close()
+    reader = telemetry_file.TelemetryReader(path)
+    timestamps = [timestamp for timestamp, _, _ in reader]
+    reader.close()
+    # what was kept is on disk whole, the newest records are the lost ones
+    assert timestamps == list(range(1000 - writer.dropped))
+
+
+def test_close_gives_back_the_space_reserved_past_the_end(tmp_path):
+    path = tmp_path / "small.bin"
+    writer = disk_writer.DiskWriter(
+        str(path), dict(DISK, preallocate_bytes=1 << 20)
+    )
+    writer.write(b"z" * 100)
+    writer.flush()
+    wait_for(writer)
+    if disk_writer.FALLOCATE is not None:
+        # a chunk at a time at first, not preallocate_bytes
+        assert writer.allocated == 8192
+    # then as much again as the file holds
+    writer.write(b"z" * (5 * 4096))
+    wait_for(writer)
+    if disk_writer.FALLOCATE is not None:
+        assert writer.allocated == 32768
+    writer.close()
+    assert path.stat().st_size == 5 * 4096 + 100
+    assert path.stat().st_blocks * 512 <= 6 * 4096
+
+    log = tmp_path / "debug.log"
+    handler = disk_writer.LogFileHandler(str(log))
+    assert handler.stream.writer.preallocate_bytes == 0
+    handler.stream.write("abc")
+    handler.close()
+    assert log.read_bytes() == b"abc"
+    assert log.stat().st_blocks * 512 <= 4096
@@ -0,0 +1,113 @@
+import datetime
+import json
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+import avi
+import export
+import telemetry_file
+import time_index
+
+CONFIG = Path(__file__).resolve().parents[1] / "dvr2" / "config.json"
+SECOND = 1_000_000_000
+FPS = 10
+
+
+def record_session(folder):
+    """[two 3 second segments of a camera at 10 fps, and 10 Hz telemetry,
+    channel1 counting the samples. frame n has n in binary along its
+    bottom edge, a white block per bit set]"""
+    number = 0
+    for segment in ("143200", "143203"):
+        path = folder / f"camera1_2021-09-22_{segment}.avi"
+        writer = cv2.VideoWriter(
+            str(path), cv2.VideoWriter_fourcc(*"MJPG"), FPS, (320, 240)
+        )
+        index = time_index.IndexWriter(f"{path}.idx")
+        for position in range(3 * FPS):
+            frame = np.zeros((240, 320, 3), np.uint8)
+            for bit in range(6):
+                if number >> bit & 1:
+                    frame[224:, bit * 48 : bit * 48 + 48] = 255
+            writer.write(frame)
+            index.add(10 * SECOND + number * SECOND // FPS, position)
+            number += 1
+        writer.release()
+        index.close()
+    telemetry = telemetry_file.TelemetryWriter(
+        str(folder / "telemetry_2021-09-22_143200.tlm"), ["overlay"], 512
+    )
+    for num in range(60):
+        values = ",".join([f"{num:.1f}"] + ["1.0"] * 7)
+        packet = f"2021-09-22 14:32:{num // 10:02d},{values},TASK {num // 20}"
+        telemetry.write(10 * SECOND + num * SECOND // 10, 0, packet.encode())
+    telemetry.close()
+
+
+def numbers(path):
+    """[each frame's number, read away from the overlay panel]"""
+    out = []
+    for jpeg in avi.frames(path):
+        frame = cv2.imdecode(np.frombuffer(jpeg, np.uint8), 1)
+        bits = frame[232, 24::48, 0][:6] > 128
+        out.append(int((bits * 2 ** np.arange(6)).sum()))
+    return out
+
+
+def test_ranges_are_exported_in_parallel_chunks_and_resumed(tmp_path):
+    session = tmp_path / "session_2021-09-22_143200"
+    session.mkdir()
+    record_session(session)
+    with open(CONFIG, "r") as f:
+        settings = json.load(f)
+    settings["export"] = {
+        "folder": str(tmp_path / "exports"),
+        "chunk_seconds": 1,
+    }
+    logger = logging.getLogger("test_export")
+    # across the segment change, and a second range
+    ranges = [
+        (12 * SECOND, 14 * SECOND - 1),
+        (15 * SECOND + SECOND // 2, 20 * SECOND),
+    ]
+
+    job = export.Export(str(session), settings, "camera1", logger, ranges)
+    # 12 to 13 in the first segment, 13 to 14 in the second, 15.5 on
+    sizes = [[c["count"] for c in part["chunks"]] for part in job.ranges]
+    assert sizes == [[10, 10], [5]]
+    seen = []
+    report = job.run(workers=2, progress=seen.append, keep_chunks=True)
+    job.close()
+    assert report["frames"] == report["done"] == 25
+    assert [update["done"] for update in seen][-1] == 25
+    first, second = report["outputs"]
+    start, end = (datetime.datetime.fromtimestamp(t) for t in (12, 14))
+    name = f"camera1_{start:%Y-%m-%d_%H%M%S}-{end:%H%M%S}.avi"
+    assert Path(first).name == name
+    assert numbers(first) == list(range(20, 40))
+    assert numbers(second) == list(range(55, 60))
+    # the overlay panel is burned in
+    frame = cv2.imdecode(np.frombuffer(next(avi.frames(first)), np.uint8), 1)
+    assert (frame[8:40, 8:200] > 150).any()
+    capture = cv2.VideoCapture(first)
+    assert capture.get(cv2.CAP_PROP_FRAME_COUNT) == 20
+    capture.release()
+
+    # stopped with one chunk of the first range to do
+    folder = Path(first).parent
+    with open(folder / export.PLAN, "r") as f:
+        state = json.load(f)
+    state["joined"].pop("0")
+    with open(folder / export.PLAN, "w") as f:
+        json.dump(state, f)
+    (folder / "chunk_000_00001.avi").unlink()
+    job = export.Export(str(session), settings, "camera1", logger, ranges)
+    report = job.run(workers=1)
+    job.close()
+    assert (report["chunks"], report["resumed"]) == (1, 10)
+    assert report["frames"] == report["done"] == 20
+    assert numbers(first) == list(range(20, 40))
+    assert not list(folder.glob("chunk_000_*"))
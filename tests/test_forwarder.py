@@ -0,0 +1,105 @@
+import logging
+import queue
+import socket
+import time
+
+import forwarder
+import io_connections
+import main
+import shared_mailbox
+
+
+def make_sinks(count):
+    sinks = []
+    for _ in range(count):
+        sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sink.bind(("127.0.0.1", 0))
+        sink.setblocking(False)
+        sinks.append(sink)
+    return sinks
+
+
+def drain(sink):
+    packets = []
+    while True:
+        try:
+            packets.append(sink.recv(2048))
+        except BlockingIOError:
+            return packets
+
+
+def test_get_packets_forwards_every_packet_to_every_output():
+    logger = logging.getLogger("test_forwarder")
+    logger.setLevel(logging.WARNING)
+    # enough raw outputs for a sendmmsg batch, plus one reformatted
+    sinks = make_sinks(forwarder.BATCH_MIN + 1)
+    outputs = [
+        {
+            "name": f"output{num}",
+            "ip": "127.0.0.1",
+            "port": sink.getsockname()[1],
+            "inputs": ["overlay"],
+        }
+        for num, sink in enumerate(sinks)
+    ]
+    outputs[-1]["fields"] = ["depth", "task"]
+    settings = {
+        "overlay": {
+            "input": "overlay",
+            "fields": [{"name": "time"}, {"name": "depth"}, {"name": "task"}],
+        },
+        "inputs": [{"name": "overlay"}, {"name": "gyro"}],
+        "outputs": outputs,
+    }
+    outputs_forwarder = forwarder.Forwarder(settings, logger)
+    assert outputs_forwarder.route("gyro") is None
+    conn = io_connections.get_connections(
+        [{"name": "overlay", "ip": "127.0.0.1", "port": 0}], True, logger
+    )[0]
+    conn.forward = outputs_forwarder.route("overlay")
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True)]
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    packets = [f"{num},{num * 10},dive, with commas".encode() for num in range(20)]
+    for packet in packets:
+        client.sendto(packet, conn.sock.getsockname())
+    time.sleep(0.05)
+    assert main.get_packets(conn, logger, mailboxes, queue.SimpleQueue()) == 20
+    time.sleep(0.05)
+
+    for sink in sinks[:-1]:
+        assert drain(sink) == packets
+    assert drain(sinks[-1]) == [
+        f"{num * 10},dive, with commas".encode() for num in range(20)
+    ]
+    counters = outputs_forwarder.counters()
+    assert all(out == {"sent": 20, "dropped": 0} for out in counters.values())
+    outputs_forwarder.close()
+    client.close()
+    conn.sock.close()
+    mailboxes[0].close()
+    for sink in sinks:
+        sink.close()
+
+
+def test_an_empty_datagram_is_forwarded_past_the_batch():
+    sinks = make_sinks(forwarder.BATCH_MIN)
+    outputs = [
+        forwarder.Output(
+            {"name": f"output{num}", "ip": "127.0.0.1", "port": port},
+            {"input": "overlay", "fields": [{"name": "time"}]},
+        )
+        for num, port in enumerate(sink.getsockname()[1] for sink in sinks)
+    ]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    route = forwarder.Route(sock, "overlay", outputs)
+    buffer = bytearray(64)
+    route.send(memoryview(buffer)[:0])
+    buffer[:4] = b"next"
+    route.send(memoryview(buffer)[:4])
+    time.sleep(0.05)
+    for sink in sinks:
+        assert drain(sink) == [b"", b"next"]
+    assert all(output.sent == 2 for output in outputs)
+    sock.close()
+    for sink in sinks:
+        sink.close()
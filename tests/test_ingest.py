@@ -0,0 +1,109 @@
+import datetime
+import logging
+import multiprocessing
+import queue
+import selectors
+import socket
+import time
+
+import io_connections
+import shared_mailbox
+import main
+
+
+def make_inputs(count: int):
+    logger = logging.getLogger("test_ingest")
+    logger.setLevel(logging.WARNING)
+    setting = [
+        {"name": f"input{idx}", "ip": "127.0.0.1", "port": 0}
+        for idx in range(count)
+    ]
+    inputs = io_connections.get_connections(setting, True, logger)
+    for conn in inputs:
+        conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        conn.port = conn.sock.getsockname()[1]
+    return inputs, logger
+
+
+def fill(conn, count: int, size: int = 100) -> None:
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for num in range(count):
+        sender.sendto(num.to_bytes(4, "big") * (size // 4), (conn.host, conn.port))
+    sender.close()
+    time.sleep(0.05)
+
+
+def legacy_get_packets(sock, qs, settings, logger):
+    # the per datagram receive path get_packets replaced
+    data_packet, sensor_ip = sock.recvfrom(1024)
+    sensor_port = sock.getsockname()[1]
+    logger.info(
+        f"data_packet from {sensor_ip} on port {sensor_port}: {data_packet}"
+    )
+    data_packet = [datetime.datetime.now(), data_packet]
+    for idx, input in enumerate(settings["inputs"]):
+        if sensor_port == input["port"]:
+            q = qs[idx]
+            while True:
+                try:
+                    _ = q.get(block=False)
+                except queue.Empty:
+                    break
+            try:
+                q.put(data_packet, block=False)
+            except queue.Full:
+                pass
+
+
+def test_get_packets_drains_burst_and_keeps_newest():
+    inputs, logger = make_inputs(2)
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True) for _ in inputs]
+    command_q = queue.SimpleQueue()
+    fill(inputs[1], 500)
+
+    assert inputs[1].index == 1
+    assert main.get_packets(inputs[1], logger, mailboxes, command_q) == 500
+    count, timestamp, packet, missed = mailboxes[1].read()
+    assert packet == (499).to_bytes(4, "big") * 25
+    assert mailboxes[0].count == 0
+    # nothing left on the socket
+    assert main.get_packets(inputs[1], logger, mailboxes, command_q) == 0
+    for conn, box in zip(inputs, mailboxes):
+        conn.sock.close()
+        box.close()
+
+
+def test_get_packets_sustains_10x_legacy_rate():
+    count = 2000
+    inputs, logger = make_inputs(1)
+    conn = inputs[0]
+    settings = {"inputs": [{"name": conn.name, "port": conn.port}]}
+    sel = selectors.DefaultSelector()
+    sel.register(conn.sock, selectors.EVENT_READ)
+    qs = [multiprocessing.Queue(maxsize=1)]
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True)]
+
+    # best of a few rounds, so a busy test box does not decide the result
+    legacy = batched = float("inf")
+    for _ in range(3):
+        fill(conn, count)
+        start = time.perf_counter()
+        for _ in range(count):
+            sel.select()
+            legacy_get_packets(conn.sock, qs, settings, logger)
+        legacy = min(legacy, time.perf_counter() - start)
+
+        fill(conn, count)
+        received = 0
+        start = time.perf_counter()
+        while received < count:
+            sel.select()
+            received += main.get_packets(
+                conn, logger, mailboxes, queue.SimpleQueue()
+            )
+        batched = min(batched, time.perf_counter() - start)
+
+    sel.close()
+    conn.sock.close()
+    mailboxes[0].close()
+    assert legacy / batched >= 10
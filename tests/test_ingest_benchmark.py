@@ -0,0 +1,16 @@
+import json
+
+import ingest_benchmark
+
+
+def test_inprocess_run_accounts_for_every_packet():
+    result = ingest_benchmark.run(
+        rate=400, size=64, inputs=2, duration=0.5, burst=10
+    )
+    json.dumps(result)
+    assert result["sent"] == 2 * 200
+    assert result["received"] + result["lost"] == result["sent"]
+    assert result["lost"] == 0
+    assert result["kernel_drops"] in (0, None)
+    assert set(result["latency_us"]) == {"p50", "p90", "p99", "p99.9", "max"}
+    assert result["throughput"] > 0
@@ -0,0 +1,103 @@
+import logging
+import time
+
+import numpy as np
+
+import frame_ring
+import mosaic
+
+
+def settings(**extra):
+    return {
+        "cameras": [
+            {"name": "camera1", "width": 320, "height": 240},
+            {"name": "camera2", "width": 160, "height": 90},
+        ],
+        "mosaic": dict(width=320, height=120, background=7, **extra),
+    }
+
+
+def test_layout_fills_a_near_square_grid_keeping_aspect():
+    assert mosaic.layout([(240, 320, 3), (90, 160, 3)], 320, 120) == [
+        (0, 0, 120, 160),
+        (15, 160, 90, 160),
+    ]
+    tiles = mosaic.layout([(720, 1280, 3)] * 3, 1280, 720)
+    assert tiles == [(0, 0, 360, 640), (0, 640, 360, 640), (360, 0, 360, 640)]
+
+
+def test_tiles_reuse_the_last_frame_of_slower_cameras():
+    config = settings()
+    rings = [
+        frame_ring.FrameRing(4, (camera["height"], camera["width"], 3))
+        for camera in config["cameras"]
+    ]
+    out = frame_ring.FrameRing(4, (120, 320, 3))
+    compositor = mosaic.Compositor(config, rings)
+    canvas = compositor.canvas
+
+    for ring, value in zip(rings, (50, 200)):
+        ring.begin()[...] = value
+        ring.commit(1.0)
+    number = compositor.publish(out)
+    assert compositor.redrawn == 2
+    frame = out.get(number)[1]
+    assert (frame[:, :160] == 50).all()
+    assert (frame[15:105, 160:] == 200).all()
+    # the letterbox around the second camera
+    assert (frame[:15, 160:] == 7).all() and (frame[105:, 160:] == 7).all()
+
+    # only the first camera moves on, the second keeps its tile
+    rings[0].begin()[...] = 90
+    rings[0].commit(1.04)
+    assert compositor.compose() == 1
+    assert compositor.compose() == 0
+    assert (canvas[:, :160] == 90).all()
+    assert (canvas[15:105, 160:] == 200).all()
+    assert compositor.canvas is canvas
+    assert all(np.shares_memory(tile, canvas) for tile in compositor.tiles)
+    counters = compositor.counters()
+    assert counters["frames"] == 3 and counters["redrawn"] == 3
+    assert counters["compose_ns"]["count"] == 3
+    frame = None
+    compositor.close()
+    out.close()
+
+
+def test_streams_add_or_replace_the_cameras():
+    config = settings(name="tiled")
+    cameras, rings = mosaic.streams(config, ["ring1", "ring2"], "tiled ring")
+    assert [camera["name"] for camera in cameras["cameras"]] == [
+        "camera1",
+        "camera2",
+        "tiled",
+    ]
+    assert rings == ["ring1", "ring2", "tiled ring"]
+    assert len(config["cameras"]) == 2
+    config["mosaic"]["replace"] = True
+    cameras, rings = mosaic.streams(config, ["ring1", "ring2"], "tiled ring")
+    assert cameras["cameras"] == [mosaic.mosaic_camera(config)]
+    assert rings == ["tiled ring"]
+    assert mosaic.streams(config, ["ring1"], None) == (config, ["ring1"])
+
+
+def test_unknown_cameras_are_left_out_of_the_mosaic():
+    logger = logging.getLogger("test_mosaic")
+    config = settings(cameras=["camera9"])
+    rings = [
+        frame_ring.FrameRing(4, (camera["height"], camera["width"], 3))
+        for camera in config["cameras"]
+    ]
+    ring, process, counters, stop = mosaic.start_mosaic(config, rings, logger)
+    assert (ring, process, counters) == (None, None, None)
+    mosaic.stop_mosaic(process, ring, counters, stop, logger)
+
+    config["mosaic"]["cameras"] = ["camera9", "camera2"]
+    ring, process, counters, stop = mosaic.start_mosaic(config, rings, logger)
+    deadline = time.monotonic() + 5
+    while not counters.count and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert process.is_alive() and counters.count
+    mosaic.stop_mosaic(process, ring, counters, stop, logger)
+    for ring in rings:
+        ring.close()
@@ -0,0 +1,65 @@
+import numpy as np
+
+import motion_gate
+
+SHAPE = (180, 320, 3)
+FPS = 10
+
+
+def frames(seconds, moving=()):
+    """[a still noisy scene, with a block moving across it in the seconds
+    listed]"""
+    rng = np.random.default_rng(2)
+    scene = rng.integers(60, 190, SHAPE, np.uint8)
+    for number in range(seconds * FPS):
+        frame = scene + rng.integers(0, 4, SHAPE, np.uint8)
+        if number // FPS in moving:
+            left = number % FPS * 20
+            frame[40:100, left : left + 60] = 255
+        yield number / FPS, frame
+
+
+def test_still_scenes_are_decimated_and_motion_is_kept_at_once():
+    gate = motion_gate.MotionGate(
+        {"width": 80, "hold_seconds": 1.0, "still_interval": 0.5}, SHAPE
+    )
+    kept = [
+        timestamp
+        for timestamp, frame in frames(6, moving=(3,))
+        if gate.keep(frame, timestamp)
+    ]
+    # still: every frame through the hold, then two a second
+    assert kept[:11] == [number / FPS for number in range(11)]
+    assert kept[11:13] == [1.5, 2.0]
+    # the first moving frame and every one after it, through the hold
+    assert 3.0 in kept and 2.9 not in kept
+    assert [t for t in kept if 3.0 <= t < 5.0] == [
+        number / FPS for number in range(30, 50)
+    ]
+    assert gate.starts == 1
+    assert gate.frames == 60 and gate.kept == len(kept)
+
+
+def test_without_a_still_interval_still_frames_are_dropped():
+    gate = motion_gate.MotionGate(
+        {"hold_seconds": 0.5, "still_interval": 0}, SHAPE
+    )
+    kept = [t for t, frame in frames(3) if gate.keep(frame, t)]
+    assert kept == [number / FPS for number in range(6)]
+    assert gate.frames == 30
+
+
+def test_a_resumed_gate_carries_on_still():
+    motion = {"hold_seconds": 1.0, "still_interval": 0.5}
+    scene = list(frames(4))
+    gate = motion_gate.MotionGate(motion, SHAPE)
+    for timestamp, frame in scene[:20]:
+        gate.keep(frame, timestamp)
+    assert not gate.moving
+    # the next segment's gate, where a fresh one would keep every frame
+    # through the hold again
+    after = motion_gate.MotionGate(motion, SHAPE)
+    after.resume(gate.state())
+    kept = [t for t, frame in scene[20:] if after.keep(frame, t)]
+    assert kept == [2.0, 2.5, 3.0, 3.5]
+    assert after.starts == 0
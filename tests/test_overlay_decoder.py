@@ -0,0 +1,73 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+import overlay_decoder
+
+CONFIG = Path(__file__).resolve().parents[1] / "dvr2" / "config.json"
+
+
+def make_decoder(**overlay):
+    with open(CONFIG, "r") as f:
+        settings = json.load(f)
+    settings["overlay"].update(overlay)
+    return overlay_decoder.OverlayDecoder(
+        settings["overlay"], logging.getLogger("test_overlay_decoder")
+    )
+
+
+def packet(second: int, task: str = "TASK: I'm the real Batman") -> bytes:
+    values = ",".join(f"{second + i / 8:.3f}" for i in range(8))
+    return f"2021-09-22 14:32:{second:02d},{values},{task}".encode()
+
+
+def test_decode_matches_naive_and_drops_malformed():
+    decoder = make_decoder()
+    packets = [packet(sec % 60) for sec in range(100)]
+    packets[10] = packet(10, "TASK: survey, line 2")
+
+    records = decoder._decode(packets, 5.0)
+    assert (records == decoder.decode_naive(packets, 5.0)).all()
+    assert decoder.text(records["task"][10]) == "TASK: survey, line 2"
+    assert records["channel2"][0] == 0.125
+    assert records["timestamp"][1] == np.datetime64("2021-09-22T14:32:01")
+
+    packets[20] = b"2021-09-22 14:32:20,1.0,2.0"
+    packets[30] = packet(30).replace(b",30.125,", b",bad,")
+    records = decoder.decode(packets, 5.0)
+    assert len(records) == 98
+
+
+def test_ring_keeps_newest_records_as_a_view():
+    decoder = make_decoder(rate=1, buffer_seconds=50)
+    for start in range(0, 120, 40):
+        for sec in range(start, start + 40):
+            decoder.add(packet(sec % 60))
+        decoder.flush()
+
+    assert decoder.decoded == 120
+    newest = decoder.ring.last(10)
+    assert newest.base is decoder.ring.data
+    assert list(newest["channel1"]) == [float(s % 60) for s in range(110, 120)]
+    # seconds 50 to 59 of the last minute
+    assert len(decoder.since(9)) == 10
+
+
+def test_text_table_is_cut_back_to_what_the_ring_holds():
+    decoder = make_decoder(rate=1, buffer_seconds=8, max_texts=10)
+    ring = decoder.ring.data
+    for batch in range(10):
+        for sec in range(4):
+            decoder.add(packet(sec, f"TASK {batch * 4 + sec}"), 1)
+        decoder.flush()
+        assert len(decoder.texts) <= 12
+    assert decoder.compactions > 0
+    # the ring was renumbered in place, its texts still read the same
+    assert decoder.ring.data is ring
+    tasks = [decoder.text(code) for code in decoder.ring.last(8)["task"]]
+    assert tasks == [f"TASK {num}" for num in range(32, 40)]
+    # a text still in the ring keeps its code
+    code = decoder.ring.last(1)["task"][0]
+    assert decoder.intern(b"TASK 39") == code
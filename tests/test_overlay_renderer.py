@@ -0,0 +1,87 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+import overlay_decoder
+import overlay_renderer
+
+CONFIG = Path(__file__).resolve().parents[1] / "dvr2" / "config.json"
+SHAPE = (240, 640, 3)
+
+
+def make_decoder():
+    with open(CONFIG, "r") as f:
+        overlay = json.load(f)["overlay"]
+    decoder = overlay_decoder.OverlayDecoder(
+        overlay, logging.getLogger("test_overlay_renderer")
+    )
+    return overlay, decoder
+
+
+def packet(second: int, channel1: float, task: str) -> bytes:
+    values = ",".join([f"{channel1:.3f}"] + ["1.5"] * 7)
+    return f"2021-09-22 14:32:{second:02d},{values},{task}".encode()
+
+
+def test_only_changed_values_are_redrawn_and_match_a_fresh_render():
+    overlay, decoder = make_decoder()
+    records = decoder.decode(
+        [
+            packet(7, 3.25, "TASK: survey"),
+            packet(7, 3.5, "TASK: survey"),
+            packet(8, 3.5, "TASK: return"),
+        ],
+        0,
+    )
+    renderer = overlay_renderer.OverlayRenderer(overlay, decoder, SHAPE)
+    picture = np.random.default_rng(1).integers(0, 256, SHAPE, np.uint8)
+
+    frame = picture.copy()
+    renderer.render(frame, records[0])
+    assert renderer.redrawn == len(overlay["fields"])
+    # the same sample again changes nothing, the next only channel1
+    assert renderer.update(records[0]) == 0
+    assert renderer.update(records[1]) == 1
+    assert renderer.update(records[2]) == 2
+    assert renderer.shown[0] == "2021-09-22 14:32:08"
+    assert renderer.shown[-1] == "TASK: return"
+    glyphs = renderer.glyph_misses
+    assert renderer.update(records[0]) == 3
+    # two times, channel1 values and tasks, and the 1.500 of the other
+    # channels, everything after came out of the tile cache
+    assert renderer.tile_misses == 7
+    assert renderer.glyph_misses == glyphs
+
+    frame = picture.copy()
+    renderer.render(frame, records[2])
+    fresh = overlay_renderer.OverlayRenderer(overlay, decoder, SHAPE)
+    expected = picture.copy()
+    fresh.render(expected, records[2])
+    assert (frame == expected).all()
+    # only the panel is touched, and it shows the picture darkened
+    inside = np.zeros(SHAPE[:2], bool)
+    inside[renderer.top : renderer.bottom, renderer.left : renderer.right] = 1
+    assert (frame[~inside] == picture[~inside]).all()
+    assert (frame[inside] != picture[inside]).mean() > 0.5
+    # text is drawn in, close to Pillow drawing the whole panel
+    naive = picture.copy()
+    renderer.render_naive(naive, records[2])
+    difference = np.abs(frame.astype(int) - naive)[inside]
+    assert difference.mean() < 4
+
+
+def test_panel_is_cut_to_the_frame():
+    overlay, decoder = make_decoder()
+    overlay["render"] = {"origin": [600, 200]}
+    records = decoder.decode([packet(7, 3.25, "TASK: survey")], 0)
+    renderer = overlay_renderer.OverlayRenderer(overlay, decoder, SHAPE)
+    frame = np.full(SHAPE, 200, np.uint8)
+    renderer.render(frame, records[0])
+    assert (renderer.right, renderer.bottom) == (SHAPE[1], SHAPE[0])
+    assert (frame[200:, 600:] != 200).any()
+    assert (frame[:200] == 200).all()
+    # no sample blanks the values
+    renderer.render(frame, None)
+    assert renderer.shown == [""] * len(overlay["fields"])
@@ -0,0 +1,26 @@
+import packet_ring
+
+
+def test_ring_wraps_and_drops_when_full():
+    ring = packet_ring.PacketRing(256)
+    reader = packet_ring.PacketRing(256, ring.name, create=False)
+    expected = []
+    for num in range(40):
+        payload = bytes([num]) * (num % 13 + 1)
+        if ring.write(payload, num, num % 3):
+            expected.append((num, num % 3, payload))
+        if num % 4 == 3:
+            got = [(t, tag, bytes(p)) for t, tag, p in reader.read()]
+            reader.release()
+            assert got == expected
+            expected = []
+    assert ring.dropped == 0
+
+    # nobody reading, the ring fills and the newest records are dropped
+    while ring.write(b"x" * 40, 0):
+        pass
+    assert ring.dropped == 1
+    assert ring.write(b"x" * 40, 0) is False
+    assert ring.dropped == 2
+    reader.close()
+    ring.close()
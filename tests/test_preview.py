@@ -0,0 +1,126 @@
+import logging
+import socket
+import time
+
+import cv2
+import numpy as np
+
+import backpressure
+import camera_capture
+import frame_ring
+import preview
+
+
+def make_settings(port: int):
+    return {
+        "cameras": [
+            {
+                "name": "camera1",
+                "driver": "synthetic",
+                "width": 640,
+                "height": 480,
+                "fps": 50,
+                "ring_slots": 16,
+            }
+        ],
+        "outputs": [{"name": "preview", "ip": "127.0.0.1", "port": port}],
+        "preview": {"output": "preview", "width": 160, "fps": 20},
+    }
+
+
+def receive(sock: socket.socket, reassembler: preview.Reassembler):
+    while True:
+        try:
+            frame = reassembler.add(sock.recv(65536))
+        except BlockingIOError:
+            return None
+        if frame is not None:
+            return frame
+
+
+def test_newest_frame_is_shrunk_and_sent_in_chunks():
+    viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    viewer.bind(("127.0.0.1", 0))
+    viewer.setblocking(False)
+    settings = make_settings(viewer.getsockname()[1])
+    camera = settings["cameras"][0]
+    ring = frame_ring.FrameRing(4, camera_capture.frame_shape(camera))
+    picture = np.random.default_rng(1).integers(0, 256, (480, 640, 3), "u1")
+    for _ in range(3):
+        ring.begin()[...] = picture
+        ring.commit(12.5)
+    board = backpressure.Board(backpressure.stage_names(settings))
+    sender = preview.Preview(settings, [ring], board)
+    # quality up so the jpeg is big enough to need several chunks
+    sender.params[1] = 95
+
+    assert sender.step() == 1
+    # three frames were waiting, the newest taken long ago
+    row = board.stages[1]
+    assert row["depth"] == 3 and row["capacity"] == 4
+    assert row["lag"] > 1e9 and row["updated"] > 0
+    # nothing new in the ring, nothing sent
+    assert sender.step() == 0
+    assert board.stages[1]["depth"] == 0
+    time.sleep(0.05)
+    camera_index, number, timestamp, jpeg = receive(
+        viewer, preview.Reassembler()
+    )
+    assert (camera_index, number, timestamp) == (0, 2, 12_500_000_000)
+    assert len(jpeg) > preview.CHUNK
+    small = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+    expected = cv2.resize(picture, (160, 120), interpolation=cv2.INTER_AREA)
+    assert small.shape == (120, 160, 3)
+    assert np.abs(small.astype(int) - expected).mean() < 12
+
+    # the policy sheds the preview before anything else
+    board.level_view[0] = backpressure.SHED_PREVIEW
+    ring.begin()
+    ring.commit(12.6)
+    assert sender.step() == 0
+    assert board.stages["shed"][1] == 1
+    sender.close()
+    board.close()
+    viewer.close()
+
+
+def test_reassembler_gives_up_on_a_frame_with_a_chunk_missing():
+    jpeg = bytes(range(256)) * 20
+    first = preview.chunks(0, 7, 1, jpeg)
+    second = preview.chunks(0, 8, 2, jpeg)
+    reassembler = preview.Reassembler()
+    for datagram in first[:-1]:
+        assert reassembler.add(datagram) is None
+    frames = [reassembler.add(datagram) for datagram in second + first[-1:]]
+    assert frames[:-2] == [None] * (len(second) - 1)
+    assert frames[-2] == (0, 8, 2, jpeg)
+    # the missing chunk of the older frame turns up too late
+    assert frames[-1] is None
+    assert reassembler.incomplete == 1
+
+
+def test_preview_process_sends_frames_from_the_capture_ring():
+    logger = logging.getLogger("test_preview")
+    viewer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    viewer.bind(("127.0.0.1", 0))
+    viewer.setblocking(False)
+    settings = make_settings(viewer.getsockname()[1])
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    process, preview_stop = preview.start_preview(
+        settings, rings, None, logger
+    )
+    reassembler = preview.Reassembler()
+    frames = []
+    deadline = time.monotonic() + 10
+    while len(frames) < 3 and time.monotonic() < deadline:
+        frame = receive(viewer, reassembler)
+        if frame is None:
+            time.sleep(0.01)
+        else:
+            frames.append(frame)
+    preview.stop_preview(process, preview_stop, logger)
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+    viewer.close()
+    assert len(frames) == 3
+    numbers = [number for _, number, _, _ in frames]
+    assert numbers == sorted(numbers)
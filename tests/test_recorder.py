@@ -0,0 +1,120 @@
+import logging
+import threading
+import time
+
+import recorder
+import telemetry_file
+
+
+SECOND = 1_000_000_000
+
+
+def read_records(session):
+    records = []
+    for path in sorted(session.glob("telemetry_*.tlm")):
+        reader = telemetry_file.TelemetryReader(str(path))
+        records += [
+            (timestamp / SECOND, reader.inputs[input_id], bytes(payload))
+            for timestamp, input_id, payload in reader
+        ]
+        reader.close()
+    return records
+
+
+def test_preroll_is_capped_by_age_and_bytes():
+    preroll = recorder.PreRoll(seconds=10, max_bytes=100_000)
+    for second in range(100):
+        preroll.append("overlay", second * SECOND, b"x" * 100)
+    # seconds 89 to 99
+    assert len(preroll.records) == 11
+    for second in range(100, 10_000):
+        preroll.append("overlay", 100 * SECOND, b"x" * 1000)
+    assert preroll.size <= 100_000
+    assert preroll.evicted > 0
+
+
+def test_start_flushes_preroll_into_new_session(tmp_path):
+    settings = {
+        "folder": str(tmp_path),
+        "preroll_seconds": 5,
+        "preroll_max_bytes": 1 << 20,
+        "chunk_bytes": 1024,
+    }
+    session_recorder = recorder.Recorder(
+        settings, ["overlay", "gyro"], logging.getLogger("test")
+    )
+    for second in range(10):
+        session_recorder.add(
+            "overlay", second * SECOND, memoryview(b"before")
+        )
+    session = session_recorder.start()
+    session_recorder.add("overlay", 10 * SECOND, b"after")
+    session_recorder.add("gyro", 10_500_000_000, b"gyro")
+    session_recorder.stop()
+    # dropped while stopped is fine, it goes in the next pre-roll
+    session_recorder.add("overlay", 11 * SECOND, b"idle")
+
+    records = read_records(session)
+    assert [t for t, _, _ in records] == [4, 5, 6, 7, 8, 9, 10, 10.5]
+    assert records[-2][2] == b"after"
+    assert records[-1][1:] == ("gyro", b"gyro")
+    assert len(session_recorder.preroll.records) == 1
+
+
+def test_restart_in_the_same_second_gets_a_new_session(tmp_path):
+    settings = {
+        "folder": str(tmp_path),
+        "preroll_seconds": 0,
+        "preroll_max_bytes": 0,
+        "chunk_bytes": 1024,
+    }
+    session_recorder = recorder.Recorder(
+        settings, ["overlay"], logging.getLogger("test")
+    )
+    sessions = []
+    for num in range(3):
+        sessions.append(session_recorder.start())
+        session_recorder.add("overlay", num * SECOND, b"%d" % num)
+        session_recorder.stop()
+    assert len(set(sessions)) == 3
+    for num, session in enumerate(sessions):
+        assert read_records(session) == [(num, "overlay", b"%d" % num)]
+    # a session's files are never opened over again
+    existing = next(sessions[0].glob("telemetry_*.tlm"))
+    try:
+        telemetry_file.TelemetryWriter(str(existing), ["overlay"], 1024)
+    except FileExistsError:
+        pass
+    else:
+        raise AssertionError("opened an existing telemetry file")
+    assert read_records(sessions[0]) == [(0, "overlay", b"0")]
+
+
+def test_add_goes_on_while_a_rotated_file_closes(tmp_path):
+    settings = {
+        "folder": str(tmp_path),
+        "preroll_seconds": 0,
+        "preroll_max_bytes": 0,
+        "chunk_bytes": 1024,
+    }
+    session_recorder = recorder.Recorder(
+        settings, ["overlay"], logging.getLogger("test")
+    )
+    session = session_recorder.start()
+    session_recorder.add("overlay", 0, b"first")
+    # the first file's disk is stuck, so closing it takes a while
+    release = threading.Event()
+    session_recorder.writer.file.call(release.wait)
+    rotating = threading.Thread(target=session_recorder.rotate)
+    rotating.start()
+    time.sleep(0.1)
+    assert rotating.is_alive()
+    session_recorder.add("overlay", SECOND, b"second")
+    release.set()
+    rotating.join(5)
+    session_recorder.stop()
+    assert read_records(session) == [
+        (0, "overlay", b"first"),
+        (1, "overlay", b"second"),
+    ]
+    assert session_recorder.dropped == 0
@@ -0,0 +1,91 @@
+import socket
+import time
+
+import replay
+import session_index
+import telemetry_file
+
+SECOND = 1_000_000_000
+MS = 1_000_000
+
+
+def write_session(folder, timestamps):
+    writer = telemetry_file.TelemetryWriter(
+        str(folder / "telemetry_2021-09-22_143200.tlm"),
+        ["overlay", "gyro", "controller"],
+        512,
+        SECOND // 10,
+    )
+    for timestamp in timestamps:
+        writer.write(timestamp, timestamp // MS % 3, f"{timestamp}".encode())
+    writer.close()
+
+
+def listeners(names):
+    socks, inputs = {}, []
+    for name in names:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.settimeout(1)
+        socks[name] = sock
+        inputs.append(
+            {"name": name, "ip": "127.0.0.1", "port": sock.getsockname()[1]}
+        )
+    return socks, {"inputs": inputs}
+
+
+def drain(sock):
+    got = []
+    sock.setblocking(False)
+    try:
+        while True:
+            got.append(int(sock.recv(64)))
+    except BlockingIOError:
+        pass
+    sock.setblocking(True)
+    return got
+
+
+def test_replay_keeps_order_and_pace_and_seeks(tmp_path):
+    # 300 records 1 ms apart, 2 seconds in, going round the three inputs
+    timestamps = [2 * SECOND + num * MS for num in range(300)]
+    write_session(tmp_path, timestamps)
+    socks, settings = listeners(["overlay", "gyro", "controller"])
+
+    # real time, the 0.3 s the records span
+    player = replay.Replay(str(tmp_path), settings, speed=1.0)
+    assert player.first == timestamps[0]
+    start = time.perf_counter()
+    sent = player.run()
+    elapsed = time.perf_counter() - start
+    # the controller's commands are left out
+    assert sent == 200
+    assert 0.29 < elapsed < 0.6
+    overlay = drain(socks["overlay"])
+    assert overlay == [t for t in timestamps if t // MS % 3 == 0]
+    assert len(drain(socks["gyro"])) == 100
+    assert drain(socks["controller"]) == []
+    report = player.report()
+    assert report["error_ns"]["count"] == 200
+    assert report["sent"] == 200 and report["failed"] == 0
+
+    # seek 0.2 s in, as fast as possible, only the overlay
+    player.close()
+    player = replay.Replay(str(tmp_path), settings, 0, ["overlay"])
+    player.seek(session_index.parse_time("0.2", player.first))
+    start = time.perf_counter()
+    assert player.run() == 33
+    assert time.perf_counter() - start < 0.2
+    assert drain(socks["overlay"])[0] == 2 * SECOND + 202 * MS
+    assert drain(socks["gyro"]) == []
+    # ten times faster, for 50 ms of the recording
+    player.close()
+    player = replay.Replay(str(tmp_path), settings, 10.0)
+    start = time.perf_counter()
+    assert player.run(duration=0.05) == 34
+    assert time.perf_counter() - start < 0.2
+    assert player.position == 2 * SECOND + 50 * MS + 1
+    player.close()
+    for sock in socks.values():
+        sock.close()
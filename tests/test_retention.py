@@ -0,0 +1,185 @@
+import datetime
+import gzip
+import os
+
+import retention
+import time_index
+
+SECOND = 1_000_000_000
+
+
+def log_lines(start, count):
+    """[debug log lines a second apart from start, every tenth followed by
+    a line without a time]"""
+    lines = []
+    for num in range(count):
+        when = start + datetime.timedelta(seconds=num)
+        stamp = f"{when:%Y-%m-%d %H:%M:%S},250"
+        lines.append(f"{num:7d},{stamp},[INFO], MSG:line {num}\n".encode())
+        if num % 10 == 9:
+            lines.append(b"Traceback (most recent call last):\n")
+    return lines
+
+
+def test_compressed_logs_are_searched_from_the_indexed_block(tmp_path):
+    start = datetime.datetime(2021, 9, 22, 14, 32, 0)
+    lines = log_lines(start, 200)
+    path = tmp_path / "debug_2021-09-22_143200.log"
+    path.write_bytes(b"".join(lines))
+
+    read, written = retention.compress(path, block_bytes=1000, rate_bytes=0)
+    assert not path.exists()
+    out = tmp_path / "debug_2021-09-22_143200.log.gz"
+    assert read == len(b"".join(lines)) and written == out.stat().st_size
+    # one .gz to anything that reads gzip
+    with gzip.open(out, "rb") as f:
+        assert f.read() == b"".join(lines)
+    index = time_index.read_index(f"{out}.idx")
+    assert len(index) > 10
+    assert index["timestamp"][0] == int(start.timestamp()) * SECOND + (
+        250_000_000
+    )
+    del index
+
+    base = int(start.timestamp()) * SECOND
+    found = list(
+        retention.search_file(out, base + 100 * SECOND, base + 110 * SECOND)
+    )
+    assert found[0].endswith(b"MSG:line 100\n")
+    # the traceback goes with the line before it
+    assert found[-1].startswith(b"Traceback") and len(found) == 11
+    # across the folder, an uncompressed newer file too
+    newer = tmp_path / "debug_2021-09-22_143520.log"
+    newer.write_bytes(
+        b"".join(log_lines(start + datetime.timedelta(seconds=200), 10))
+    )
+    found = list(
+        retention.search(
+            str(tmp_path),
+            "debug_*.log",
+            base + 198 * SECOND,
+            base + 201 * SECOND,
+        )
+    )
+    assert [line.split(b"MSG:")[-1] for line in found] == [
+        b"line 198\n",
+        b"line 199\n",
+        b"Traceback (most recent call last):\n",
+        b"line 0\n",
+    ]
+
+
+def test_sweep_compresses_closed_files_and_keeps_the_limits(tmp_path):
+    folder = tmp_path / "log"
+    folder.mkdir()
+    start = datetime.datetime(2021, 9, 22, 14, 32, 0)
+    paths = []
+    for num in range(4):
+        when = start + datetime.timedelta(seconds=20 * num)
+        path = folder / f"debug_{when:%Y-%m-%d_%H%M%S}.log"
+        path.write_bytes(b"".join(log_lines(when, 2000)))
+        paths.append(path)
+    now = start.timestamp() + 200
+    for path in paths:
+        os.utime(path, (now - 60, now - 60))
+    # the third was written a moment ago, the logger may not be done
+    os.utime(paths[2], (now - 1, now - 1))
+    settings = {
+        "rate_bytes": 0,
+        "folders": [
+            {"folder": str(folder), "pattern": "debug_*.log"},
+        ],
+    }
+    sweeper = retention.Retention(settings)
+    sweeper.sweep(now)
+    assert [path.exists() for path in paths] == [False, False, True, True]
+    assert sweeper.compressed == 2 and sweeper.removed == 0
+    assert sweeper.bytes_in > 5 * sweeper.bytes_out
+    compressed = [folder / f"{path.name}.gz" for path in paths[:2]]
+    assert all(path.exists() for path in compressed)
+
+    # the oldest goes once the folder is over its size
+    size = sum(
+        retention.Retention.size(path)
+        for path in retention.files_of(folder, "debug_*.log")
+    )
+    settings["folders"][0]["max_bytes"] = size - 1
+    sweeper = retention.Retention(settings)
+    sweeper.sweep(now)
+    assert not compressed[0].exists()
+    assert not (folder / f"{compressed[0].name}.idx").exists()
+    assert compressed[1].exists() and paths[2].exists()
+    assert sweeper.removed == 1
+
+    # and everything but the newest once it is too old
+    settings["folders"][0]["max_age_days"] = 1
+    sweeper = retention.Retention(settings)
+    sweeper.sweep(now + 2 * 86400)
+    assert [path.name for path in folder.iterdir()] == [paths[3].name]
+
+
+def test_whole_sessions_go_oldest_first_but_never_the_active_one(tmp_path):
+    folder = tmp_path / "recordings"
+    start = datetime.datetime(2021, 9, 22, 14, 32, 0)
+    sessions = []
+    for num in range(4):
+        when = start + datetime.timedelta(hours=num)
+        session = folder / f"session_{when:%Y-%m-%d_%H%M%S}123"
+        session.mkdir(parents=True)
+        (session / "camera1_0.avi").write_bytes(b"v" * 1000)
+        (session / "telemetry_0.tlm").write_bytes(b"t" * 500)
+        sessions.append(session)
+    now = start.timestamp() + 86400
+    for session in sessions:
+        for path in [session, *session.iterdir()]:
+            os.utime(path, (now - 3600, now - 3600))
+    # an old session something is still writing into
+    os.utime(sessions[1] / "camera1_0.avi", (now - 1, now - 1))
+    settings = {
+        "folders": [
+            {
+                "folder": str(folder),
+                "pattern": "session_*",
+                "directories": True,
+                "max_bytes": 2000,
+            },
+        ],
+    }
+    sweeper = retention.Retention(settings)
+    sweeper.sweep(now)
+    assert [session.exists() for session in sessions] == [
+        False,
+        True,
+        False,
+        True,
+    ]
+    assert sweeper.removed == 2 and sweeper.removed_bytes == 3000
+    assert sweeper.kept_bytes == 3000 and sweeper.compressed == 0
+
+    # the newest is the one being recorded, however old
+    sweeper = retention.Retention(
+        dict(settings, folders=[dict(settings["folders"][0], max_bytes=0)])
+    )
+    sweeper.sweep(now + 3600)
+    assert [path.name for path in folder.iterdir()] == [sessions[3].name]
+
+
+def test_parts_of_a_compression_cut_short_are_removed(tmp_path):
+    folder = tmp_path / "log"
+    folder.mkdir()
+    stale = [
+        folder / "debug_2021-09-22_143200.log.gz.part",
+        folder / "debug_2021-09-22_143200.log.gz.idx.part",
+    ]
+    growing = folder / "debug_2021-09-22_143300.log.gz.part"
+    for path in stale + [growing]:
+        path.write_bytes(b"x" * 100)
+    now = 1_700_000_000.0
+    for path in stale:
+        os.utime(path, (now - 60, now - 60))
+    os.utime(growing, (now, now))
+    settings = {"folders": [{"folder": str(folder), "pattern": "debug_*"}]}
+    sweeper = retention.Retention(settings)
+    sweeper.sweep(now)
+    assert not any(path.exists() for path in stale) and growing.exists()
+    assert sweeper.counters()["removed_parts"] == 2
@@ -0,0 +1,55 @@
+import session_index
+import telemetry_file
+import time_index
+
+SECOND = 1_000_000_000
+
+
+def write_segment(path, timestamps):
+    writer = telemetry_file.TelemetryWriter(
+        str(path), ["overlay", "gyro"], 512, SECOND // 10
+    )
+    for timestamp in timestamps:
+        writer.write(timestamp, timestamp % 2, f"at {timestamp}".encode())
+    writer.close()
+
+
+def test_lookups_seek_across_segments(tmp_path):
+    # two telemetry segments, 50 records a second for 4 seconds each
+    step = SECOND // 50
+    first = list(range(10 * SECOND, 14 * SECOND, step))
+    second = list(range(14 * SECOND, 18 * SECOND, step))
+    write_segment(tmp_path / "telemetry_2021-09-22_143200.tlm", first)
+    write_segment(tmp_path / "telemetry_2021-09-22_143204.tlm", second)
+    # a camera segment's index, 25 fps from 11 seconds with frame 3 missing
+    frames = [t for t in range(11 * SECOND, 15 * SECOND, SECOND // 25)]
+    del frames[3]
+    index = time_index.IndexWriter(
+        str(tmp_path / "camera1_2021-09-22_143200.avi.idx")
+    )
+    for number, timestamp in enumerate(frames):
+        index.add(timestamp, number)
+    index.close()
+
+    session = session_index.SessionIndex(str(tmp_path))
+    assert session.cameras == ["camera1"]
+
+    start, end = 13 * SECOND + 5, 14 * SECOND + SECOND // 2
+    records = session.telemetry(start, end)
+    expected = [t for t in first + second if start <= t <= end]
+    assert [record[0] for record in records] == expected
+    timestamp, name, payload = records[0]
+    assert name == ["overlay", "gyro"][timestamp % 2]
+    assert bytes(payload) == f"at {timestamp}".encode()
+    assert session.telemetry(0, 5 * SECOND) == []
+
+    path, number, timestamp = session.frame("camera1", frames[10] + 1)
+    assert path.name == "camera1_2021-09-22_143200.avi"
+    assert (number, timestamp) == (10, frames[10])
+    assert session.frame("camera1", 10 * SECOND) is None
+
+    moment = session.at(12 * SECOND, window=SECOND // 10)
+    assert len(moment["telemetry"]) == 6
+    assert moment["camera1"][1:] == (24, 12 * SECOND)
+    del records, payload, moment
+    session.close()
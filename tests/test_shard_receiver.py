@@ -0,0 +1,89 @@
+import logging
+import socket
+import time
+
+import ingest_benchmark
+import packet_ring
+import shard_receiver
+import shared_mailbox
+
+
+class ListRecorder:
+    def __init__(self):
+        self.records = []
+
+    def add(self, stream, timestamp, payload):
+        self.records.append((stream, timestamp, bytes(payload)))
+
+
+def test_shards_merge_in_timestamp_order():
+    probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    setting = {"name": "sonar", "ip": "127.0.0.1", "port": port, "shards": 2}
+    mailbox = shared_mailbox.Mailbox(1024, ns=True)
+    groups = shard_receiver.start_shards(
+        {"inputs": [setting]}, [mailbox], logging.getLogger("test_shards")
+    )
+    group = groups["sonar"]
+    ingest_benchmark.wait_bound([port])
+
+    # several source ports, so the kernel spreads them over the shards
+    senders = [
+        socket.socket(socket.AF_INET, socket.SOCK_DGRAM) for _ in range(8)
+    ]
+    for num in range(400):
+        senders[num % 8].sendto(num.to_bytes(4, "big"), ("127.0.0.1", port))
+        if num % 50 == 49:
+            time.sleep(0.01)
+    recorder = ListRecorder()
+    received = 0
+    deadline = time.time() + 5
+    while received < 400 and time.time() < deadline:
+        received += group.get_packets(recorder)
+        time.sleep(0.01)
+    assert group.dropped == 0
+    shard_receiver.stop_shards(groups, logging.getLogger("test_shards"))
+
+    assert received == 400
+    timestamps = [timestamp for _, timestamp, _ in recorder.records]
+    assert timestamps == sorted(timestamps)
+    payloads = {payload for _, _, payload in recorder.records}
+    assert payloads == {num.to_bytes(4, "big") for num in range(400)}
+    # the mailbox holds the newest packet of whichever shard saw it last
+    count, timestamp, payload, _ = mailbox.read()
+    assert count > 0 and timestamp == timestamps[-1]
+    for sender in senders:
+        sender.close()
+    mailbox.close()
+
+
+def test_records_newer_than_the_slowest_shard_wait_for_a_later_drain():
+    rings = [packet_ring.PacketRing(1 << 12) for _ in range(2)]
+
+    def drain():
+        out = [timestamp for timestamp, _, _ in shard_receiver.ordered(rings)]
+        for ring in rings:
+            ring.release()
+        return out
+
+    rings[0].write(b"a", 10)
+    rings[0].write(b"a", 30)
+    rings[0].mark(30)
+    rings[1].write(b"b", 15)
+    # the second shard has not marked anything, nothing can go yet
+    assert drain() == []
+    rings[1].mark(15)
+    assert drain() == [10, 15]
+    # 20 reaches its ring after 30 was in the other one
+    rings[1].write(b"b", 20)
+    rings[1].write(b"b", 40)
+    rings[1].mark(40)
+    assert drain() == [20, 30]
+    assert rings[1].backlog and not rings[0].backlog
+    rings[0].mark(50)
+    assert drain() == [40]
+    assert not any(ring.backlog for ring in rings)
+    for ring in rings:
+        ring.close()
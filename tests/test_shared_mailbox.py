@@ -0,0 +1,55 @@
+import multiprocessing
+
+import shared_mailbox
+
+
+def read_in_child(box, results):
+    results.put(box.read())
+    box.close()
+
+
+def test_read_reports_newest_and_missed_updates():
+    box = shared_mailbox.Mailbox(64)
+    reader = shared_mailbox.Mailbox(64, box.name, create=False)
+    assert reader.read() == (0, 0.0, b"", 0)
+
+    for num in range(5):
+        box.write(bytes([num]) * 8, float(num))
+    assert reader.read() == (5, 4.0, bytes([4]) * 8, 4)
+    # nothing new since the last read
+    assert reader.read() == (5, 4.0, bytes([4]) * 8, 0)
+
+    box.write(b"abc", 5.0)
+    out = bytearray(64)
+    assert reader.read_into(out) == (6, 5.0, 3, 0)
+    assert out[:3] == b"abc"
+    reader.close()
+    box.close()
+
+
+def test_read_from_another_process():
+    box = shared_mailbox.Mailbox(64)
+    box.write(b"first", 1.0)
+    box.write(b"second", 2.0)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    child = ctx.Process(target=read_in_child, args=(box, results))
+    child.start()
+    assert results.get(timeout=10) == (2, 2.0, b"second", 1)
+    child.join()
+    box.close()
+
+
+def test_ns_timestamps_are_kept_exact():
+    box = shared_mailbox.Mailbox(64, ns=True)
+    # past 2**53, a float of it in seconds is off by hundreds of ns
+    stamp = 1_792_331_547_123_456_789
+    box.write(b"gyro", stamp)
+    assert box.timestamp == stamp
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    child = ctx.Process(target=read_in_child, args=(box, results))
+    child.start()
+    assert results.get(timeout=10) == (1, stamp, b"gyro", 0)
+    child.join()
+    box.close()
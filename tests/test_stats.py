@@ -0,0 +1,81 @@
+import json
+import logging
+import queue
+import socket
+import time
+
+import numpy as np
+
+import io_connections
+import main
+import shared_mailbox
+import stats
+
+
+def test_histogram_percentiles_are_within_a_bucket():
+    values = np.random.default_rng(1).lognormal(10, 2, 100_000).astype(int)
+    histogram = stats.Histogram()
+    for chunk in np.array_split(values, 7):
+        histogram.record(chunk)
+    assert histogram.count == len(values)
+    assert histogram.max == values.max()
+    for percentile in stats.PERCENTILES:
+        exact = np.percentile(values, percentile, method="inverted_cdf")
+        got = histogram.percentile(percentile)
+        assert exact <= got <= exact * (1 + 2 / stats.SUB_COUNT) + 1
+
+
+def test_get_packets_counts_and_stats_are_served():
+    logger = logging.getLogger("test_stats")
+    logger.setLevel(logging.WARNING)
+    conn = io_connections.get_connections(
+        [{"name": "gyro", "ip": "127.0.0.1", "port": 0}], True, logger
+    )[0]
+    ingest_stats = stats.Stats()
+    conn.stats = ingest_stats.input("gyro")
+    mailboxes = [shared_mailbox.Mailbox(1024, ns=True)]
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(1)
+    for _ in range(50):
+        client.sendto(b"x" * 10, conn.sock.getsockname())
+    time.sleep(0.05)
+    assert main.get_packets(conn, logger, mailboxes, queue.SimpleQueue()) == 50
+
+    server = stats.StatsServer(ingest_stats, "127.0.0.1", 0)
+    client.sendto(b"stats", server.sock.getsockname())
+    time.sleep(0.05)
+    server.handle()
+    snapshot = json.loads(client.recv(65507))
+    gyro = snapshot["inputs"]["gyro"]
+    assert (gyro["packets"], gyro["bytes"], gyro["wakeups"]) == (50, 500, 1)
+    assert gyro["superseded"] == 49
+    assert gyro["batch_packets"]["max"] == 50
+    assert gyro["drain_ns"]["count"] == 1
+    assert gyro["decode_ns"]["count"] == 0
+    server.close()
+    client.close()
+    conn.sock.close()
+    mailboxes[0].close()
+
+
+def test_a_snapshot_too_big_for_a_datagram_is_cut_down():
+    ingest_stats = stats.Stats()
+    ingest_stats.input("gyro")
+    ingest_stats.add_source("small", lambda: {"value": 1})
+    ingest_stats.add_source("huge", lambda: {"blob": "x" * 100_000})
+    ingest_stats.add_source("after", lambda: {"value": 2})
+    server = stats.StatsServer(ingest_stats, "127.0.0.1", 0)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.settimeout(1)
+    client.sendto(b"stats", server.sock.getsockname())
+    time.sleep(0.05)
+    server.handle()
+    reply = client.recv(65535)
+    assert len(reply) <= stats.MAX_REPLY
+    snapshot = json.loads(reply)
+    assert snapshot["truncated"] == ["huge"]
+    assert snapshot["small"] == {"value": 1} and snapshot["after"]["value"]
+    assert "gyro" in snapshot["inputs"]
+    assert server.truncated == 1
+    server.close()
+    client.close()
@@ -0,0 +1,45 @@
+import telemetry_file
+
+
+def write_file(path, count: int, chunk_bytes: int = 256):
+    writer = telemetry_file.TelemetryWriter(
+        str(path), ["overlay", "controller"], chunk_bytes
+    )
+    for num in range(count):
+        writer.write(num * 1000, num % 2, f"packet {num}".encode())
+    writer.close()
+
+
+def test_reader_slices_records_without_copying(tmp_path):
+    path = tmp_path / "telemetry.tlm"
+    write_file(path, 100)
+
+    reader = telemetry_file.TelemetryReader(str(path))
+    assert reader.inputs == ["overlay", "controller"]
+    assert len(reader) == 100
+    timestamp, input_id, payload = reader[51]
+    assert (timestamp, input_id, bytes(payload)) == (51_000, 1, b"packet 51")
+    assert isinstance(payload, memoryview)
+    assert [bytes(p) for _, _, p in reader[98:]] == [b"packet 98", b"packet 99"]
+    del payload
+    reader.close()
+
+
+def test_reader_skips_damage_and_a_cut_short_end(tmp_path):
+    path = tmp_path / "telemetry.tlm"
+    write_file(path, 100)
+    data = bytearray(path.read_bytes())
+    # wreck the length of record 10, then cut the last record in half
+    first = data.index(b"packet 10") - telemetry_file.RECORD.size
+    data[first : first + 4] = b"\xff\xff\xff\x7f"
+    path.write_bytes(bytes(data[:-4]))
+
+    reader = telemetry_file.TelemetryReader(str(path))
+    payloads = [bytes(p) for _, _, p in reader]
+    reader.close()
+    assert reader.damaged == 1
+    assert b"packet 10" not in payloads
+    assert payloads[:10] == [f"packet {n}".encode() for n in range(10)]
+    # reading picks up again at the next chunk
+    assert payloads[-1] == b"packet 98"
+    assert len(payloads) > 80
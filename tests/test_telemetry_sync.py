@@ -0,0 +1,99 @@
+import json
+import logging
+from pathlib import Path
+
+import numpy as np
+
+import overlay_decoder
+import telemetry_file
+import telemetry_sync
+import time_index
+
+CONFIG = Path(__file__).resolve().parents[1] / "dvr2" / "config.json"
+SECOND = 1_000_000_000
+STEP = SECOND // 10
+
+
+def overlay_settings():
+    with open(CONFIG, "r") as f:
+        return json.load(f)["overlay"]
+
+
+def packet(num: int) -> bytes:
+    values = ",".join(f"{num + i:.1f}" for i in range(8))
+    return f"2021-09-22 14:32:{num % 60:02d},{values},TASK {num}".encode()
+
+
+def test_live_lookups_follow_each_camera_with_a_cursor():
+    decoder = overlay_decoder.OverlayDecoder(
+        overlay_settings(), logging.getLogger("test_telemetry_sync")
+    )
+    # 10 Hz telemetry for 10 seconds, channel1 counts the samples
+    for num in range(100):
+        decoder.add(packet(num), 10 * SECOND + num * STEP)
+    decoder.flush()
+
+    nearest = telemetry_sync.TelemetrySync(decoder)
+    blended = telemetry_sync.TelemetrySync(decoder, telemetry_sync.INTERPOLATE)
+    frames = np.arange(10 * SECOND, 19 * SECOND, SECOND // 30)
+    for camera in ("camera1", "camera2"):
+        for frame in frames:
+            sample = nearest.sample(camera, int(frame))
+            position = (frame - 10 * SECOND) / STEP
+            assert sample["channel1"] == round(position)
+            sample = blended.sample(camera, int(frame))
+            assert abs(sample["channel1"] - position) < 1e-9
+            assert sample["received"] == frame
+            assert decoder.text(sample["task"]) == f"TASK {round(position)}"
+    # both cameras kept up, neither had to search
+    assert nearest.searches == blended.searches == 0
+
+    samples, valid = blended.samples("camera3", frames)
+    assert valid.all()
+    assert np.allclose(samples["channel1"], (frames - 10 * SECOND) / STEP)
+    # an old frame is searched for, one long after the telemetry has none
+    assert nearest.sample("camera1", 10 * SECOND)["channel1"] == 0
+    assert nearest.searches == 1
+    assert nearest.sample("camera1", 30 * SECOND) is None
+
+
+def test_session_frames_are_matched_in_one_batch(tmp_path):
+    settings = overlay_settings()
+    writer = telemetry_file.TelemetryWriter(
+        str(tmp_path / "telemetry_2021-09-22_143200.tlm"),
+        ["overlay", "gyro"],
+        512,
+    )
+    for num in range(50):
+        writer.write(10 * SECOND + num * STEP, 0, packet(num))
+        writer.write(10 * SECOND + num * STEP + 1, 1, b"gyro")
+    writer.close()
+    # 25 fps from 9 seconds, before the telemetry starts, to 16 seconds
+    frames = list(range(9 * SECOND, 16 * SECOND, SECOND // 25))
+    index = time_index.IndexWriter(
+        str(tmp_path / "camera1_2021-09-22_143200.avi.idx")
+    )
+    for number, timestamp in enumerate(frames):
+        index.add(timestamp, number)
+    index.close()
+
+    sync = telemetry_sync.SessionSync(
+        str(tmp_path),
+        settings,
+        logging.getLogger("test_telemetry_sync"),
+        telemetry_sync.INTERPOLATE,
+        max_gap=SECOND // 2,
+    )
+    assert len(sync.records) == 50
+    entries, samples, valid = sync.align("camera1")
+    assert list(entries["position"]) == list(range(len(frames)))
+    times = np.array(frames)
+    # half a second either side of the telemetry is still close enough
+    near = (times >= 9.5 * SECOND) & (times <= 15.4 * SECOND)
+    assert (valid == near).all()
+    inside = (times >= 10 * SECOND) & (times <= 14.9 * SECOND)
+    assert np.allclose(
+        samples["channel1"][inside], (times[inside] - 10 * SECOND) / STEP
+    )
+    assert (samples["channel1"][~valid] == 0).all()
+    sync.close()
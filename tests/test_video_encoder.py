@@ -0,0 +1,252 @@
+from concurrent.futures import Future
+import logging
+from pathlib import Path
+import pickle
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import camera_capture
+import frame_ring
+import motion_gate
+import shared_mailbox
+import time_index
+import video_encoder
+
+
+def test_segments_are_contiguous_across_rotation(tmp_path):
+    logger = logging.getLogger("test_video_encoder")
+    settings = {
+        "cameras": [
+            {
+                "name": "camera1",
+                "driver": "synthetic",
+                "width": 160,
+                "height": 120,
+                "fps": 50,
+                "ring_slots": 16,
+            }
+        ],
+        "video": {"fourcc": "MJPG", "ext": "avi"},
+    }
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    encoder = video_encoder.SegmentEncoder(settings, rings, logger)
+    while rings[0].count < 5:
+        time.sleep(0.01)
+
+    encoder.start(tmp_path, time.time() - 10)
+    time.sleep(1.1)
+    encoder.rotate()
+    time.sleep(1.1)
+    encoder.close()
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+
+    first, second = sorted(encoder.results, key=lambda result: result[1])
+    # the first segment starts with frames from before start was called
+    assert first[1] == 0
+    assert second[1] == first[2] + 1
+    for path, start, end, written, dropped, shed, costs in (first, second):
+        assert dropped == shed == costs["gated"] == 0
+        assert written == end - start + 1
+        video = cv2.VideoCapture(path)
+        assert video.get(cv2.CAP_PROP_FRAME_COUNT) == written
+        video.release()
+        index = time_index.read_index(f"{path}.idx")
+        assert list(index["position"]) == list(range(written))
+
+
+def test_preroll_is_kept_past_what_the_ring_holds(tmp_path):
+    logger = logging.getLogger("test_video_encoder")
+    settings = {
+        "cameras": [
+            {
+                "name": "camera1",
+                "driver": "synthetic",
+                "width": 160,
+                "height": 120,
+                "fps": 25,
+                "ring_slots": 4,
+            }
+        ],
+        "video": {"fourcc": "MJPG", "ext": "avi"},
+        "recording": {"preroll_seconds": 1.0},
+    }
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    encoder = video_encoder.SegmentEncoder(settings, rings, logger)
+    # the ring holds 0.16 s
+    time.sleep(2.0)
+    started = time.time()
+    encoder.start(tmp_path, started - 1.0)
+    time.sleep(0.5)
+    encoder.close()
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+
+    (path, written, dropped, evicted), = encoder.prerolls
+    assert evicted == 0
+    (segment,) = encoder.results
+    times = time_index.read_index(f"{path}.idx")["timestamp"] / 1e9
+    assert times[-1] < started <= times[-1] + 0.1
+    assert times[-1] - times[0] > 0.8 and written == len(times)
+    video = cv2.VideoCapture(path)
+    assert video.get(cv2.CAP_PROP_FRAME_COUNT) == written
+    video.release()
+    # the first segment carries on from the pre-roll
+    first = time_index.read_index(f"{segment[0]}.idx")["timestamp"][0]
+    assert started <= first / 1e9 < started + 0.1
+    assert sorted(p.name for p in tmp_path.glob("*.avi")) == sorted(
+        [Path(path).name, Path(segment[0]).name]
+    )
+
+
+def test_the_motion_gate_runs_on_across_segments(tmp_path):
+    logger = logging.getLogger("test_video_encoder")
+    settings = {
+        "cameras": [
+            {
+                "name": "camera1",
+                "driver": "synthetic",
+                "width": 160,
+                "height": 120,
+                "fps": 25,
+                "ring_slots": 16,
+                # the scrolling gradient counts as still
+                "motion": {
+                    "start": 0.5,
+                    "stop": 0.05,
+                    "hold_seconds": 0.2,
+                    "still_interval": 0,
+                },
+            }
+        ],
+        "video": {"fourcc": "MJPG", "ext": "avi"},
+    }
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    encoder = video_encoder.SegmentEncoder(settings, rings, logger)
+    while rings[0].count < 5:
+        time.sleep(0.01)
+
+    encoder.start(tmp_path, time.time())
+    time.sleep(1.0)
+    encoder.rotate()
+    time.sleep(1.0)
+    encoder.close()
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+
+    first, second = sorted(encoder.results, key=lambda result: result[0])
+    # the hold at the start of the first segment only, the second carries
+    # on still rather than starting out moving
+    assert 0 < first[3] <= 10
+    assert second[3] == 0 and second[6]["gated"] > 15
+
+
+def test_the_preroll_is_capped_in_bytes(tmp_path):
+    camera = {
+        "name": "camera1",
+        "width": 160,
+        "height": 120,
+        "fps": 25,
+        "ring_slots": 32,
+    }
+    ring = frame_ring.FrameRing(32, camera_capture.frame_shape(camera))
+    rng = np.random.default_rng(3)
+    now = time.time()
+    for number in range(30):
+        # noise, so every jpeg is about the same size
+        ring.begin()[...] = rng.integers(0, 256, (120, 160, 3), np.uint8)
+        ring.commit(now - 1.2 + number * 0.04)
+    boundary = shared_mailbox.Mailbox(video_encoder.BOUNDARY_BYTES)
+    boundary.write(str(tmp_path).encode(), now)
+    jpeg = cv2.imencode(
+        ".jpg",
+        ring.get(0)[1],
+        [cv2.IMWRITE_JPEG_QUALITY, video_encoder.PREROLL_QUALITY],
+    )[1]
+    path, written, dropped, evicted = video_encoder.keep_preroll(
+        camera,
+        ring,
+        boundary,
+        0.0,
+        10.0,
+        {"fourcc": "MJPG", "ext": "avi"},
+        max_bytes=int(10.5 * len(jpeg)),
+    )
+    # the newest frames that fit, the oldest thrown away for them
+    assert written + evicted == 30 and dropped == 0
+    assert 8 <= written <= 11
+    times = time_index.read_index(f"{path}.idx")["timestamp"] / 1e9
+    assert abs(times[-1] - (now - 1.2 + 29 * 0.04)) < 1e-3
+    assert len(times) == written
+
+
+def test_only_the_latest_sessions_are_totalled(tmp_path):
+    settings = {"cameras": [], "video": {"fourcc": "MJPG", "ext": "avi"}}
+    encoder = video_encoder.SegmentEncoder(
+        settings, [], logging.getLogger("test_video_encoder")
+    )
+    costs = {"gated": 0, "encode_ns": 1, "gate_ns": 0, "bytes": 10}
+    for num in range(video_encoder.SESSIONS_KEPT + 5):
+        job = Future()
+        path = str(tmp_path / f"session_{num:03d}" / "camera1.avi")
+        job.set_result((path, 0, 9, 10, 0, 0, costs))
+        encoder.finished(job)
+    sessions = list(encoder.counters())
+    assert len(sessions) == video_encoder.SESSIONS_KEPT
+    assert sessions[0] == "session_005" and sessions[-1].endswith("020")
+    encoder.close()
+
+
+def test_a_late_gate_handoff_is_not_waited_for_past_the_ring(tmp_path):
+    logger = logging.getLogger("test_video_encoder")
+    settings = {
+        "cameras": [
+            {
+                "name": "camera1",
+                "driver": "synthetic",
+                "width": 160,
+                "height": 120,
+                "fps": 25,
+                "ring_slots": 16,
+                "motion": {"hold_seconds": 0.2, "still_interval": 0},
+            }
+        ],
+        "video": {"fourcc": "MJPG", "ext": "avi"},
+    }
+    camera = settings["cameras"][0]
+    rings, processes, stop = camera_capture.start_cameras(settings, logger)
+    boundary = shared_mailbox.Mailbox(video_encoder.BOUNDARY_BYTES)
+    gate = motion_gate.MotionGate(camera["motion"], (120, 160, 3))
+    # the segment before never hands its gate over
+    handoff = shared_mailbox.Mailbox(len(gate.state()))
+    start = time.time()
+    results = []
+    job = threading.Thread(
+        target=lambda: results.append(
+            video_encoder.encode_segment(
+                camera,
+                pickle.loads(pickle.dumps(rings[0])),
+                pickle.loads(pickle.dumps(boundary)),
+                str(tmp_path / "camera1.avi"),
+                start,
+                settings["video"],
+                None,
+                pickle.loads(pickle.dumps(handoff)),
+                True,
+            )
+        )
+    )
+    job.start()
+    time.sleep(1.5)
+    boundary.write(b"", time.time())
+    job.join(5)
+    camera_capture.stop_cameras(rings, processes, stop, logger)
+    boundary.close()
+    handoff.close()
+
+    (_, first, last, written, dropped, _, costs), = results
+    # the ring holds 0.64 s, the old 2 s wait lost the frames before it
+    assert costs["handoff_missed"] == 1
+    assert dropped == 0
+    index = time_index.read_index(str(tmp_path / "camera1.avi.idx"))
+    assert index["timestamp"][0] / 1e9 - start < 0.1